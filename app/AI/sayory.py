@@ -1,42 +1,159 @@
+from typing import AsyncIterator, Optional, Sequence
+from uuid import UUID
 
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from openai import AsyncOpenAI
+from app.cache.cache import MISSING, sayory_responses
+from app.functions.func_private import fetch_last_private_messages
+from app.metrics.metrics import GPT_SECONDS
 from app.settings.config import settings
 
 sayori_key=settings.openai_api_key
 
-client = AsyncOpenAI(
-    api_key=sayori_key
-)
+_client = None
+
+
+def get_client():
+    """
+    The AsyncOpenAI client, created on first use so `openai` is not imported at startup.
+    """
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI(
+            api_key=sayori_key,
+            base_url=settings.openai_base_url
+        )
+    return _client
 
 instruction = "Ти асистент в мессінджері, твоє ім'я Sayory, відповідь не повинна перевищувати 600 символів."
 
-async def ask_to_gpt(ask_to_chat: str) -> list:
+# Sampling parameters shared by ask_to_gpt and stream_gpt
+completion_params = dict(
+    model="gpt-4o-mini",
+    temperature=1,
+    max_tokens=256,
+    top_p=1,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+    n=1
+)
+
+
+def build_messages(ask_to_chat: str, context: Sequence[dict] = ()) -> list:
+    return [
+        {
+        "role": "system",
+        "content": [
+            {
+            "type": "text",
+            "text": instruction
+            }
+        ]
+        },
+        *context,
+        {
+            "role": "user",
+            "content": ask_to_chat,
+        }
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting: about four characters per token plus
+    the per-message overhead of the chat format.
+    """
+    return len(text) // 4 + 4
+
+
+async def build_context(user_id: UUID, sayory_id: UUID, ask_to_chat: str, session: AsyncSession,
+                        budget: Optional[int] = None) -> list:
+    """
+    The most recent turns of the user's conversation with Sayory, oldest first,
+    that fit in `budget` tokens (`settings.sayory_context_tokens` by default).
+
+    History comes from `fetch_last_private_messages`, so bodies decrypted for
+    the socket are reused from `decrypted_messages`. The question being
+    answered is already stored as the newest message and is left out.
+    """
+    budget = budget if budget is not None else settings.sayory_context_tokens
+    history = await fetch_last_private_messages(sayory_id, user_id, session,
+                                                limit=settings.sayory_context_messages)
+    # ChatMessagesSchema.receiver_id carries the sender
+    if history and history[-1].receiver_id == user_id and history[-1].message == ask_to_chat:
+        history = history[:-1]
+
+    context = []
+    for message in reversed(history):
+        if not message.message or message.deleted:
+            continue
+        cost = estimate_tokens(message.message)
+        if cost > budget:
+            break
+        budget -= cost
+        role = "assistant" if message.receiver_id == sayory_id else "user"
+        context.append({"role": role, "content": message.message})
+    context.reverse()
+    return context
+
+
+def response_key(ask_to_chat: str) -> str:
+    """
+    Cache key of an answer: the prompt with case, spacing and trailing
+    punctuation normalized.
+    """
+    return " ".join(ask_to_chat.casefold().split()).strip(" .!?")
+
+
+def cached_answer(ask_to_chat: str, context: Sequence[dict] = ()) -> Optional[str]:
+    """
+    The cached answer to a question asked without earlier turns.
+
+    An answer given in a conversation depends on all of it, and the history
+    changes every turn, so questions with a `context` are always sent to the model.
+    """
+    if context:
+        return None
+    answer = sayory_responses.get(response_key(ask_to_chat))
+    return None if answer is MISSING else answer
+
+
+def remember_answer(ask_to_chat: str, context: Sequence[dict], answer: str):
+    if answer and not context:
+        sayory_responses.set(response_key(ask_to_chat), answer)
+
+
+async def stream_gpt(ask_to_chat: str, client=None, context: Sequence[dict] = ()) -> AsyncIterator[str]:
+    """
+    Yield the text deltas of Sayory's answer as the model produces them.
+
+    Args:
+        ask_to_chat (str): The user's message.
+        client: An AsyncOpenAI client, `get_client()` by default.
+        context (list): Earlier turns from `build_context`.
+    """
+    stream = await (client or get_client()).chat.completions.create(
+        messages=build_messages(ask_to_chat, context),
+        stream=True,
+        **completion_params
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def ask_to_gpt(ask_to_chat: str, context: Sequence[dict] = ()) -> list:
+    cached = cached_answer(ask_to_chat, context)
+    if cached is not None:
+        return [cached]
     try:
-        chat_completion = await client.chat.completions.create(
-            messages=[
-                {
-                "role": "system",
-                "content": [
-                    {
-                    "type": "text",
-                    "text": instruction
-                    }
-                ]
-                },
-                {
-                    "role": "user",
-                    "content": ask_to_chat,
-                }
-            ],
-            model="gpt-4o-mini",
-            temperature=1,
-            max_tokens=256,
-            top_p=1,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            n=1
-        )
+        with GPT_SECONDS.labels(stage='complete').time():
+            chat_completion = await get_client().chat.completions.create(
+                messages=build_messages(ask_to_chat, context),
+                **completion_params
+            )
         response_1 = chat_completion.choices[0].model_dump()
         response_1 = response_1["message"]["content"]
         # response_2 = chat_completion.choices[1].model_dump()
@@ -44,6 +161,7 @@ async def ask_to_gpt(ask_to_chat: str) -> list:
     
         # response =  [response_1, response_2]
 
+        remember_answer(ask_to_chat, context, response_1)
         return [response_1]
     
     except Exception as e:
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+from uuid import UUID
+
+from _log_config.log_config import get_logger
+from app.AI.sayory import build_context, cached_answer, remember_answer, stream_gpt
+from app.database.database import async_session_maker
+from app.metrics.metrics import GPT_SECONDS
+from app.settings.config import settings
+
+logger = get_logger('sayory_worker', 'sayory_worker.log')
+
+SAYORY_NAME = "SayOry"
+SAYORY_AVATAR = "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/girl_5.webp"
+
+
+@dataclass
+class SayoryJob:
+    user_id: UUID
+    sayory_id: UUID
+    prompt: str
+    id_return: Optional[UUID]
+
+
+class SayoryWorker:
+    """
+    Pool of background tasks answering messages sent to the Sayory bot.
+
+    The socket handler only queues the question with `submit` and goes back
+    to its receive loop. A worker streams the answer from the model to the
+    user's sockets as a `typing` frame followed by `delta` frames, then
+    persists the complete answer once through `send_private_all`, which
+    delivers it as a regular message.
+
+    The model sees a token-budgeted window of the conversation. A question
+    asked without earlier turns whose normalized text was answered before is
+    sent the cached answer as a single delta without calling the model.
+
+    At most `workers` completions run at once, and each user may submit
+    `rate_limit` questions per `rate_window` seconds.
+    """
+
+    def __init__(self, manager, workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 rate_limit: Optional[int] = None, rate_window: Optional[float] = None, client=None):
+        self.manager = manager
+        self.workers = workers or settings.sayory_workers
+        self.rate_limit = rate_limit or settings.sayory_rate_limit
+        self.rate_window = rate_window or settings.sayory_rate_window
+        self.client = client
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or settings.sayory_queue_size)
+        # user id -> monotonic times of the user's questions inside the current window
+        self.recent: Dict[UUID, Deque[float]] = {}
+        self._pruned_at = time.monotonic()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def allow(self, user_id: UUID) -> bool:
+        """
+        Record a question from `user_id` unless it is over its rate limit.
+        """
+        now = time.monotonic()
+        if now - self._pruned_at > self.rate_window:
+            # Forget users whose questions have all left the window
+            self.recent = {key: times for key, times in self.recent.items()
+                           if times and times[-1] > now - self.rate_window}
+            self._pruned_at = now
+        recent = self.recent.setdefault(user_id, deque())
+        while recent and recent[0] <= now - self.rate_window:
+            recent.popleft()
+        if len(recent) >= self.rate_limit:
+            return False
+        recent.append(now)
+        return True
+
+    def submit(self, user_id: UUID, sayory_id: UUID, prompt: str, id_return: Optional[UUID] = None) -> bool:
+        """
+        Queue a question for Sayory without waiting for the answer.
+
+        Returns:
+            bool: False if the user is rate limited or the queue is full.
+        """
+        self.start()
+        if not self.allow(user_id):
+            return False
+        try:
+            self.queue.put_nowait(SayoryJob(user_id, sayory_id, prompt, id_return))
+        except asyncio.QueueFull:
+            logger.error(f"Sayory queue is full, dropping question from {user_id}")
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.answer(job)
+            except Exception as e:
+                logger.error(f"Error processing GPT query: {e}", exc_info=True)
+                await self._send(job, {"notice": f"Error processing GPT query: {e}"})
+            finally:
+                self.queue.task_done()
+
+    async def answer(self, job: SayoryJob):
+        id_return = str(job.id_return) if job.id_return else None
+        await self._send(job, {"typing": {"user_id": str(job.sayory_id), "id_return": id_return}})
+
+        context = await self.load_context(job)
+        answer = cached_answer(job.prompt, context)
+        if answer is not None:
+            await self._send(job, {"delta": {"user_id": str(job.sayory_id), "id_return": id_return,
+                                             "text": answer}})
+        else:
+            parts = []
+            started = time.perf_counter()
+            async for delta in stream_gpt(job.prompt, self.client, context):
+                if not parts:
+                    GPT_SECONDS.labels(stage='first_token').observe(time.perf_counter() - started)
+                parts.append(delta)
+                await self._send(job, {"delta": {"user_id": str(job.sayory_id), "id_return": id_return,
+                                                 "text": delta}})
+            GPT_SECONDS.labels(stage='complete').observe(time.perf_counter() - started)
+            answer = "".join(parts)
+            remember_answer(job.prompt, context, answer)
+
+        await self.manager.send_private_all(
+            message=answer,
+            fileUrl=None,
+            voiceUrl=None,
+            videoUrl=None,
+            receiver_id=job.user_id,
+            sender_id=job.sayory_id,
+            user_name=SAYORY_NAME,
+            avatar=SAYORY_AVATAR,
+            verified=True,
+            id_return=job.id_return,
+            is_read=True
+        )
+
+    async def load_context(self, job: SayoryJob) -> list:
+        async with async_session_maker() as session:
+            return await build_context(job.user_id, job.sayory_id, job.prompt, session)
+
+    async def _send(self, job: SayoryJob, frame: dict):
+        await self.manager.send_to(job.user_id, job.sayory_id, json.dumps(frame))
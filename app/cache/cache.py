@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from app.metrics.metrics import (CACHE_EVICTIONS, CACHE_EXPIRATIONS, CACHE_HITS, CACHE_MAXSIZE, CACHE_MISSES,
+                                 CACHE_SIZE)
+from app.settings.config import settings
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    In-process LRU cache with a per-entry time to live.
+
+    At most `maxsize` entries are kept: inserting beyond that evicts the least
+    recently used one. Entries older than `ttl` seconds are dropped on access.
+    Hit, miss, eviction and expiration counters are kept for sizing; a named
+    cache also exports them, with its size, on /metrics labelled by `name`.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Prometheus children of a named cache, None otherwise
+        self._hit_counter = self._miss_counter = self._eviction_counter = self._expiration_counter = None
+        if name is not None:
+            self._hit_counter = CACHE_HITS.labels(cache=name)
+            self._miss_counter = CACHE_MISSES.labels(cache=name)
+            self._eviction_counter = CACHE_EVICTIONS.labels(cache=name)
+            self._expiration_counter = CACHE_EXPIRATIONS.labels(cache=name)
+            CACHE_SIZE.labels(cache=name).set_function(lambda: len(self._data))
+            CACHE_MAXSIZE.labels(cache=name).set(maxsize)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        Return the cached value, or `default` (the `MISSING` sentinel unless given).
+
+        Cached values may legitimately be None, so misses are told apart by the sentinel.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            if self._miss_counter is not None:
+                self._miss_counter.inc()
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            if self._miss_counter is not None:
+                self._expiration_counter.inc()
+                self._miss_counter.inc()
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        if self._hit_counter is not None:
+            self._hit_counter.inc()
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            if self._eviction_counter is not None:
+                self._eviction_counter.inc()
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Decrypted message bodies keyed by message id and ciphertext digest, see app.functions.func_private.body_key
+decrypted_messages = TTLCache(settings.message_cache_size, settings.message_cache_ttl,
+                              name='decrypted_messages')
+
+# Sayory answers to questions without context, keyed by normalized prompt, see app.AI.sayory.response_key
+sayory_responses = TTLCache(settings.sayory_cache_size, settings.sayory_cache_ttl,
+                            name='sayory_responses')
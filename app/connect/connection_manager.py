@@ -1,14 +1,26 @@
+import asyncio
+import time
+from functools import partial
 from uuid import UUID
 from datetime import datetime
-import pytz
 from _log_config.log_config import get_logger
 from fastapi import WebSocket
 from app.database.database import async_session_maker
+from app.database.ids import conversation_key, uuid7
+from app.database.message_writer import message_writer
 from app.models import models
-from app.schemas import schemas
-from sqlalchemy import insert, update
-from typing import Dict, Optional, Tuple
+from app.schemas import frames, schemas
+from sqlalchemy import insert
+from typing import Dict, Optional, Set, Tuple
 from app.security.crypto_messages import async_encrypt
+from app.settings.config import settings
+from app.connect.read_receipts import ReadReceiptBatcher
+from app.connect.fanout import FanoutBackend, create_fanout_backend
+from app.connect.outbound import OutboundQueue, tag_frame
+from app.connect.presence import PresenceTracker
+from app.functions.func_changes import INSERT, record_changes
+from app.functions.func_conversations import upsert_conversation_summaries
+from app.metrics.metrics import DB_MESSAGE_INSERT, SEND_PRIVATE_ALL, WS_ACTIVE_CONNECTIONS
 
 # Налаштування логування
 logger = get_logger('connect_manager', 'connect_manager.log')
@@ -18,15 +30,167 @@ logger = get_logger('connect_manager', 'connect_manager.log')
 
        # Connecting Private Messages     
 class ConnectionManagerPrivate:
-    def __init__(self):
-        self.active_connections: Dict[Tuple[UUID, UUID], WebSocket] = {}
+    """
+    Registry of the private-chat sockets held by this process.
 
-    async def connect(self, websocket: WebSocket, user_id: UUID, recipient_id: UUID):
+    Frames are not written to sockets directly: they are published on the
+    recipient user's channel of the fan-out backend, and the manager holding
+    that user's socket, in this or another worker, queues them on the
+    socket's `OutboundQueue`, whose writer task does the actual send.
+    """
+
+    def __init__(self, backend: Optional[FanoutBackend] = None):
+        # Conversation (user id, peer id) -> outbound queues of that user's devices on it
+        self.active_connections: Dict[Tuple[UUID, UUID], Set[OutboundQueue]] = {}
+        # Presence: user id -> outbound queues of all that user's open sockets in this process
+        self.presence: Dict[UUID, Set[OutboundQueue]] = {}
+        self.read_receipts = ReadReceiptBatcher(self)
+        self.backend = backend or create_fanout_backend()
+        # Open conversations published for the other workers, when there are any
+        self.conversation_presence = PresenceTracker(self)
+        self.backend.bind(self._deliver)
+        self._started = False
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._start_lock:
+            if self._started:
+                return
+            await self.backend.start()
+            self.read_receipts.start()
+            if self.backend.shared:
+                self.conversation_presence.start()
+            self._started = True
+
+    async def stop(self):
+        for queues in list(self.presence.values()):
+            for outbound in list(queues):
+                await outbound.close()
+        await message_writer.close()
+        await self.read_receipts.stop()
+        await self.conversation_presence.stop()
+        await self.backend.stop()
+        self._started = False
+
+    async def connect(self, websocket: WebSocket, user_id: UUID, recipient_id: Optional[UUID] = None,
+                      multiplexed: bool = False) -> OutboundQueue:
+        """
+        Accept `websocket` for `user_id`, subscribed to the conversation with
+        `recipient_id` when given.
+
+        Every device of a user gets its own registration: a second socket on
+        the same conversation is added next to the first, not in its place. A
+        `multiplexed` socket subscribes to conversations later with `subscribe`
+        and gets every frame tagged with its conversation id.
+
+        Returns:
+            OutboundQueue: The socket's outbound queue. The connection's own
+            handler writes through it and passes it back to `disconnect`.
+        """
+        await self.start()
         await websocket.accept()
-        self.active_connections[(user_id, recipient_id)] = websocket
 
-    async def disconnect(self, user_id: UUID, recipient_id: UUID):
-        self.active_connections.pop((user_id, recipient_id), None)
+        async def evicted(queue: OutboundQueue):
+            await self.disconnect(user_id, queue)
+
+        outbound = OutboundQueue(websocket, on_evict=evicted, multiplexed=multiplexed)
+        outbound.start()
+        queues = self.presence.setdefault(user_id, set())
+        queues.add(outbound)
+        WS_ACTIVE_CONNECTIONS.inc()
+        if len(queues) == 1:
+            await self.backend.subscribe(user_id)
+        if recipient_id is not None:
+            self.subscribe(user_id, recipient_id, outbound)
+        return outbound
+
+    def subscribe(self, user_id: UUID, recipient_id: UUID, outbound: OutboundQueue):
+        """
+        Deliver the frames of `user_id`'s conversation with `recipient_id` to `outbound`.
+        """
+        conversation = self.active_connections.setdefault((user_id, recipient_id), set())
+        if not conversation:
+            self.conversation_presence.changed()
+        conversation.add(outbound)
+        outbound.conversations.add(recipient_id)
+
+    def unsubscribe(self, user_id: UUID, recipient_id: UUID, outbound: OutboundQueue):
+        outbound.conversations.discard(recipient_id)
+        conversation = self.active_connections.get((user_id, recipient_id))
+        if conversation is not None:
+            conversation.discard(outbound)
+            if not conversation:
+                del self.active_connections[(user_id, recipient_id)]
+                self.conversation_presence.changed()
+
+    async def disconnect(self, user_id: UUID, outbound: OutboundQueue):
+        """
+        Unregister one socket from all its conversations. Safe to call more
+        than once for the same socket.
+        """
+        await outbound.close()
+        for recipient_id in list(outbound.conversations):
+            self.unsubscribe(user_id, recipient_id, outbound)
+        queues = self.presence.get(user_id)
+        if queues is None or outbound not in queues:
+            return
+        queues.discard(outbound)
+        WS_ACTIVE_CONNECTIONS.dec()
+        if not queues:
+            del self.presence[user_id]
+            await self.backend.unsubscribe(user_id)
+
+    def is_online(self, user_id: UUID, recipient_id: Optional[UUID] = None) -> bool:
+        """
+        Whether `user_id` has a socket open in this process, on the conversation
+        with `recipient_id` when given.
+
+        Presence is per process: a user connected to another worker reads as
+        offline here. Pushes are checked against every worker's conversations
+        in `conversation_presence` before they are sent.
+        """
+        if recipient_id is not None:
+            return (user_id, recipient_id) in self.active_connections
+        return user_id in self.presence
+
+    async def send_to(self, user_id: UUID, recipient_id: UUID, message_json: str,
+                      delivered_at: Optional[datetime] = None):
+        """
+        Publish a text frame for `user_id`'s socket on the conversation with `recipient_id`.
+
+        `delivered_at` marks the frame as a new message from `recipient_id`:
+        writing it to an open socket records a read receipt up to that time.
+        """
+        # "<peer>\n<delivered_at>\n<frame>": the frame is passed through as is
+        # instead of being escaped into a JSON envelope on every publish
+        delivered = delivered_at.isoformat() if delivered_at is not None else ""
+        await self.backend.publish(user_id, f"{recipient_id}\n{delivered}\n{message_json}")
+
+    async def fan_out(self, sender_id: UUID, receiver_id: UUID, message_json: str,
+                      created_at: Optional[datetime] = None):
+        """
+        Publish a frame to both participants. `created_at` marks it as a new
+        message for `receiver_id`; edits, deletes and votes are sent without it.
+        """
+        await self.send_to(sender_id, receiver_id, message_json)
+        await self.send_to(receiver_id, sender_id, message_json, delivered_at=created_at)
+
+    async def _deliver(self, user_id: UUID, payload: str):
+        peer, delivered, message_json = payload.split("\n", 2)
+        recipient_id = UUID(peer)
+        on_sent = None
+        if delivered:
+            # Written to an open recipient socket, so it has been read
+            on_sent = partial(self.read_receipts.mark_read, user_id, recipient_id,
+                              datetime.fromisoformat(delivered))
+        # Queued for each device's writer task, never awaited here
+        tagged = None
+        for outbound in list(self.active_connections.get((user_id, recipient_id), ())):
+            if outbound.multiplexed:
+                tagged = tagged or tag_frame(message_json, recipient_id)
+                outbound.offer(tagged, on_sent)
+            else:
+                outbound.offer(message_json, on_sent)
 
         
     async def send_private_all(self, message: Optional[str], fileUrl: Optional[str],
@@ -35,20 +199,15 @@ class ConnectionManagerPrivate:
                             user_name: str, verified: bool,
                             avatar: str, id_return: Optional[UUID],
                             is_read: bool):
-        
-        sender_to_recipient = (sender_id, receiver_id)
-        recipient_to_sender = (receiver_id, sender_id)
-        
-        timezone = pytz.timezone('UTC')
-        current_time_utc = datetime.now(timezone)
+
+        started = time.perf_counter()
         try:
-            message_id = await self.add_private_all_to_database(sender_id, receiver_id, message,
-                                                                fileUrl, voiceUrl, videoUrl,
-                                                                id_return, is_read)
-            await self.mark_as_sent_message(message_id)
+            message_id, created_at, seq = await self.add_private_all_to_database(sender_id, receiver_id, message,
+                                                                                 fileUrl, voiceUrl, videoUrl,
+                                                                                 id_return, is_read)
             # SocketModel
             socket_message = schemas.ChatMessagesSchema(
-                created_at=current_time_utc,
+                created_at=created_at,
                 id=message_id,
                 receiver_id=sender_id,
                 message=message,
@@ -65,20 +224,14 @@ class ConnectionManagerPrivate:
                 deleted=False
             )
 
-            # Серіалізація даних моделі у JSON
-            wrapped_message = await schemas.wrap_message(socket_message)
-            message_json = wrapped_message.model_dump_json()
-
-
-            if sender_to_recipient in self.active_connections:
-                await self.active_connections[sender_to_recipient].send_text(message_json)
+            # Encoded once, the same frame goes to both participants
+            message_json = frames.message_frame(socket_message, seq)
 
-            if recipient_to_sender in self.active_connections:
-                await self.active_connections[recipient_to_sender].send_text(message_json)
-
-                logger.info("Notification sent to user")
+            await self.fan_out(sender_id, receiver_id, message_json, created_at)
         except Exception as e:
             logger.error(f"Error sending private message: {e}", exc_info=True)
+        finally:
+            SEND_PRIVATE_ALL.observe(time.perf_counter() - started)
 
 
     @staticmethod
@@ -86,27 +239,37 @@ class ConnectionManagerPrivate:
                                           message: Optional[str], fileUrl: Optional[str],
                                           voiceUrl: Optional[str], videoUrl: Optional[str],
                                           id_return: Optional[int], is_read: bool):
+        """
+        Persist a message as sent in one INSERT ... RETURNING and return its `(id, created_at, seq)`.
+
+        The conversation summaries of both participants and the conversation's
+        change log are updated in the same transaction; `seq` is the insert's
+        number in that log.
+
+        `created_at` is the database timestamp and the id a UUIDv7 taken here, after
+        encryption, so ids follow the order rows reach the database. With `settings.message_group_commit`
+        the row is handed to the group-commit writer and shares a multi-row INSERT
+        with the messages sent concurrently from other sockets.
+        """
         try:
             encrypt_message = await async_encrypt(message)
-            async with async_session_maker() as session:
-                stmt = insert(models.PrivateMessage).values(sender_id=sender_id, receiver_id=receiver_id,message=encrypt_message,
-                                                            is_read=is_read, fileUrl=fileUrl, voiceUrl=voiceUrl,
-                                                            videoUrl=videoUrl, id_return=id_return
-                                                            )
-                result = await session.execute(stmt)
-                await session.commit()
-
-                message_id = result.inserted_primary_key[0]
-                return message_id
+            row = dict(id=uuid7(), sender_id=sender_id, receiver_id=receiver_id, message=encrypt_message,
+                       is_read=is_read, fileUrl=fileUrl, voiceUrl=voiceUrl,
+                       videoUrl=videoUrl, id_return=id_return, is_sent=True,
+                       conversation_key=conversation_key(sender_id, receiver_id))
+            if settings.message_group_commit:
+                return await message_writer.insert(row)
+
+            with DB_MESSAGE_INSERT.labels(mode='single').time():
+                async with async_session_maker() as session:
+                    stmt = insert(models.PrivateMessage).values(**row).returning(models.PrivateMessage.id,
+                                                                                 models.PrivateMessage.created_at)
+                    result = await session.execute(stmt)
+                    message_id, created_at = result.one()
+                    await upsert_conversation_summaries([(sender_id, receiver_id, message_id, created_at)],
+                                                        session)
+                    seq, = await record_changes([(sender_id, receiver_id, message_id, INSERT)], session)
+                    await session.commit()
+            return message_id, created_at, seq
         except Exception as e:
             logger.error(f"Error adding message to database: {e}", exc_info=True)
-
-    @staticmethod
-    async def mark_as_sent_message(message_id: UUID):
-        async with async_session_maker() as session:
-            await session.execute(
-                update(models.PrivateMessage)
-                .where(models.PrivateMessage.id == message_id)
-                .values(is_sent=True)
-            )
-            await session.commit()
@@ -0,0 +1,177 @@
+import json
+from functools import partial
+from typing import Callable, Optional
+from uuid import UUID
+
+from _log_config.log_config import get_logger
+from app.connect.outbound import OutboundQueue, tag_frame
+from app.database.database import async_session_maker
+from app.functions.fcm_sent_message import send_notifications_private_message
+from app.functions.func_changes import changed_since, current_seq
+from app.functions.func_private import (change_message, delete_message, fetch_last_private_messages,
+                                        fetch_messages_by_id, fetch_one_message, fetch_reply_previews,
+                                        history_cursor, history_limit, message_update_json, process_vote,
+                                        send_history_page, send_messages_via_websocket)
+from app.schemas import frames, schemas
+from app.security.auth_cache import UserSnapshot
+
+logger = get_logger('conversation', 'conversation.log')
+
+
+class Conversation:
+    """
+    One user's side of a conversation with `peer_id` on one socket.
+
+    Holds the commands shared by the per-conversation `/private/{receiver_id}`
+    endpoint and the multiplexed `/ws` endpoint. On a multiplexed socket
+    every frame this conversation writes is tagged with its conversation id,
+    which is the peer's user id.
+
+    Edits, deletes and votes go to every socket of both participants, tagged
+    with their change log `seq` like new messages.
+    """
+
+    def __init__(self, manager, sayory_worker, user: UserSnapshot, peer_id: UUID,
+                 outbound: OutboundQueue, is_sayory: bool = False):
+        self.manager = manager
+        self.sayory_worker = sayory_worker
+        self.user = user
+        self.peer_id = peer_id
+        self.outbound = outbound
+        self.is_sayory = is_sayory
+
+    async def send_text(self, frame: str, on_sent: Optional[Callable[[], None]] = None):
+        if self.outbound.multiplexed:
+            frame = tag_frame(frame, self.peer_id)
+        await self.outbound.send_text(frame, on_sent)
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data))
+
+    async def open(self, since: Optional[int] = None):
+        """
+        Bring the client up to date and mark what it was sent from the peer as read.
+
+        With `since`, the last change `seq` the client saw, only the messages
+        changed after it are sent, in their current state. Without it, or when
+        the delta would be too large, the newest history page is sent instead.
+        Either way a `sync` frame with the current `seq` follows.
+        """
+        changed = None
+        async with async_session_maker() as session:
+            if since is not None:
+                changed, seq = await changed_since(self.user.id, self.peer_id, since, session)
+            if changed is not None:
+                messages = await fetch_messages_by_id(changed, session)
+            else:
+                # Read before the page: a change landing in between is sent again, never missed
+                seq = await current_seq(self.user.id, self.peer_id, session)
+                limit = history_limit()
+                messages = await fetch_last_private_messages(self.peer_id, self.user.id, session, limit=limit)
+            replies = await fetch_reply_previews(messages, session)
+
+        if changed is not None:
+            await send_messages_via_websocket(messages, self, replies)
+        else:
+            await send_history_page(messages, history_cursor(messages, limit), self, replies)
+
+        # Everything the peer sent up to what has been delivered is read, once
+        # the writer has written the page: the sync frame follows it in the queue
+        received = [message.created_at for message in messages if message.receiver_id == self.peer_id]
+        on_sent = None
+        if received:
+            on_sent = partial(self.manager.read_receipts.mark_read, self.user.id, self.peer_id, max(received))
+        await self.send_text(frames.sync_frame(seq), on_sent)
+
+    async def handle(self, data: dict):
+        """
+        Run one command from the client. Errors are reported as `notice` frames.
+        """
+        for command, handler, failure in (('history', self.history, "Error processing history"),
+                                          ('read_up_to', self.read_up_to, "Error processing read_up_to"),
+                                          ('vote', self.vote, "Error processing vote"),
+                                          ('update', self.update, "Error processing update"),
+                                          ('delete', self.delete, "Error processing delete"),
+                                          ('send', self.send, "Error sending message")):
+            if command in data:
+                try:
+                    await handler(data[command])
+                except Exception as e:
+                    logger.error(f"{failure}: {e}", exc_info=True)
+                    await self.send_json({"notice": f"{failure}: {e}"})
+                return
+
+    # Older history pages
+    async def history(self, payload: Optional[dict]):
+        history_data = schemas.HistoryRequest(**(payload or {}))
+        limit = history_limit(history_data.limit)
+        async with async_session_maker() as session:
+            page = await fetch_last_private_messages(self.peer_id, self.user.id, session,
+                                                     before=history_data.before, limit=limit)
+            replies = await fetch_reply_previews(page, session)
+        await send_history_page(page, history_cursor(page, limit), self, replies)
+
+    # Explicit read receipt from the client
+    async def read_up_to(self, payload: dict):
+        read_data = schemas.ReadUpTo(**payload)
+        self.manager.read_receipts.mark_read(self.user.id, self.peer_id, read_data.created_at)
+
+    # Created likes
+    async def vote(self, payload: dict):
+        vote_data = schemas.Vote(**payload)
+        async with async_session_maker() as session:
+            message, seq = await process_vote(vote_data, session, self.user)
+
+            message_json = await message_update_json(message, session, seq)
+        if seq is None:
+            # Nothing changed: only the voter hears back, with the current count
+            await self.send_text(message_json)
+            return
+        await self.manager.fan_out(self.user.id, self.peer_id, message_json)
+
+    async def update(self, payload: dict):
+        message_data = schemas.ChatUpdateMessage(**payload)
+        async with async_session_maker() as session:
+            seq = await change_message(message_data.id, message_data, session, self.user)
+
+            message_json = await fetch_one_message(message_data.id, session, seq)
+        await self.manager.fan_out(self.user.id, self.peer_id, message_json)
+
+    # Block delete message
+    async def delete(self, payload: dict):
+        message_data = schemas.ChatMessageDelete(**payload)
+        async with async_session_maker() as session:
+            seq = await delete_message(message_data.id, session, self.user)
+        await self.manager.fan_out(self.user.id, self.peer_id, frames.deleted_frame(message_data.id, seq))
+
+    async def send(self, payload: dict):
+        original_message_id = payload['original_message_id']
+        original_message = payload['message']
+
+        await self.manager.send_private_all(
+            message=original_message,
+            fileUrl=payload['fileUrl'],
+            voiceUrl=payload['voiceUrl'],
+            videoUrl=payload['videoUrl'],
+            receiver_id=self.peer_id,
+            sender_id=self.user.id,
+            user_name=self.user.user_name,
+            avatar=self.user.avatar,
+            verified=self.user.verified,
+            id_return=original_message_id,
+            is_read=True
+        )
+
+        # The recipient already got it over the socket if the conversation is open;
+        # the dispatcher also checks the other workers before pushing
+        if not self.manager.is_online(self.peer_id, self.user.id):
+            send_notifications_private_message(message=original_message,
+                                               sender=self.user.user_name,
+                                               recipient_id=self.peer_id,
+                                               sender_id=self.user.id)
+        logger.info(f"Sent message: {original_message}")
+
+        # Answered by the Sayory worker pool; the receive loop keeps going meanwhile
+        if self.is_sayory and not self.sayory_worker.submit(self.user.id, self.peer_id, original_message,
+                                                            original_message_id):
+            await self.send_json({"notice": "Sayory is busy, please try again later"})
@@ -0,0 +1,276 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from sqlalchemy import text
+
+from _log_config.log_config import get_logger
+from app.settings.config import settings
+
+logger = get_logger('fanout', 'fanout.log')
+
+# Handler installed by the connection manager: (user_id, payload) -> delivery to local sockets
+DeliveryHandler = Callable[[UUID, str], Awaitable[None]]
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7999
+
+# Marks one part of a payload split across several notifications:
+# "#<part id> <index> <count>\n<part>". Manager payloads start with a uuid.
+CHUNK_MARKER = "#"
+CHUNK_HEADER_SIZE = 64
+
+
+def user_channel(user_id: UUID) -> str:
+    return f"private_user_{user_id.hex}"
+
+
+def notify_chunks(payload: str, limit: int = NOTIFY_PAYLOAD_LIMIT) -> List[str]:
+    """
+    Split `payload` into NOTIFY payloads of at most `limit` bytes.
+
+    A payload that fits is returned as is. Larger ones are cut on UTF-8
+    character boundaries into parts that each carry a header naming the
+    payload, the part index and the part count, for the receiver to join.
+    """
+    data = payload.encode('utf-8')
+    if len(data) <= limit:
+        return [payload]
+
+    size = limit - CHUNK_HEADER_SIZE
+    parts, start = [], 0
+    while start < len(data):
+        end = min(start + size, len(data))
+        # Never cut a multi-byte character: back off over continuation bytes
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode('utf-8'))
+        start = end
+
+    part_id = uuid4().hex
+    return [f"{CHUNK_MARKER}{part_id} {index} {len(parts)}\n{part}" for index, part in enumerate(parts)]
+
+
+class FanoutBackend:
+    """
+    Delivers payloads published for a user to whichever process holds that user's sockets.
+
+    Every user has its own channel. A manager subscribes to the channel of each
+    user it holds a socket for and the backend calls the bound handler for
+    every payload published on it, wherever it was published.
+
+    `shared` is True for backends that connect several worker processes.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.handler: Optional[DeliveryHandler] = None
+
+    def bind(self, handler: DeliveryHandler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, user_id: UUID):
+        raise NotImplementedError
+
+    async def unsubscribe(self, user_id: UUID):
+        raise NotImplementedError
+
+    async def publish(self, user_id: UUID, payload: str):
+        raise NotImplementedError
+
+    async def _dispatch(self, user_id: UUID, payload: str):
+        if self.handler is None:
+            return
+        try:
+            await self.handler(user_id, payload)
+        except Exception as e:
+            logger.error(f"Error delivering payload to {user_id}: {e}", exc_info=True)
+
+
+class LocalBroker:
+    """
+    In-memory channel registry shared by the `InProcessFanout` backends that use it.
+
+    A single worker uses one private broker. Tests share one broker between
+    several managers to stand in for Postgres between worker processes.
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, Set["InProcessFanout"]] = {}
+
+    def subscribe(self, channel: str, backend: "InProcessFanout"):
+        self.channels.setdefault(channel, set()).add(backend)
+
+    def unsubscribe(self, channel: str, backend: "InProcessFanout"):
+        subscribers = self.channels.get(channel)
+        if subscribers is None:
+            return
+        subscribers.discard(backend)
+        if not subscribers:
+            del self.channels[channel]
+
+    async def publish(self, channel: str, user_id: UUID, payload: str):
+        for backend in list(self.channels.get(channel, ())):
+            await backend._dispatch(user_id, payload)
+
+
+class InProcessFanout(FanoutBackend):
+    def __init__(self, broker: Optional[LocalBroker] = None):
+        super().__init__()
+        self.broker = broker or LocalBroker()
+
+    async def subscribe(self, user_id: UUID):
+        self.broker.subscribe(user_channel(user_id), self)
+
+    async def unsubscribe(self, user_id: UUID):
+        self.broker.unsubscribe(user_channel(user_id), self)
+
+    async def publish(self, user_id: UUID, payload: str):
+        await self.broker.publish(user_channel(user_id), user_id, payload)
+
+
+class PostgresFanout(FanoutBackend):
+    """
+    Fan-out over Postgres LISTEN/NOTIFY.
+
+    LISTEN runs on one dedicated asyncpg connection, held outside the
+    SQLAlchemy pool for the life of the process and re-established, with its
+    channels re-subscribed, if the server drops it. NOTIFY goes through a
+    pooled connection of `engine`, so publishers never queue behind the
+    listener. Payloads over the NOTIFY limit are split with `notify_chunks`
+    and sent in one transaction, which Postgres delivers together and in order.
+    """
+
+    shared = True
+
+    def __init__(self, dsn: str, engine, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.dsn = dsn
+        self.engine = engine
+        self.reconnect_delay = reconnect_delay
+        self.users: Set[UUID] = set()
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # Dispatches started by notifications, cancelled on stop
+        self._tasks: Set[asyncio.Task] = set()
+        # Parts received so far of split payloads, by (sender pid, part id)
+        self._parts: Dict[Tuple[int, str], List[Optional[str]]] = {}
+
+    async def start(self):
+        async with self._lock:
+            if self._connection is None:
+                await self._connect()
+
+    async def stop(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        async with self._lock:
+            if self._connection is not None:
+                connection, self._connection = self._connection, None
+                await connection.close()
+        tasks, self._tasks = self._tasks, set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._parts.clear()
+
+    async def _connect(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self.dsn)
+        connection.add_termination_listener(self._on_termination)
+        for user_id in self.users:
+            await connection.add_listener(user_channel(user_id), self._on_notify)
+        self._connection = connection
+        logger.info(f"Listening on {len(self.users)} user channels")
+
+    def _on_termination(self, connection):
+        if connection is not self._connection:
+            return
+        logger.error("Fan-out connection lost, reconnecting")
+        self._connection = None
+        # Parts of a payload cut off by the disconnect will never complete
+        self._parts.clear()
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while True:
+            try:
+                async with self._lock:
+                    if self._connection is None:
+                        await self._connect()
+                return
+            except Exception as e:
+                logger.error(f"Fan-out reconnect failed: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        user_id = UUID(hex=channel[len("private_user_"):])
+        if payload.startswith(CHUNK_MARKER):
+            payload = self._join(pid, payload)
+            if payload is None:
+                return
+        task = asyncio.create_task(self._dispatch(user_id, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _join(self, pid: int, chunk: str) -> Optional[str]:
+        """
+        Collect one part of a split payload. Returns the whole payload once every part has arrived.
+        """
+        header, part = chunk.split("\n", 1)
+        part_id, index, count = header[len(CHUNK_MARKER):].split(" ")
+        key = (pid, part_id)
+        parts = self._parts.setdefault(key, [None] * int(count))
+        parts[int(index)] = part
+        if any(received is None for received in parts):
+            return None
+        del self._parts[key]
+        return "".join(parts)
+
+    async def subscribe(self, user_id: UUID):
+        async with self._lock:
+            if user_id in self.users:
+                return
+            self.users.add(user_id)
+            if self._connection is not None:
+                await self._connection.add_listener(user_channel(user_id), self._on_notify)
+
+    async def unsubscribe(self, user_id: UUID):
+        async with self._lock:
+            if user_id not in self.users:
+                return
+            self.users.discard(user_id)
+            if self._connection is not None:
+                await self._connection.remove_listener(user_channel(user_id), self._on_notify)
+
+    async def publish(self, user_id: UUID, payload: str):
+        channel = user_channel(user_id)
+        async with self.engine.begin() as connection:
+            for chunk in notify_chunks(payload):
+                await connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                         dict(channel=channel, payload=chunk))
+
+
+def create_fanout_backend(backend: Optional[str] = None) -> FanoutBackend:
+    """
+    Build the backend selected by `settings.fanout_backend` ("memory" or "postgres").
+    """
+    backend = backend or settings.fanout_backend
+    if backend == "memory":
+        return InProcessFanout()
+    if backend == "postgres":
+        from app.database.database import ASYNC_SQLALCHEMY_DATABASE_URL, engine_async
+
+        return PostgresFanout(ASYNC_SQLALCHEMY_DATABASE_URL.replace('postgresql+asyncpg://', 'postgresql://', 1),
+                              engine_async)
+    raise ValueError(f"Unknown fan-out backend: {backend}")
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import weakref
+from typing import Awaitable, Callable, Optional, Set
+from uuid import UUID
+
+from fastapi import WebSocket, status
+
+from _log_config.log_config import get_logger
+from app.metrics.metrics import (WS_DROPPED_FRAMES, WS_EVICTIONS, WS_QUEUE_DEPTH,
+                                 WS_QUEUE_DEPTH_MAX, WS_QUEUED_FRAMES)
+from app.settings.config import settings
+
+logger = get_logger('outbound', 'outbound.log')
+
+DROP_OLDEST, DROP_NEWEST, CLOSE = "drop_oldest", "drop_newest", "close"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, CLOSE)
+
+# Called once when a queue evicts its socket
+EvictHandler = Callable[["OutboundQueue"], Awaitable[None]]
+
+# Called by the writer once a frame has actually been written to the socket
+SentHandler = Callable[[], None]
+
+# Open queues, for the depth gauges
+_queues: "weakref.WeakSet[OutboundQueue]" = weakref.WeakSet()
+
+WS_QUEUE_DEPTH_MAX.set_function(lambda: max((queue.depth for queue in _queues), default=0))
+WS_QUEUED_FRAMES.set_function(lambda: sum(queue.depth for queue in _queues))
+
+
+def tag_frame(frame: str, conversation_id: UUID) -> str:
+    """
+    Prefix a JSON object frame with `"conversation_id"` without decoding it.
+    """
+    return f'{{"conversation_id":"{conversation_id}",{frame[1:]}'
+
+
+class OutboundQueue:
+    """
+    Bounded queue of text frames for one socket, drained by its own writer task.
+
+    Frames for other users are queued with `offer`, which never waits: a slow
+    or dead recipient cannot stall the handler of the user sending to it. When
+    the queue is full, `policy` decides whether the oldest queued frame or the
+    new one is dropped, or the socket is closed. A `send_text` that does not
+    complete within `send_timeout` seconds, or fails, evicts the socket.
+
+    The connection's own handler writes through `send_text`/`send_json`,
+    which wait for room instead, so replies share the same ordered stream.
+
+    Frames may carry an `on_sent` callback, run by the writer after the frame
+    has been written; a dropped or discarded frame never runs it.
+    """
+
+    def __init__(self, websocket: WebSocket, on_evict: Optional[EvictHandler] = None,
+                 maxsize: Optional[int] = None, send_timeout: Optional[float] = None,
+                 policy: Optional[str] = None, multiplexed: bool = False):
+        self.websocket = websocket
+        # A multiplexed socket carries several conversations, its frames are tagged with one
+        self.multiplexed = multiplexed
+        # Peer ids of the conversations this socket is subscribed to
+        self.conversations: Set[UUID] = set()
+        self.on_evict = on_evict
+        self.send_timeout = send_timeout or settings.ws_send_timeout
+        self.policy = policy or settings.ws_queue_full_policy
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown outbound queue policy: {self.policy}")
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize or settings.ws_send_queue_size)
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+        # Eviction scheduled by `offer`, held so it is not garbage collected or scheduled twice
+        self._evicting: Optional[asyncio.Task] = None
+        _queues.add(self)
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        """
+        Stop the writer and discard queued frames; the socket itself is left alone.
+        """
+        self.closed = True
+        _queues.discard(self)
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def offer(self, frame: str, on_sent: Optional[SentHandler] = None) -> bool:
+        """
+        Queue `frame` without waiting. Returns False if it was not queued.
+        """
+        if self.closed:
+            return False
+        WS_QUEUE_DEPTH.observe(self.depth)
+        if not self.queue.full():
+            self.queue.put_nowait((frame, on_sent))
+            return True
+
+        WS_DROPPED_FRAMES.labels(policy=self.policy).inc()
+        if self.policy == DROP_NEWEST:
+            return False
+        if self.policy == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.queue.put_nowait((frame, on_sent))
+            return True
+        if self._evicting is None:
+            self._evicting = asyncio.create_task(self._evict("queue_full"))
+        return False
+
+    async def send_text(self, frame: str, on_sent: Optional[SentHandler] = None):
+        if self.closed:
+            return
+        WS_QUEUE_DEPTH.observe(self.depth)
+        await self.queue.put((frame, on_sent))
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data))
+
+    async def drain(self):
+        """
+        Wait until every queued frame has been written.
+        """
+        await self.queue.join()
+
+    async def _writer(self):
+        while True:
+            frame, on_sent = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(frame), self.send_timeout)
+                if on_sent is not None:
+                    on_sent()
+            except asyncio.TimeoutError:
+                await self._evict("send_timeout")
+                return
+            except Exception as e:
+                logger.error(f"Error writing to socket: {e}")
+                await self._evict("send_error")
+                return
+            finally:
+                self.queue.task_done()
+
+    async def _evict(self, reason: str):
+        if self.closed:
+            return
+        logger.warning(f"Evicting slow consumer: {reason}, {self.depth} frames queued")
+        WS_EVICTIONS.labels(reason=reason).inc()
+        await self.close()
+        # Release anyone waiting on drain()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+        try:
+            await self.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+        if self.on_evict is not None:
+            await self.on_evict(self)
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import uuid4
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+
+from _log_config.log_config import get_logger
+from app.database.database import async_session_maker
+from app.models import models
+from app.settings.config import settings
+
+logger = get_logger('presence', 'presence.log')
+
+# Rows per INSERT, under the 32767 bind parameters of one asyncpg statement
+PRESENCE_BATCH = 5000
+
+
+class PresenceTracker:
+    """
+    Publishes the conversations open in this process to `conversation_presence`.
+
+    With several workers, a recipient may have the conversation open on a
+    worker other than the sender's, where the local `is_online` cannot see it.
+    Each worker writes its open (user, peer) pairs under its own `worker_id`:
+    changes within `flush_interval` seconds of a subscribe or unsubscribe,
+    and all of them every `heartbeat_interval` seconds so rows of a worker
+    that died without cleaning up expire after `settings.presence_ttl`.
+    The notification dispatcher reads the table before pushing.
+    """
+
+    def __init__(self, manager, flush_interval: Optional[float] = None,
+                 heartbeat_interval: Optional[float] = None):
+        self.manager = manager
+        self.worker_id = uuid4()
+        self.flush_interval = flush_interval or settings.presence_flush_interval
+        self.heartbeat_interval = heartbeat_interval or settings.presence_heartbeat_interval
+        self.dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        try:
+            async with async_session_maker() as session:
+                await session.execute(delete(models.ConversationPresence)
+                                      .where(models.ConversationPresence.worker_id == self.worker_id))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error clearing presence: {e}", exc_info=True)
+
+    def changed(self):
+        """
+        Note that a conversation was opened or closed; written on the next flush.
+        """
+        self.dirty = True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        heartbeat_at = 0.0
+        while True:
+            if self.dirty or loop.time() >= heartbeat_at:
+                self.dirty = False
+                try:
+                    await self.flush()
+                    heartbeat_at = loop.time() + self.heartbeat_interval
+                except Exception as e:
+                    logger.error(f"Error writing presence: {e}", exc_info=True)
+                    self.dirty = True
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        """
+        Refresh this worker's open conversations and drop its closed and everyone's expired ones.
+        """
+        now = datetime.now(timezone.utc)
+        presence = models.ConversationPresence
+        rows = [dict(user_id=user_id, peer_id=peer_id, worker_id=self.worker_id, seen_at=now)
+                for user_id, peer_id in list(self.manager.active_connections)]
+
+        async with async_session_maker() as session:
+            for i in range(0, len(rows), PRESENCE_BATCH):
+                statement = insert(presence).values(rows[i:i + PRESENCE_BATCH])
+                await session.execute(statement.on_conflict_do_update(
+                    index_elements=[presence.user_id, presence.peer_id, presence.worker_id],
+                    set_=dict(seen_at=statement.excluded.seen_at)
+                ))
+            # Not refreshed above: closed here since the last flush
+            await session.execute(delete(presence).where(presence.worker_id == self.worker_id,
+                                                         presence.seen_at < now))
+            await session.execute(delete(presence).where(
+                presence.seen_at < now - timedelta(seconds=settings.presence_ttl)))
+            await session.commit()
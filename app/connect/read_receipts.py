@@ -0,0 +1,108 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import column, select, update, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.sql.sqltypes import TIMESTAMP
+
+from _log_config.log_config import get_logger
+from app.database.database import async_session_maker
+from app.functions.func_conversations import refresh_unread_counts_statement
+from app.models import models
+from app.settings.config import settings
+
+logger = get_logger('read_receipts', 'read_receipts.log')
+
+
+class ReadReceiptBatcher:
+    """
+    Coalesces read receipts from all sockets of the process into one UPDATE per flush.
+
+    A receipt is recorded once a message has been written to an open recipient
+    socket or when the client sends `read_up_to`. Receipts for the same
+    (reader, sender) pair are merged by keeping the newest `created_at`, and
+    every `flush_interval` seconds the pending set is written with a single
+    UPDATE ... FROM (VALUES ...), the readers' unread counts in
+    `conversation_summaries` are recounted in the same transaction, and the
+    receipts that marked at least one message are pushed to the senders as
+    `read` events once the transaction has committed.
+
+    Note: `PrivateMessage.is_read` stays True while the message is unseen and
+    is set to False once the recipient has read it, as the clients expect.
+    """
+
+    def __init__(self, manager, flush_interval: Optional[float] = None):
+        self.manager = manager
+        self.flush_interval = flush_interval or settings.read_receipt_flush_interval
+        self.pending: Dict[Tuple[UUID, UUID], datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def mark_read(self, reader_id: UUID, sender_id: UUID, up_to: datetime):
+        """
+        Record that `reader_id` has seen every message from `sender_id` up to `up_to`.
+        """
+        key = (reader_id, sender_id)
+        current = self.pending.get(key)
+        if current is None or up_to > current:
+            self.pending[key] = up_to
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+
+        receipts = values(
+            column('reader_id', PG_UUID(as_uuid=True)),
+            column('sender_id', PG_UUID(as_uuid=True)),
+            column('up_to', TIMESTAMP(timezone=True)),
+            name='receipts'
+        ).data([(reader_id, sender_id, up_to) for (reader_id, sender_id), up_to in pending.items()])
+
+        marked = (
+            update(models.PrivateMessage)
+            .where(models.PrivateMessage.receiver_id == receipts.c.reader_id,
+                   models.PrivateMessage.sender_id == receipts.c.sender_id,
+                   models.PrivateMessage.created_at <= receipts.c.up_to,
+                   models.PrivateMessage.is_read)
+            .values(is_read=False)
+            .returning(models.PrivateMessage.receiver_id, models.PrivateMessage.sender_id)
+            .cte('marked')
+        )
+
+        try:
+            async with async_session_maker() as session:
+                # Pairs for which the UPDATE matched at least one unread message
+                result = await session.execute(select(marked.c.receiver_id, marked.c.sender_id).distinct())
+                changed = set(result.all())
+                await session.execute(refresh_unread_counts_statement(receipts))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error flushing read receipts: {e}", exc_info=True)
+            for (reader_id, sender_id), up_to in pending.items():
+                self.mark_read(reader_id, sender_id, up_to)
+            return
+
+        # Nothing to tell the sender when everything was already read
+        for (reader_id, sender_id), up_to in pending.items():
+            if (reader_id, sender_id) not in changed:
+                continue
+            event = json.dumps({"read": {"user_id": str(reader_id), "up_to": up_to.isoformat()}})
+            await self.manager.send_to(sender_id, reader_id, event)
@@ -0,0 +1,321 @@
+"""
+One-off data migrations, run from the repository root with the usual `.env`,
+in this order on an existing database:
+
+    PYTHONPATH=. python -m app.database.backfill history-index
+    PYTHONPATH=. python -m app.database.backfill conversation-summaries
+    PYTHONPATH=. python -m app.database.backfill change-log
+    PYTHONPATH=. python -m app.database.backfill vote-counts
+    PYTHONPATH=. python -m app.database.backfill presence-table
+    PYTHONPATH=. python -m app.database.backfill message-ids
+    PYTHONPATH=. python -m app.database.backfill conversation-keys
+
+The tables must exist before a release that writes them is deployed; the
+fills can run while it serves.
+"""
+import asyncio
+import sys
+
+from sqlalchemy import column, select, text, update, values
+from sqlalchemy.dialects.postgresql import UUID
+
+from _log_config.log_config import get_logger
+from app.database.database import async_session_maker, engine_async
+from app.database.ids import CONVERSATION_NAMESPACE, uuid7
+from app.functions.func_conversations import rebuild_conversation_summaries
+from app.functions.func_private import recount_votes
+from app.models import models
+
+logger = get_logger('backfill', 'backfill.log')
+
+HISTORY_INDEX = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_private_messages_pair_created "
+    "ON private_messages (sender_id, receiver_id, created_at, id)"
+)
+
+
+async def create_index_concurrently(statement: str):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    async with engine_async.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text(statement))
+
+
+async def create_tables(*tables):
+    # CREATE TABLE IF NOT EXISTS with the indexes declared on the models
+    async with engine_async.begin() as connection:
+        for table in tables:
+            await connection.run_sync(table.create, checkfirst=True)
+
+
+async def create_history_index() -> int:
+    """
+    Build the per-direction history index on an existing `private_messages`
+    without blocking writes. Returns 0; there are no rows to fill.
+    """
+    await create_index_concurrently(HISTORY_INDEX)
+    logger.info("Created ix_private_messages_pair_created")
+    return 0
+
+# Foreign keys to private_messages.id are checked at commit while a batch remaps both sides
+MESSAGE_ID_DDL = (
+    "ALTER TABLE private_message_votes DROP CONSTRAINT IF EXISTS private_message_votes_message_id_fkey",
+    "ALTER TABLE private_message_votes ADD CONSTRAINT private_message_votes_message_id_fkey "
+    "FOREIGN KEY (message_id) REFERENCES private_messages (id) ON DELETE CASCADE "
+    "DEFERRABLE INITIALLY IMMEDIATE",
+    "ALTER TABLE conversation_summaries DROP CONSTRAINT IF EXISTS conversation_summaries_last_message_id_fkey",
+    "ALTER TABLE conversation_summaries ADD CONSTRAINT conversation_summaries_last_message_id_fkey "
+    "FOREIGN KEY (last_message_id) REFERENCES private_messages (id) ON DELETE SET NULL "
+    "DEFERRABLE INITIALLY IMMEDIATE",
+)
+
+# Lookups of old ids in the referencing columns, dropped once the ids are rewritten;
+# votes use ix_private_message_votes_message_id from the vote-counts backfill
+MESSAGE_ID_REFERENCE_INDEXES = {
+    'ix_backfill_private_messages_id_return': "private_messages (id_return)",
+    'ix_backfill_conversation_summaries_last_message_id': "conversation_summaries (last_message_id)",
+    'ix_backfill_conversation_changes_message_id': "conversation_changes (message_id)",
+}
+
+DEFER_MESSAGE_ID_KEYS = text(
+    "SET CONSTRAINTS private_message_votes_message_id_fkey, conversation_summaries_last_message_id_fkey DEFERRED"
+)
+
+
+async def backfill_message_ids(batch_size: int = 1000) -> int:
+    """
+    Give messages stored with random (v4) ids a UUIDv7 built from their `created_at`.
+
+    Walks the primary key in batches of `batch_size`, one transaction each,
+    so it can be stopped and resumed. Each batch rewrites its v4 ids and, in
+    the same transaction, every column holding them: replies (`id_return`),
+    votes, conversation summaries and the change log, so reconnecting
+    clients get the new ids from `changed_since`. The referencing columns
+    are indexed for the run. Clients holding old ids should reload their
+    history afterwards. Returns the number of rewritten messages.
+
+    Until it has run, v4 rows still sort correctly: history is ordered by
+    `(created_at, id)` and the id only breaks ties.
+    """
+    messages = models.PrivateMessage.__table__
+    references = (
+        (messages, messages.c.id_return),
+        (models.PrivateMessageVote.__table__, models.PrivateMessageVote.__table__.c.message_id),
+        (models.ConversationSummary.__table__, models.ConversationSummary.__table__.c.last_message_id),
+        (models.ConversationChange.__table__, models.ConversationChange.__table__.c.message_id),
+    )
+
+    async with async_session_maker() as session:
+        for statement in MESSAGE_ID_DDL:
+            await session.execute(text(statement))
+        await session.commit()
+    # Without them every batch would scan the referencing tables
+    for name, target in MESSAGE_ID_REFERENCE_INDEXES.items():
+        await create_index_concurrently(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+
+    rewritten, after = 0, None
+    while True:
+        async with async_session_maker() as session:
+            batch = (messages.select().with_only_columns(messages.c.id, messages.c.created_at)
+                     .order_by(messages.c.id).limit(batch_size))
+            if after is not None:
+                batch = batch.where(messages.c.id > after)
+            rows = (await session.execute(batch)).all()
+            if not rows:
+                break
+            # A rewritten id may land ahead of the cursor: it is read again and skipped
+            old = [(message_id, created_at) for message_id, created_at in rows if message_id.version != 7]
+
+            if old:
+                mapping = values(column('old_id', UUID(as_uuid=True)), column('new_id', UUID(as_uuid=True)),
+                                 name='mapping').data([(message_id, uuid7(created_at))
+                                                       for message_id, created_at in old])
+                await session.execute(DEFER_MESSAGE_ID_KEYS)
+                await session.execute(
+                    update(messages).where(messages.c.id == mapping.c.old_id).values(id=mapping.c.new_id)
+                )
+                for table, reference in references:
+                    await session.execute(
+                        update(table).where(reference == mapping.c.old_id).values({reference: mapping.c.new_id})
+                    )
+                await session.commit()
+
+        rewritten += len(old)
+        after = rows[-1][0]
+        logger.info(f"Rewrote {rewritten} message ids, up to {after}")
+
+    for name in MESSAGE_ID_REFERENCE_INDEXES:
+        await create_index_concurrently(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    return rewritten
+
+
+CONVERSATION_KEY_DDL = (
+    "ALTER TABLE private_messages ADD COLUMN IF NOT EXISTS conversation_key uuid",
+)
+
+CONVERSATION_KEY_INDEX = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_private_messages_conversation_created "
+    "ON private_messages (conversation_key, created_at, id)"
+)
+
+# Same key as app.database.ids.conversation_key
+FILL_CONVERSATION_KEYS = text("""
+    UPDATE private_messages
+    SET conversation_key = uuid_generate_v5(CAST(:namespace AS uuid),
+                                            least(sender_id, receiver_id)::text || ':' ||
+                                            greatest(sender_id, receiver_id)::text)
+    WHERE id IN (SELECT id FROM private_messages WHERE id > :after ORDER BY id LIMIT :batch_size)
+      AND conversation_key IS NULL
+    RETURNING id
+""")
+
+LAST_ID_OF_BATCH = text("""
+    SELECT max(id) FROM (SELECT id FROM private_messages WHERE id > :after ORDER BY id LIMIT :batch_size) AS batch
+""")
+
+
+async def backfill_conversation_keys(batch_size: int = 5000) -> int:
+    """
+    Fill `conversation_key` on messages written before it existed, then build its index.
+
+    Walks the primary key in batches of `batch_size`, one short transaction
+    each, so live traffic is not blocked and the run can be repeated. New
+    messages already carry the key. The index is built CONCURRENTLY once the
+    column is filled; switch on `settings.history_by_conversation_key` after
+    that. Returns the number of filled messages.
+    """
+    async with async_session_maker() as session:
+        for statement in CONVERSATION_KEY_DDL:
+            await session.execute(text(statement))
+        await session.commit()
+
+    filled, after = 0, '00000000-0000-0000-0000-000000000000'
+    while True:
+        async with async_session_maker() as session:
+            params = dict(after=after, batch_size=batch_size)
+            last = (await session.execute(LAST_ID_OF_BATCH, params)).scalar_one()
+            if last is None:
+                break
+            result = await session.execute(FILL_CONVERSATION_KEYS,
+                                           dict(params, namespace=str(CONVERSATION_NAMESPACE)))
+            filled += len(result.all())
+            await session.commit()
+        after = last
+        logger.info(f"Filled {filled} conversation keys, up to {after}")
+
+    await create_index_concurrently(CONVERSATION_KEY_INDEX)
+    return filled
+
+
+async def create_change_log_tables() -> int:
+    """
+    Create `conversation_sequences` and `conversation_changes`, with the
+    vote index `reconcile_vote_counts` reads. Returns 0; the log starts
+    empty and clients get a full history page until they have seen a `seq`.
+    """
+    await create_tables(models.ConversationSequence.__table__, models.ConversationChange.__table__)
+    logger.info("Created conversation_sequences and conversation_changes")
+    return 0
+
+
+async def create_presence_table() -> int:
+    """
+    Create `conversation_presence`, needed before running several workers on
+    the postgres fan-out. Returns 0; it starts empty and workers fill it.
+    """
+    await create_tables(models.ConversationPresence.__table__)
+    logger.info("Created conversation_presence")
+    return 0
+
+
+# Constant default: added without rewriting the table
+VOTE_COUNT_DDL = (
+    "ALTER TABLE private_messages ADD COLUMN IF NOT EXISTS vote_count integer NOT NULL DEFAULT 0",
+)
+
+VOTE_INDEXES = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_private_message_votes_message_id "
+    "ON private_message_votes (message_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conversation_changes_votes "
+    "ON conversation_changes (created_at) WHERE kind IN ('vote', 'delete')",
+)
+
+
+async def backfill_vote_counts(batch_size: int = 1000) -> int:
+    """
+    Add `vote_count` and set it from the votes table on every message.
+
+    Walks the primary key in batches of `batch_size`, one transaction each,
+    counting with `recount_votes` so concurrent votes are never overwritten.
+    First builds the indexes the recount and `reconcile_vote_counts` read.
+    Safe to repeat, e.g. after reconciliation was off for longer than
+    `settings.vote_reconcile_lookback`. Returns the number of corrected messages.
+    """
+    messages = models.PrivateMessage.__table__
+
+    async with async_session_maker() as session:
+        for statement in VOTE_COUNT_DDL:
+            await session.execute(text(statement))
+        await session.commit()
+    for statement in VOTE_INDEXES:
+        await create_index_concurrently(statement)
+
+    fixed, after = 0, None
+    async with engine_async.connect() as connection:
+        while True:
+            batch = select(messages.c.id).order_by(messages.c.id).limit(batch_size)
+            if after is not None:
+                batch = batch.where(messages.c.id > after)
+            message_ids = (await connection.execute(batch)).scalars().all()
+            if not message_ids:
+                break
+            fixed += await recount_votes(message_ids, connection)
+            await connection.commit()
+            after = message_ids[-1]
+            logger.info(f"Recounted votes up to {after}, {fixed} corrected")
+    return fixed
+
+
+async def backfill_conversation_summaries(batch_size: int = 500) -> int:
+    """
+    Create `conversation_summaries` and fill it from the existing history.
+
+    Walks the users by primary key in batches of `batch_size`, rebuilding
+    their rows with `rebuild_conversation_summaries`, one transaction each.
+    New messages keep their summaries current meanwhile, so the
+    conversations endpoint can be served as soon as the run ends. Safe to
+    repeat. Returns the number of written summary rows.
+    """
+    users = models.User.__table__
+    await create_tables(models.ConversationSummary.__table__)
+
+    written, after = 0, None
+    while True:
+        async with async_session_maker() as session:
+            batch = select(users.c.id).order_by(users.c.id).limit(batch_size)
+            if after is not None:
+                batch = batch.where(users.c.id > after)
+            user_ids = (await session.execute(batch)).scalars().all()
+            if not user_ids:
+                break
+            written += await rebuild_conversation_summaries(user_ids, session)
+        after = user_ids[-1]
+        logger.info(f"Rebuilt {written} conversation summaries, up to user {after}")
+    return written
+
+
+BACKFILLS = {
+    'history-index': create_history_index,
+    'message-ids': backfill_message_ids,
+    'conversation-keys': backfill_conversation_keys,
+    'change-log': create_change_log_tables,
+    'presence-table': create_presence_table,
+    'vote-counts': backfill_vote_counts,
+    'conversation-summaries': backfill_conversation_summaries,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in BACKFILLS:
+        sys.exit(f"usage: python -m app.database.backfill {{{'|'.join(BACKFILLS)}}}")
+    print(asyncio.run(BACKFILLS[sys.argv[1]]()))
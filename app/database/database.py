@@ -1,10 +1,15 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from typing import AsyncGenerator
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncio
 import time
 
+from sqlalchemy import text
+
+from _log_config.log_config import get_logger
+
+from app.metrics.metrics import DB_POOL_CHECKOUT_WAIT, DB_POOL_IDLE, DB_POOL_IN_USE, DB_POOL_OVERFLOW
 from app.settings.config import settings
 
 # URL налаштування для підключення до бази даних
@@ -14,10 +19,42 @@ ASYNC_SQLALCHEMY_DATABASE_URL = (
     f'{settings.database_port}/{settings.database_name}'
 )
 
+logger = get_logger('database', 'database.log')
+
 Base = declarative_base()
 
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
 # Створення асинхронного двигуна
-engine_async = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+engine_async = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=InstrumentedPool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=settings.db_pool_pre_ping,
+    connect_args={
+        # asyncpg prepared statements cached per connection by the SQLAlchemy dialect
+        "prepared_statement_cache_size": settings.db_prepared_statement_cache_size,
+    },
+)
+DB_POOL_IN_USE.set_function(lambda: engine_async.pool.checkedout())
+DB_POOL_IDLE.set_function(lambda: engine_async.pool.checkedin())
+DB_POOL_OVERFLOW.set_function(lambda: max(engine_async.pool.overflow(), 0))
 async_session_maker = async_sessionmaker(bind=engine_async, expire_on_commit=False)
 
 # Асинхронна функція для отримання сесії
@@ -26,22 +63,61 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
-# test session database
+async def ping(timeout: float = 2.0) -> bool:
+    """
+    Check that a pooled connection can run a trivial query within `timeout` seconds.
+    """
+    async def select_one():
+        async with engine_async.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    try:
+        await asyncio.wait_for(select_one(), timeout)
+        return True
+    except Exception as e:
+        logger.error(f"Database ping failed: {e}")
+        return False
+
+
+async def warm_pool(connections: int, deadline: float,
+                    initial_backoff: float = 0.1, max_backoff: float = 5.0):
+    """
+    Open `connections` pooled connections concurrently before traffic arrives.
+
+    Each connection is retried with exponential backoff until it succeeds or
+    `deadline` seconds have passed, in which case the last error is raised.
+    """
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    all_open = asyncio.Event()
+    opened = 0
+
+    async def open_connection(connection_number: int):
+        nonlocal opened
+        backoff = initial_backoff
+        while True:
+            try:
+                connection = await engine_async.connect()
+                break
+            except Exception as e:
+                if loop.time() + backoff > give_up_at:
+                    raise
+                logger.error(f"Connection {connection_number} to database failed, retrying in {backoff:.1f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+        try:
+            await connection.execute(text("SELECT 1"))
+            opened += 1
+            if opened == connections:
+                all_open.set()
+            # Hold the connection until all of them are open so the pool really grows
+            await all_open.wait()
+        finally:
+            await connection.close()
 
-while True:
+    tasks = [asyncio.create_task(open_connection(i)) for i in range(connections)]
     try:
-        conn = psycopg2.connect(
-            host=settings.database_hostname,
-            database=settings.database_name,
-            user=settings.database_username,
-            password=settings.database_password,
-            cursor_factory=RealDictCursor,
-        )
-        cursor = conn.cursor()
-        print("Database connection was successful")
-        break
-
-    except Exception as error:
-        print("Connection to database failed")
-        print("Error:", error)
-        time.sleep(2)
\ No newline at end of file
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import insert
+
+from _log_config.log_config import get_logger
+from app.database.database import async_session_maker
+from app.functions.func_changes import INSERT, record_changes
+from app.functions.func_conversations import upsert_conversation_summaries
+from app.metrics.metrics import DB_MESSAGE_INSERT
+from app.models import models
+from app.settings.config import settings
+
+logger = get_logger('message_writer', 'message_writer.log')
+
+
+class MessageWriter:
+    """
+    Group-commit writer for `private_messages`.
+
+    Rows inserted by concurrent sockets within `window` seconds (or until
+    `max_batch` rows are queued) are written as one multi-row
+    INSERT ... RETURNING in a single transaction, together with one upsert of
+    their conversation summaries and their change log entries. Every caller
+    gets back the `(id, created_at, seq)` of its own row.
+    """
+
+    def __init__(self, window: Optional[float] = None, max_batch: Optional[int] = None):
+        self.window = window if window is not None else settings.message_group_commit_window_ms / 1000
+        self.max_batch = max_batch or settings.message_group_commit_max_batch
+        self.pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes = set()
+
+    async def insert(self, row: dict) -> Tuple[UUID, datetime, int]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((row, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        write = asyncio.create_task(self._write(batch))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            with DB_MESSAGE_INSERT.labels(mode='group').time():
+                async with async_session_maker() as session:
+                    result = await session.execute(
+                        insert(models.PrivateMessage).returning(models.PrivateMessage.id,
+                                                                models.PrivateMessage.created_at,
+                                                                sort_by_parameter_order=True),
+                        [row for row, _ in batch]
+                    )
+                    inserted = result.all()
+                    await upsert_conversation_summaries(
+                        [(row['sender_id'], row['receiver_id'], message_id, created_at)
+                         for (row, _), (message_id, created_at) in zip(batch, inserted)],
+                        session
+                    )
+                    seqs = await record_changes(
+                        [(row['sender_id'], row['receiver_id'], message_id, INSERT)
+                         for (row, _), (message_id, _) in zip(batch, inserted)],
+                        session
+                    )
+                    await session.commit()
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} messages: {e}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), (message_id, created_at), seq in zip(batch, inserted, seqs):
+            if not future.done():
+                future.set_result((message_id, created_at, seq))
+
+    async def close(self):
+        self._flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+
+message_writer = MessageWriter()
@@ -1,44 +1,219 @@
-
-from _log_config.log_config import get_logger
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 from uuid import UUID
-from .func_notifications import get_user_fcm_tokens
-from sqlalchemy.ext.asyncio import AsyncSession
 
-import firebase_admin
-from firebase_admin import credentials, messaging
+from _log_config.log_config import get_logger
+from app.database.database import async_session_maker
+from app.metrics.metrics import FCM_SEND
 from app.settings.config import settings
-
-# Initialize the Firebase app with service account credentials
-cred = credentials.Certificate(settings.google_services)
-result = firebase_admin.initialize_app(cred)
+from .func_notifications import delete_fcm_tokens, get_online_conversations, get_users_fcm_tokens
 
 
 # Configure logging
 logger = get_logger('notification', 'notification.log')
 
+# Push outcome per token, as reported by a transport
+SENT, INVALID_TOKEN, FAILED = "sent", "invalid_token", "failed"
 
-# @router.post("/send_notification")
-async def send_notifications_private_message(
-                                        message: str,
-                                        sender: str,
-                                        recipient_id: UUID,
-                                        session: AsyncSession
-                                    ):
-    try:
-        fcm_tokens = await get_user_fcm_tokens(recipient_id, session)
-        if not fcm_tokens:
-            logger.info("No FCM tokens found for user")
-            return
-        for token in fcm_tokens:
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title=sender,
-                    body=message,
-                ),
-                token=token
+
+@dataclass
+class Push:
+    token: str
+    title: str
+    body: str
+
+
+class FirebaseTransport:
+    """
+    Sends pushes with `firebase_admin.messaging.send_each`.
+
+    The SDK is blocking: callers run `send_each` in a worker thread. The
+    Firebase app is initialised on first use so importing this module stays cheap.
+    """
+
+    def __init__(self):
+        self._app = None
+
+    def _messaging(self):
+        import firebase_admin
+        from firebase_admin import credentials, messaging
+
+        if self._app is None:
+            # Initialize the Firebase app with service account credentials
+            cred = credentials.Certificate(settings.google_services)
+            self._app = firebase_admin.initialize_app(cred)
+        return messaging
+
+    def send_each(self, pushes: List[Push]) -> List[str]:
+        messaging = self._messaging()
+        batch = messaging.send_each([
+            messaging.Message(
+                notification=messaging.Notification(title=push.title, body=push.body),
+                token=push.token
             )
-            response = messaging.send(message)
+            for push in pushes
+        ], app=self._app)
+
+        outcomes = []
+        for response in batch.responses:
+            if response.success:
+                outcomes.append(SENT)
+            elif isinstance(response.exception, (messaging.UnregisteredError,
+                                                 messaging.SenderIdMismatchError)):
+                # Only these mean the token itself is dead; INVALID_ARGUMENT may be the payload
+                outcomes.append(INVALID_TOKEN)
+            else:
+                logger.error(f"Error sending notification: {response.exception}")
+                outcomes.append(FAILED)
+        return outcomes
+
+
+def truncate_body(body: str, max_bytes: Optional[int] = None) -> str:
+    """
+    Cut `body` to at most `max_bytes` UTF-8 bytes (`settings.fcm_body_max_bytes`), ending with an ellipsis.
+    """
+    max_bytes = max_bytes or settings.fcm_body_max_bytes
+    data = body.encode('utf-8')
+    if len(data) <= max_bytes:
+        return body
+    ellipsis = "…"
+    cut = data[:max_bytes - len(ellipsis.encode('utf-8'))]
+    return cut.decode('utf-8', errors='ignore') + ellipsis
+
+
+@dataclass
+class PendingNotification:
+    due: float
+    title: str
+    messages: List[str] = field(default_factory=list)
+
+
+class NotificationDispatcher:
+    """
+    Queue of push notifications drained by background workers.
+
+    Messages to the same recipient from the same sender that arrive within
+    `coalesce_window` seconds are merged into one push. Each worker takes all
+    due recipients from the queue, leaves out those who have the conversation
+    open on another worker, loads their FCM tokens with one query and
+    sends up to `batch_size` pushes per `send_each` call in a worker thread.
+    Tokens the transport reports as invalid are deleted from `FCMTokenManager`.
+    """
+
+    def __init__(self, transport=None, workers: Optional[int] = None,
+                 coalesce_window: Optional[float] = None, batch_size: Optional[int] = None):
+        self.transport = transport or FirebaseTransport()
+        self.workers = workers or settings.fcm_workers
+        self.coalesce_window = coalesce_window if coalesce_window is not None else settings.fcm_coalesce_window
+        self.batch_size = batch_size or settings.fcm_batch_size
+        # (recipient id, sender id) -> messages waiting for the coalesce window
+        self.pending: Dict[Tuple[UUID, UUID], PendingNotification] = {}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.fcm_queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self, recipient_id: UUID, sender_id: UUID, sender: str, message: Optional[str]):
+        """
+        Queue a push for `recipient_id`, titled `sender`, without waiting for it to be sent.
+        """
+        self.start()
+        key = (recipient_id, sender_id)
+        pending = self.pending.get(key)
+        if pending is not None:
+            pending.messages.append(message or "")
+            return
+        try:
+            self.queue.put_nowait(key)
+        except asyncio.QueueFull:
+            logger.error(f"Notification queue is full, dropping push to {recipient_id}")
+            return
+        self.pending[key] = PendingNotification(due=time.monotonic() + self.coalesce_window,
+                                                title=sender, messages=[message or ""])
+
+    async def _worker(self):
+        while True:
+            keys = [await self.queue.get()]
+            delay = self.pending[keys[0]].due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Recipients queued behind this one that are also due go in the same batch
+            while len(keys) < self.batch_size and not self.queue.empty():
+                key = self.queue.get_nowait()
+                if self.pending[key].due > time.monotonic():
+                    # Still coalescing: back in the queue, nothing behind it is due either
+                    self.queue.put_nowait(key)
+                    self.queue.task_done()
+                    break
+                keys.append(key)
+            try:
+                await self._send(keys)
+            except Exception as e:
+                logger.error(f"Error sending notifications: {e}", exc_info=True)
+            finally:
+                for _ in keys:
+                    self.queue.task_done()
+
+    async def _send(self, keys: List[Tuple[UUID, UUID]]):
+        notifications = [(key, self.pending.pop(key)) for key in keys]
+        online = await self._load_online(keys)
+        notifications = [(key, pending) for key, pending in notifications if key not in online]
+        if not notifications:
+            return
+        tokens = await self._load_tokens(list({recipient_id for (recipient_id, _), _ in notifications}))
+
+        pushes = []
+        for (recipient_id, _), pending in notifications:
+            body = truncate_body("\n".join(pending.messages[-settings.fcm_coalesce_max_lines:]))
+            pushes.extend(Push(token=token, title=pending.title, body=body)
+                          for token in tokens.get(recipient_id, []))
+        if not pushes:
+            logger.info("No FCM tokens found for users")
+            return
+
+        invalid = []
+        for i in range(0, len(pushes), self.batch_size):
+            batch = pushes[i:i + self.batch_size]
+            with FCM_SEND.time():
+                outcomes = await asyncio.to_thread(self.transport.send_each, batch)
+            invalid.extend(push.token for push, outcome in zip(batch, outcomes) if outcome == INVALID_TOKEN)
+
+        logger.info(f"Sent {len(pushes)} notifications to {len(notifications)} recipients")
+        if invalid:
+            await self._prune_tokens(invalid)
+
+    async def _load_online(self, keys: List[Tuple[UUID, UUID]]) -> Set[Tuple[UUID, UUID]]:
+        # Only the postgres fan-out runs several workers; otherwise the caller's is_online saw everything
+        if settings.fanout_backend != "postgres":
+            return set()
+        async with async_session_maker() as session:
+            return await get_online_conversations(keys, session)
+
+    async def _load_tokens(self, recipient_ids: List[UUID]) -> Dict[UUID, List[str]]:
+        async with async_session_maker() as session:
+            return await get_users_fcm_tokens(recipient_ids, session)
+
+    async def _prune_tokens(self, fcm_tokens: List[str]):
+        async with async_session_maker() as session:
+            await delete_fcm_tokens(fcm_tokens, session)
+
+
+notification_dispatcher = NotificationDispatcher()
+
 
-        logger.info("Notifications sent to user")
-    except Exception as e:
-        logger.error(f"Error sending notification: {str(e)}")
\ No newline at end of file
+def send_notifications_private_message(message: Optional[str], sender: str, recipient_id: UUID,
+                                       sender_id: UUID):
+    """
+    Queue a push about a new private message; sending happens on the dispatcher workers.
+    """
+    notification_dispatcher.notify(recipient_id, sender_id, sender, message)
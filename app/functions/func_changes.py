@@ -0,0 +1,122 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from _log_config.log_config import get_logger
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.ids import conversation_key
+from app.models import models
+from app.settings.config import settings
+
+logger = get_logger('func_changes', 'func_changes.log')
+
+Sequence = models.ConversationSequence
+Change = models.ConversationChange
+
+INSERT, EDIT, DELETE, VOTE = "insert", "edit", "delete", "vote"
+
+
+def number_changes(keys: List[UUID], last_seq: Dict[UUID, int]) -> List[int]:
+    """
+    Number changes in the order given, per conversation.
+
+    Args:
+        keys: The conversation key of each change.
+        last_seq: The counter of each conversation after reserving its changes.
+
+    Returns:
+        The `seq` of each change.
+    """
+    counts = Counter(keys)
+    next_seq = {key: last_seq[key] - count for key, count in counts.items()}
+    seqs = []
+    for key in keys:
+        next_seq[key] += 1
+        seqs.append(next_seq[key])
+    return seqs
+
+
+async def record_changes(changes: Iterable[Tuple[UUID, UUID, UUID, str]],
+                         session: AsyncSession) -> List[int]:
+    """
+    Append `(user_id, peer_id, message_id, kind)` changes to the change log, in the caller's transaction.
+
+    Each conversation's counter is bumped once by the number of its changes
+    in one INSERT ... ON CONFLICT. The counter rows stay locked until the
+    caller commits, so a later writer to the same conversation gets higher
+    numbers and commits after: a reader never sees `seq` 7 before 6.
+
+    Returns:
+        The `seq` of each change, in the order given.
+    """
+    changes = [(conversation_key(user_id, peer_id), message_id, kind)
+               for user_id, peer_id, message_id, kind in changes]
+    if not changes:
+        return []
+    keys = [key for key, _, _ in changes]
+    counts = Counter(keys)
+
+    # Sorted so concurrent writers lock the counters in the same order
+    stmt = pg_insert(Sequence).values([dict(conversation_key=key, last_seq=counts[key])
+                                       for key in sorted(counts)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Sequence.conversation_key],
+        set_=dict(last_seq=Sequence.last_seq + stmt.excluded.last_seq)
+    ).returning(Sequence.conversation_key, Sequence.last_seq)
+    last_seq = dict((await session.execute(stmt)).all())
+
+    seqs = number_changes(keys, last_seq)
+    await session.execute(insert(Change), [
+        dict(conversation_key=key, seq=seq, message_id=message_id, kind=kind)
+        for (key, message_id, kind), seq in zip(changes, seqs)
+    ])
+    return seqs
+
+
+async def current_seq(user_id: UUID, peer_id: UUID, session: AsyncSession) -> int:
+    """
+    The `seq` of the latest change in the conversation, 0 before the first one.
+    """
+    seq = await session.scalar(select(Sequence.last_seq)
+                               .where(Sequence.conversation_key == conversation_key(user_id, peer_id)))
+    return seq or 0
+
+
+async def changed_since(user_id: UUID, peer_id: UUID, since: int, session: AsyncSession,
+                        limit: Optional[int] = None) -> Tuple[Optional[List[UUID]], int]:
+    """
+    Ids of the messages changed after `since`, in the order of their latest change.
+
+    One range of the change log's primary key, collapsed to one entry per message.
+
+    Args:
+        since: The last `seq` the client has seen.
+        limit: Most messages worth a delta, `settings.sync_max_changes` by default.
+
+    Returns:
+        The message ids, or None when a delta is not worth it: more than
+        `limit` messages changed, or `since` is ahead of the conversation,
+        and the client should reload its history instead. Then the current `seq`.
+    """
+    limit = limit or settings.sync_max_changes
+    seq = await current_seq(user_id, peer_id, session)
+    if since > seq:
+        return None, seq
+    if since == seq:
+        return [], seq
+
+    latest = func.max(Change.seq)
+    result = await session.execute(
+        select(Change.message_id).where(
+            Change.conversation_key == conversation_key(user_id, peer_id),
+            Change.seq > since,
+            Change.seq <= seq
+        ).group_by(Change.message_id).order_by(latest).limit(limit + 1)
+    )
+    message_ids = result.scalars().all()
+    if len(message_ids) > limit:
+        return None, seq
+    return message_ids, seq
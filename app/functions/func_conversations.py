@@ -0,0 +1,202 @@
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from _log_config.log_config import get_logger
+from fastapi import HTTPException, status
+from sqlalchemy import case, desc, func, literal, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.functions.func_private import decode_cursor, decrypt_bodies, encode_cursor, message_schema
+from app.models import models
+from app.schemas import schemas
+from app.security import auth_cache
+from app.security.auth_cache import UserSnapshot
+from app.settings.config import settings
+
+logger = get_logger('func_conversations', 'func_conversations.log')
+
+Summary = models.ConversationSummary
+
+
+def conversations_limit(limit: Optional[int] = None) -> int:
+    if not limit:
+        return settings.conversations_page_size
+    return min(limit, settings.conversations_max_page_size)
+
+
+def summary_rows(messages: Iterable[Tuple[UUID, UUID, UUID, datetime]]) -> list[dict]:
+    """
+    Collapse `(sender_id, receiver_id, message_id, created_at)` tuples into one
+    summary row per (user, peer), as inserted by `upsert_conversation_summaries`.
+
+    The rows are sorted by key so concurrent upserts lock them in the same
+    order: A writing to B and B writing to A at once cannot deadlock.
+    """
+    rows = {}
+    for sender_id, receiver_id, message_id, created_at in messages:
+        for user_id, peer_id, unread in ((sender_id, receiver_id, 0), (receiver_id, sender_id, 1)):
+            if user_id == peer_id and unread:
+                # Notes to self are never unread
+                continue
+            row = rows.get((user_id, peer_id))
+            if row is None:
+                rows[(user_id, peer_id)] = dict(user_id=user_id, peer_id=peer_id, last_message_id=message_id,
+                                                last_activity=created_at, unread_count=unread)
+                continue
+            row['unread_count'] += unread
+            if created_at >= row['last_activity']:
+                row['last_message_id'], row['last_activity'] = message_id, created_at
+    return [rows[key] for key in sorted(rows, key=lambda key: (str(key[0]), str(key[1])))]
+
+
+async def upsert_conversation_summaries(messages: Iterable[Tuple[UUID, UUID, UUID, datetime]],
+                                        session: AsyncSession):
+    """
+    Record newly inserted messages in `conversation_summaries`, in the caller's transaction.
+
+    Both sides of each conversation are upserted by one INSERT ... ON CONFLICT:
+    the last message moves forward only, and the receiver's unread count grows.
+    """
+    rows = summary_rows(messages)
+    if not rows:
+        return
+    stmt = pg_insert(Summary).values(rows)
+    excluded = stmt.excluded
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[Summary.user_id, Summary.peer_id],
+        set_=dict(
+            last_message_id=case((excluded.last_activity >= Summary.last_activity, excluded.last_message_id),
+                                 else_=Summary.last_message_id),
+            last_activity=func.greatest(Summary.last_activity, excluded.last_activity),
+            unread_count=Summary.unread_count + excluded.unread_count,
+        )
+    ))
+
+
+def refresh_unread_counts_statement(receipts):
+    """
+    UPDATE recounting `unread_count` for the (reader_id, sender_id, up_to) rows of `receipts`.
+
+    Only messages newer than `up_to` are counted: everything up to it has just
+    been marked read, so the count walks a short range of the pair index.
+    """
+    unread = select(func.count()).where(
+        models.PrivateMessage.sender_id == receipts.c.sender_id,
+        models.PrivateMessage.receiver_id == receipts.c.reader_id,
+        models.PrivateMessage.created_at > receipts.c.up_to,
+        models.PrivateMessage.is_read
+    ).scalar_subquery()
+    return update(Summary).where(
+        Summary.user_id == receipts.c.reader_id,
+        Summary.peer_id == receipts.c.sender_id
+    ).values(unread_count=unread)
+
+
+async def fetch_conversations(user: UserSnapshot, session: AsyncSession,
+                              before: Optional[str] = None,
+                              limit: Optional[int] = None) -> schemas.ConversationsPage:
+    """
+    One page of `user`'s conversations, most recent activity first.
+
+    Reads `limit` summary rows by index, joins each last message by primary
+    key and resolves the peers through `auth_cache`.
+
+    Args:
+        user: The current user.
+        session: The database session.
+        before: Cursor from the previous page, None for the first page.
+        limit: Page size, capped at `settings.conversations_max_page_size`.
+
+    Returns:
+        ConversationsPage: The conversations and the cursor of the next page.
+    """
+    limit = conversations_limit(limit)
+    query = select(Summary, models.PrivateMessage).outerjoin(
+        models.PrivateMessage, models.PrivateMessage.id == Summary.last_message_id
+    ).where(Summary.user_id == user.id)
+    if before:
+        last_activity, peer_id = decode_cursor(before)
+        query = query.where(tuple_(Summary.last_activity, Summary.peer_id) < tuple_(last_activity, peer_id))
+    query = query.order_by(desc(Summary.last_activity), desc(Summary.peer_id)).limit(limit)
+
+    try:
+        rows = (await session.execute(query)).all()
+        peers = await auth_cache.get_users([summary.peer_id for summary, _ in rows], session)
+        messages = [private for _, private in rows if private is not None]
+        bodies = dict(zip((private.id for private in messages), await decrypt_bodies(messages)))
+    except Exception as e:
+        logger.error(f"Error fetching conversations: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error fetching conversations")
+
+    conversations = []
+    for summary, private in rows:
+        peer = peers.get(summary.peer_id)
+        last_message = None
+        if private is not None:
+            sender = user if private.sender_id == user.id else peer
+            last_message = message_schema(private, sender, bodies[private.id])
+        if peer is not None:
+            peer_schema = schemas.ConversationPeer(id=peer.id, user_name=peer.user_name,
+                                                   avatar=peer.avatar, verified=peer.verified)
+        else:
+            peer_schema = schemas.ConversationPeer(id=summary.peer_id)
+        conversations.append(schemas.ConversationSummary(
+            peer=peer_schema,
+            last_message=last_message,
+            last_activity=summary.last_activity,
+            unread_count=summary.unread_count,
+        ))
+
+    next_cursor = None
+    if len(rows) == limit:
+        oldest = rows[-1][0]
+        next_cursor = encode_cursor(oldest.last_activity, oldest.peer_id)
+    return schemas.ConversationsPage(conversations=conversations, before=next_cursor)
+
+
+async def rebuild_conversation_summaries(user_ids: List[UUID], session: AsyncSession) -> int:
+    """
+    Recompute the summary rows of `user_ids` from `private_messages`, and commit.
+
+    Reads the messages sent and received by these users through the sender
+    and receiver indexes: meant for the backfill after the table is created,
+    which walks the users in batches, or for repairs, not for the request path.
+    A row that a concurrent send has already moved past the rebuilt last
+    message is left alone.
+
+    Returns:
+        int: The number of summary rows written.
+    """
+    pm = models.PrivateMessage
+    sides = union_all(
+        select(pm.sender_id.label('user_id'), pm.receiver_id.label('peer_id'),
+               pm.id, pm.created_at, literal(0).label('unread'))
+        .where(pm.sender_id.in_(user_ids)),
+        select(pm.receiver_id.label('user_id'), pm.sender_id.label('peer_id'),
+               pm.id, pm.created_at, case((pm.is_read, 1), else_=0).label('unread'))
+        .where(pm.receiver_id.in_(user_ids), pm.sender_id != pm.receiver_id)
+    ).subquery()
+    latest = select(
+        sides.c.user_id, sides.c.peer_id,
+        func.array_agg(aggregate_order_by(sides.c.id, desc(sides.c.created_at), desc(sides.c.id)))[1],
+        func.max(sides.c.created_at),
+        func.sum(sides.c.unread)
+    ).group_by(sides.c.user_id, sides.c.peer_id)
+
+    stmt = pg_insert(Summary).from_select(
+        ['user_id', 'peer_id', 'last_message_id', 'last_activity', 'unread_count'], latest
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Summary.user_id, Summary.peer_id],
+        set_=dict(last_message_id=stmt.excluded.last_message_id,
+                  last_activity=stmt.excluded.last_activity,
+                  unread_count=stmt.excluded.unread_count),
+        where=Summary.last_activity <= stmt.excluded.last_activity
+    )
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.rowcount
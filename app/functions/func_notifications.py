@@ -1,7 +1,10 @@
+from datetime import timedelta
 from uuid import UUID
-from typing import List
+from typing import Dict, List, Set, Tuple
 from _log_config.log_config import get_logger
 from app.models import models
+from app.settings.config import settings
+from sqlalchemy import delete, func, tuple_
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -18,4 +21,35 @@ async def get_user_fcm_tokens(user_id: UUID, session: AsyncSession, ) -> List[st
     return tokens
 
 
+async def get_users_fcm_tokens(user_ids: List[UUID], session: AsyncSession) -> Dict[UUID, List[str]]:
+    result = await session.execute(
+        select(models.FCMTokenManager.user_id, models.FCMTokenManager.fcm_token)
+        .where(models.FCMTokenManager.user_id.in_(user_ids))
+    )
+    tokens: Dict[UUID, List[str]] = {}
+    for user_id, token in result.all():
+        tokens.setdefault(user_id, []).append(token)
+    return tokens
+
+
+async def delete_fcm_tokens(fcm_tokens: List[str], session: AsyncSession):
+    await session.execute(
+        delete(models.FCMTokenManager).where(models.FCMTokenManager.fcm_token.in_(fcm_tokens))
+    )
+    await session.commit()
+    logger.info(f"Pruned {len(fcm_tokens)} invalid FCM tokens")
+
+
 
+async def get_online_conversations(pairs: List[Tuple[UUID, UUID]],
+                                   session: AsyncSession) -> Set[Tuple[UUID, UUID]]:
+    """
+    The (user_id, peer_id) pairs of `pairs` open on a socket of any worker, per `conversation_presence`.
+    """
+    presence = models.ConversationPresence
+    result = await session.execute(
+        select(presence.user_id, presence.peer_id).distinct()
+        .where(tuple_(presence.user_id, presence.peer_id).in_(pairs),
+               presence.seen_at > func.now() - timedelta(seconds=settings.presence_ttl))
+    )
+    return set(result.all())
@@ -1,17 +1,26 @@
 import asyncio
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 from uuid import UUID
 from _log_config.log_config import get_logger
 from fastapi import HTTPException, status
 from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
 
-from sqlalchemy import and_, asc, or_, update, func
+from sqlalchemy import asc, delete, desc, exists, literal, tuple_, union_all, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from app.database.database import async_session_maker
+from app.cache.cache import MISSING, decrypted_messages
+from app.database.database import engine_async
+from app.database.ids import conversation_key
+from app.functions.func_changes import DELETE, EDIT, VOTE, record_changes
 from app.models import models
-from app.schemas import schemas
+from app.schemas import frames, schemas
 from app.schemas.schemas import ChatMessagesSchema
-from app.security.crypto_messages import async_decrypt
+from app.security import auth_cache
+from app.security.crypto_messages import decrypt_many
 from app.settings.config import settings
 
 
@@ -19,68 +28,175 @@ logger = get_logger('func_private', 'func_private.log')
 
 
 
+def encode_cursor(created_at: datetime, message_id: UUID) -> str:
+    """
+    Build an opaque history cursor from the (created_at, id) keyset of a message.
+    """
+    raw = f"{created_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Parse a cursor produced by `encode_cursor`.
+
+    Raises:
+        HTTPException: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8')
+        created_at, message_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), UUID(message_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid history cursor")
+
+
+def body_key(private: models.PrivateMessage) -> Tuple[UUID, bytes]:
+    """
+    Cache key of a decrypted body: the message id and a digest of its ciphertext.
+
+    An edit stores a new ciphertext, so every worker misses on the new key
+    instead of serving the old plaintext until it expires.
+    """
+    return private.id, hashlib.blake2b(private.message.encode('utf-8'), digest_size=16).digest()
+
+
+async def decrypt_bodies(privates: list[models.PrivateMessage]) -> list[Optional[str]]:
+    """
+    Decrypted bodies of `privates`, served from `decrypted_messages` where possible.
+
+    Only cache misses are decrypted, in one `decrypt_many` batch, and then cached.
+    Rows without a body, such as deleted messages, are never looked up.
+    """
+    bodies = [decrypted_messages.get(body_key(private)) if private.message is not None else None
+              for private in privates]
+    missing = [i for i, body in enumerate(bodies) if body is MISSING]
+    if missing:
+        decrypted = await decrypt_many([privates[i].message for i in missing])
+        for i, body in zip(missing, decrypted):
+            bodies[i] = body
+            decrypted_messages.set(body_key(privates[i]), body)
+    return bodies
+
+
+def message_schema(private: models.PrivateMessage, user, body: Optional[str]) -> ChatMessagesSchema:
+    """
+    Build the socket representation of `private`, sent by `user` (a User or UserSnapshot).
+    """
+    return schemas.ChatMessagesSchema(
+        created_at=private.created_at,
+        id=private.id,
+        receiver_id=private.sender_id,
+        message=body,
+        fileUrl=private.fileUrl,
+        voiceUrl=private.voiceUrl,
+        videoUrl=private.videoUrl,
+        id_return=private.id_return,
+        user_name=user.user_name if user is not None else "Unknown user",
+        verified=user.verified if user is not None else None,
+        avatar=user.avatar if user is not None else "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/photo_2024-06-14_19-20-40.jpg",
+        is_read=private.is_read,
+        vote=private.vote_count,
+        edited=private.edited,
+        deleted=private.deleted
+    )
+
+
+def history_limit(limit: Optional[int] = None) -> int:
+    if not limit:
+        return settings.history_page_size
+    return min(limit, settings.history_max_page_size)
+
+
+def history_cursor(messages: list[ChatMessagesSchema], limit: int) -> Optional[str]:
+    """
+    Cursor for the page older than `messages`, or None when the history is exhausted.
+    """
+    if len(messages) < limit:
+        return None
+    oldest = messages[0]
+    return encode_cursor(oldest.created_at, oldest.id)
+
+
+def _history_range(where, before: Optional[Tuple[datetime, UUID]], limit: int):
+    query = select(
+        models.PrivateMessage.id, models.PrivateMessage.created_at
+    ).where(*where)
+    if before is not None:
+        query = query.where(
+            tuple_(models.PrivateMessage.created_at, models.PrivateMessage.id) < tuple_(*before)
+        )
+    return query.order_by(
+        desc(models.PrivateMessage.created_at), desc(models.PrivateMessage.id)
+    ).limit(limit)
+
+
 async def fetch_last_private_messages(sender_id: UUID, receiver_id: UUID,
-                                      session: AsyncSession) -> list[ChatMessagesSchema]:
+                                      session: AsyncSession,
+                                      before: Optional[str] = None,
+                                      limit: Optional[int] = None) -> list[ChatMessagesSchema]:
     
     """
-    Fetch the last private messages between two users from the database.
+    Fetch one page of private messages between two users from the database.
+
+    With `settings.history_by_conversation_key` the conversation is read as
+    one ordered range of `ix_private_messages_conversation_created`, otherwise
+    each direction as a range of `ix_private_messages_pair_created`. Only the
+    newest `limit` rows older than the cursor are read, so the cost follows
+    the page size rather than the length of the conversation. Senders are
+    resolved once per page through `auth_cache` instead of a join per row.
+
+    Messages are ordered by `(created_at, id)`. Rows written by one group
+    commit share `created_at`; their UUIDv7 ids keep them in the order they
+    were sent.
 
     Args:
     session (AsyncSession): The database session to execute the query.
     sender_id (int): The ID of the user who sent the message.
     receiver_id (int): The ID of the user who received the message.
+    before (str): Cursor returned with the previous page, None for the newest page.
+    limit (int): Page size, defaults to `settings.history_page_size`.
 
     Returns:
-    List[dict]: A list of dictionaries containing message details.
+    List[ChatMessagesSchema]: The page in chronological order.
     """
+    limit = history_limit(limit)
+    keyset = decode_cursor(before) if before else None
     try:
+        if settings.history_by_conversation_key:
+            page = _history_range(
+                [models.PrivateMessage.conversation_key == conversation_key(sender_id, receiver_id)],
+                keyset, limit
+            ).subquery()
+        else:
+            directions = [(sender_id, receiver_id)]
+            if str(sender_id) != str(receiver_id):
+                # Notes to self have a single direction, reading it twice would duplicate the page
+                directions.append((receiver_id, sender_id))
+            sides = union_all(*(
+                _history_range([models.PrivateMessage.sender_id == one,
+                                models.PrivateMessage.receiver_id == other], keyset, limit)
+                for one, other in directions
+            )).subquery()
+            page = select(sides.c.id).order_by(
+                desc(sides.c.created_at), desc(sides.c.id)
+            ).limit(limit).subquery()
+
         query = select(
-            models.PrivateMessage,
-            models.User,
-            func.coalesce(func.sum(models.PrivateMessageVote.dir), 0).label('vote')
+            models.PrivateMessage
         ).join(
-            models.User, models.PrivateMessage.sender_id == models.User.id
-        ).outerjoin(
-            models.PrivateMessageVote, models.PrivateMessage.id == models.PrivateMessageVote.message_id
-        ).where(
-            or_(
-                and_(models.PrivateMessage.sender_id == sender_id, models.PrivateMessage.receiver_id == receiver_id),
-                and_(models.PrivateMessage.sender_id == receiver_id, models.PrivateMessage.receiver_id == sender_id)
-                )
-        ).group_by(
-            models.PrivateMessage.id, models.User.id
-        ).order_by(asc(models.PrivateMessage.id))
+            page, models.PrivateMessage.id == page.c.id
+        ).order_by(asc(models.PrivateMessage.created_at), asc(models.PrivateMessage.id))
 
         result = await session.execute(query)
-        raw_messages = result.all()
-
-        messages = []
-        for private, user, votes in raw_messages:
-            decrypted_message = await async_decrypt(private.message)
-            if decrypted_message is None:
-                decrypted_message = None
-
-            messages.append(
-                schemas.ChatMessagesSchema(
-                    created_at=private.created_at,
-                    id=private.id,
-                    receiver_id=private.sender_id,
-                    message=decrypted_message,
-                    fileUrl=private.fileUrl,
-                    voiceUrl=private.voiceUrl,
-                    videoUrl=private.videoUrl,
-                    id_return=private.id_return,
-                    user_name=user.user_name if user is not None else "Unknown user",
-                    verified=user.verified,
-                    avatar=user.avatar if user is not None else "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/photo_2024-06-14_19-20-40.jpg",
-                    is_read=private.is_read,
-                    vote=votes,
-                    edited=private.edited,
-                    deleted=private.deleted
-                )
-            )
-        # messages.reverse()
-        return messages
+        privates = result.scalars().all()
+
+        senders = await auth_cache.get_users({private.sender_id for private in privates}, session)
+        bodies = await decrypt_bodies(privates)
+
+        return [message_schema(private, senders.get(private.sender_id), body)
+                for private, body in zip(privates, bodies)]
     except Exception as e:
         logger.error(f"Error fetching last private messages: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -88,38 +204,128 @@ async def fetch_last_private_messages(sender_id: UUID, receiver_id: UUID,
 
 
 
-async def send_messages_via_websocket(messages, websocket):
+async def fetch_messages_by_id(message_ids: list[UUID], session: AsyncSession) -> list[ChatMessagesSchema]:
+    """
+    The current state of `message_ids`, in that order, deleted ones included.
+
+    Args:
+    message_ids (list[UUID]): The messages to fetch, as listed by `func_changes.changed_since`.
+    session (AsyncSession): The database session to execute the query.
+    """
+    if not message_ids:
+        return []
+    result = await session.execute(
+        select(models.PrivateMessage).where(models.PrivateMessage.id.in_(message_ids))
+    )
+    found = {private.id: private for private in result.scalars().all()}
+    privates = [found[message_id] for message_id in message_ids if message_id in found]
+    senders = await auth_cache.get_users({private.sender_id for private in privates}, session)
+    bodies = await decrypt_bodies(privates)
+    return [message_schema(private, senders.get(private.sender_id), body)
+            for private, body in zip(privates, bodies)]
+
+
+async def fetch_reply_previews(messages: list[ChatMessagesSchema],
+                               session: AsyncSession) -> dict[UUID, schemas.ReplyPreview]:
+    """
+    Previews of the messages quoted (`id_return`) by `messages`, by id.
+
+    Quotes of messages in the same page are built from it; the others are
+    read with one `IN` query. Bodies are cut to `settings.reply_preview_length`.
+    """
+    in_page = {message.id: message for message in messages}
+    quoted = {message.id_return for message in messages if message.id_return is not None}
+    previews = {}
+    missing = []
+    for message_id in quoted:
+        message = in_page.get(message_id)
+        if message is None:
+            missing.append(message_id)
+            continue
+        previews[message_id] = reply_preview(message_id, message.receiver_id, message.message,
+                                             bool(message.fileUrl or message.voiceUrl or message.videoUrl),
+                                             message.deleted)
+
+    if missing:
+        result = await session.execute(
+            select(models.PrivateMessage.id, models.PrivateMessage.sender_id, models.PrivateMessage.message,
+                   models.PrivateMessage.fileUrl, models.PrivateMessage.voiceUrl,
+                   models.PrivateMessage.videoUrl, models.PrivateMessage.deleted)
+            .where(models.PrivateMessage.id.in_(missing))
+        )
+        rows = result.all()
+        bodies = await decrypt_bodies(rows)
+        for row, body in zip(rows, bodies):
+            previews[row.id] = reply_preview(row.id, row.sender_id, body,
+                                             bool(row.fileUrl or row.voiceUrl or row.videoUrl), row.deleted)
+    return previews
+
+
+def reply_preview(message_id: UUID, sender_id: UUID, body: Optional[str], has_media: bool,
+                  deleted: Optional[bool]) -> schemas.ReplyPreview:
+    if deleted:
+        return schemas.ReplyPreview(id=message_id, sender_id=sender_id, deleted=True)
+    if body is not None and len(body) > settings.reply_preview_length:
+        body = body[:settings.reply_preview_length] + "…"
+    return schemas.ReplyPreview(id=message_id, sender_id=sender_id, message=body, has_media=has_media)
+
+
+async def send_history_page(messages: list[ChatMessagesSchema], before: Optional[str], websocket,
+                            replies: Optional[dict[UUID, schemas.ReplyPreview]] = None):
+    """
+    Send a history page: its messages in batched `{"messages": [...]}` frames,
+    then a `{"history": {...}}` frame with the cursor for the next older page.
+    """
+    await send_messages_via_websocket(messages, websocket, replies)
+    await websocket.send_text(frames.history_frame(before))
+
+
+
+async def send_messages_via_websocket(messages, websocket,
+                                      replies: Optional[dict[UUID, schemas.ReplyPreview]] = None):
+    """
+    Send `messages` as size-capped `{"messages": [...]}` frames, each message
+    encoded once, with the `users` and `replies` maps they refer to.
+    """
     try:
-        for message in messages:
-            wrapped_message = await schemas.wrap_message(message)
-            json_message = wrapped_message.model_dump_json()
-            await websocket.send_text(json_message)
+        for frame in frames.messages_frames(messages, replies=replies):
+            await websocket.send_text(frame)
     except Exception as e:
         logger.error(f"Error sending messages via websocket: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Error sending messages via websocket")
 
 
-async def fetch_one_message(message_id: int, session: AsyncSession): #-> schemas.SocketModel:
+async def message_update_json(private: models.PrivateMessage, session: AsyncSession,
+                              seq: Optional[int] = None) -> str:
+    """
+    Serialize an `update` frame for a message row already in hand, tagged with change `seq` if given.
+
+    The sender comes from `auth_cache` and the body from `decrypted_messages`,
+    so echoing a vote needs no further SELECT on warm caches.
+    """
+    user = await auth_cache.get_user(private.sender_id, session)
+    body, = await decrypt_bodies([private])
+    return frames.update_frame(message_schema(private, user, body), seq)
+
+
+async def fetch_one_message(message_id: int, session: AsyncSession,
+                            seq: Optional[int] = None): #-> schemas.SocketModel:
     """
     Fetch a single private message from the database.
 
     Args:
     message_id (int): The ID of the message to fetch.
+    seq (int): Change log `seq` the `update` frame is tagged with, if any.
     """
     try:
         query = select(
             models.PrivateMessage,
-            models.User,
-            func.coalesce(func.sum(models.PrivateMessageVote.dir), 0).label('votes')
-        ).outerjoin(
-            models.PrivateMessageVote, models.PrivateMessage.id == models.PrivateMessageVote.message_id
+            models.User
         ).outerjoin(
             models.User, models.PrivateMessage.sender_id == models.User.id
         ).filter(
             models.PrivateMessage.id == message_id
-        ).group_by(
-            models.PrivateMessage.id, models.User.id
         )
 
         result = await session.execute(query)
@@ -127,28 +333,10 @@ async def fetch_one_message(message_id: int, session: AsyncSession): #-> schemas
 
         # Convert raw messages to SocketModel
         if raw_message:
-            private, user, votes = raw_message
-            decrypted_message = await async_decrypt(private.message)
-
-            message = schemas.ChatMessagesSchema(
-                created_at=private.created_at,
-                id=private.id,
-                receiver_id=private.sender_id,
-                message=decrypted_message,
-                fileUrl=private.fileUrl,
-                voiceUrl=private.voiceUrl,
-                videoUrl=private.videoUrl,
-                id_return=private.id_return,
-                user_name=user.user_name if user is not None else "Unknown user",
-                verified=user.verified,
-                avatar=user.avatar if user is not None else "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/photo_2024-06-14_19-20-40.jpg",
-                is_read=private.is_read,
-                vote=votes,
-                edited=private.edited,
-                deleted=private.deleted
-            )
-            wrapped_message_update = await schemas.wrap_message_update(message)
-            return wrapped_message_update.model_dump_json()
+            private, user = raw_message
+            decrypted_message, = await decrypt_bodies([private])
+
+            return frames.update_frame(message_schema(private, user, decrypted_message), seq)
 
         else:
             raise HTTPException(status_code=404, detail="Message not found")
@@ -161,124 +349,208 @@ async def fetch_one_message(message_id: int, session: AsyncSession): #-> schemas
 
 async def get_recipient_by_id(receiver_id: UUID, session: AsyncSession):
     try:
-        recipient = await session.execute(select(models.User).filter(models.User.id == receiver_id))
-        result = recipient.scalars().first()
-
-        return result
+        return await auth_cache.get_user(receiver_id, session)
     except Exception as e:
         logger.error(f"Error fetching recipient by ID: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to get recipient id  {e}")
 
+    
+# pg_advisory_lock key held by the worker running vote reconciliation
+VOTE_RECONCILE_LOCK = 0x766F7465
 
 
-async def mark_messages_as_read(user_id: UUID, sender_id: UUID):
+async def recount_votes(message_ids: List[UUID], connection: AsyncConnection) -> int:
     """
-    Marks all private messages sent by a specific user as unread for a specific recipient.
+    Set `PrivateMessage.vote_count` of `message_ids` from the votes table, in the caller's transaction.
 
-    Args:
-
-        user_id (int): The ID of the recipient.
-        sender_id (int): The ID of the user who sent the messages.
+    The message rows are locked first, in id order, and counted by a second
+    statement, so a `process_vote` committed in between is counted and one
+    still running waits and applies its change on top. Rows already right are
+    not written.
 
     Returns:
-        None
+        int: The number of corrected messages.
+    """
+    if not message_ids:
+        return 0
+    await connection.execute(
+        select(models.PrivateMessage.id).where(models.PrivateMessage.id.in_(message_ids))
+        .order_by(models.PrivateMessage.id).with_for_update()
+    )
+    actual = select(
+        func.coalesce(func.sum(models.PrivateMessageVote.dir), 0)
+    ).where(
+        models.PrivateMessageVote.message_id == models.PrivateMessage.id
+    ).scalar_subquery()
+    result = await connection.execute(
+        update(models.PrivateMessage)
+        .where(models.PrivateMessage.id.in_(message_ids),
+               models.PrivateMessage.vote_count.is_distinct_from(actual))
+        .values(vote_count=actual)
+    )
+    return result.rowcount
+
+
+async def reconcile_vote_counts(since: datetime, batch_size: int = 1000) -> Optional[int]:
+    """
+    Repair `PrivateMessage.vote_count` of messages voted on, or deleted, since `since`.
 
-    Raises:
-        HTTPException: If an error occurs while updating the database.
+    Candidates come from the vote and delete entries of the change log, and
+    are recounted with `recount_votes` in batches of `batch_size`, one
+    transaction each. Only one worker runs at a time, behind a session
+    advisory lock.
+
+    Returns:
+        Optional[int]: The number of corrected messages, None if another worker holds the lock.
     """
-    async with async_session_maker() as session:
+    async with engine_async.connect() as connection:
+        locked = await connection.scalar(select(func.pg_try_advisory_lock(VOTE_RECONCILE_LOCK)))
+        await connection.commit()
+        if not locked:
+            return None
         try:
-            await session.execute(
-                update(models.PrivateMessage)
-                .where(models.PrivateMessage.receiver_id == user_id,
-                       models.PrivateMessage.is_read).filter(models.PrivateMessage.sender_id == sender_id)
-                .values(is_read=False)
+            result = await connection.execute(
+                select(models.ConversationChange.message_id).distinct()
+                .where(models.ConversationChange.kind.in_((VOTE, DELETE)),
+                       models.ConversationChange.created_at > since)
             )
-            await session.commit()
+            message_ids = sorted(result.scalars().all())
+            await connection.commit()
+
+            fixed = 0
+            for i in range(0, len(message_ids), batch_size):
+                fixed += await recount_votes(message_ids[i:i + batch_size], connection)
+                await connection.commit()
+            return fixed
+        finally:
+            await connection.rollback()
+            await connection.execute(select(func.pg_advisory_unlock(VOTE_RECONCILE_LOCK)))
+            await connection.commit()
+
+
+async def vote_reconciliation_task(interval: float):
+    """
+    Run `reconcile_vote_counts` every `interval` seconds over the last
+    `settings.vote_reconcile_lookback` seconds of votes. Counts that drifted
+    before that are repaired by the `vote-counts` backfill.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            since = datetime.now(timezone.utc) - timedelta(seconds=settings.vote_reconcile_lookback)
+            fixed = await reconcile_vote_counts(since)
+            if fixed:
+                logger.warning(f"Reconciled vote_count on {fixed} messages")
         except Exception as e:
-            logger.error(f"Error marking messages as read: {e}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail=f"Failed to mark messages as read {e}")
-    
-vote_lock = asyncio.Lock()
+            logger.error(f"Error reconciling vote counts: {e}", exc_info=True)
+
+
+def _toggle_vote_statement(vote: schemas.Vote, user_id: UUID):
+    """
+    Build the single statement that toggles `user_id`'s vote on a message.
+
+    The vote row is deleted if present, otherwise inserted when `dir` is 1,
+    and `vote_count` moves by exactly the rows that changed, returned as
+    `votes_changed` with the message columns. Concurrent
+    toggles are ordered by the row locks on the `(user_id, message_id)` key
+    and on the message, so no application lock is needed.
+    """
+    votes = models.PrivateMessageVote.__table__
+    messages = models.PrivateMessage.__table__
+    target = messages.alias('target')
+    votable = exists().where(target.c.id == vote.message_id, target.c.deleted.is_not(True))
+
+    removed = delete(votes).where(
+        votes.c.user_id == user_id,
+        votes.c.message_id == vote.message_id,
+        votable
+    ).returning(votes.c.dir).cte('removed')
+    delta = -func.coalesce(select(func.sum(removed.c.dir)).scalar_subquery(), 0)
+    changed = select(func.count()).select_from(removed).scalar_subquery()
+
+    if vote.dir == 1:
+        added = pg_insert(votes).from_select(
+            ['user_id', 'message_id', 'dir'],
+            select(
+                literal(user_id, votes.c.user_id.type),
+                literal(vote.message_id, votes.c.message_id.type),
+                literal(vote.dir, votes.c.dir.type)
+            ).where(~exists(select(removed.c.dir)), votable)
+        ).on_conflict_do_nothing().returning(votes.c.dir).cte('added')
+        delta = delta + func.coalesce(select(func.sum(added.c.dir)).scalar_subquery(), 0)
+        changed = changed + select(func.count()).select_from(added).scalar_subquery()
+
+    return update(messages).where(
+        messages.c.id == vote.message_id,
+        messages.c.deleted.is_not(True)
+    ).values(
+        vote_count=messages.c.vote_count + delta
+    ).returning(*messages.c, changed.label('votes_changed'))
+
+
 async def process_vote(vote: schemas.Vote,
                        session: AsyncSession,
                        current_user: models.User):
     """
     Processes a vote submitted by a user.
 
+    The toggle and the `PrivateMessage.vote_count` change run as one atomic
+    statement, so votes on different messages proceed in parallel.
+
     Args:
         vote (schemas.Vote): The vote submitted by the user.
         session (AsyncSession): The database session.
         current_user (models.User): The current user.
 
     Returns:
-        dict: A message indicating the result of the vote.
+        Tuple[Row, Optional[int]]: The message columns with the new `vote_count`,
+        and the change log `seq` of the vote, None if no vote row changed,
+        as for a `dir` 0 vote on a message the user had not voted on.
 
     Raises:
         HTTPException: If an error occurs while processing the vote.
     """
-    async with vote_lock:
-        try:
-            # Check if the message exists
-            result = await session.execute(select(models.PrivateMessage).filter(models.PrivateMessage.id == vote.message_id))
-            message = result.scalars().first()
+    try:
+        result = await session.execute(_toggle_vote_statement(vote, current_user.id))
+        message = result.first()
+        seq = None
+        if message is not None and message.votes_changed:
+            seq, = await record_changes([(message.sender_id, message.receiver_id, message.id, VOTE)], session)
+        await session.commit()
 
-            if not message:
+        if message is None:
+            # Nothing was toggled: tell a missing message from a deleted one
+            deleted = await session.scalar(select(models.PrivateMessage.deleted)
+                                           .where(models.PrivateMessage.id == vote.message_id))
+            if deleted is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                     detail=f"Message with id: {vote.message_id} does not exist")
-            if message.deleted:
-                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                    detail="Message has been deleted")
-
-            # Check if the user has already voted on this message
-            vote_result = await session.execute(select(models.PrivateMessageVote).filter(
-                models.PrivateMessageVote.message_id == vote.message_id,
-                models.PrivateMessageVote.user_id == current_user.id
-            ))
-            found_vote = vote_result.scalars().first()
-
-            # Toggle vote logic
-            if vote.dir == 1:
-                if found_vote:
-                    # If vote exists, remove it
-                    await session.delete(found_vote)
-                    await session.commit()
-                    return {"notice": "Successfully removed vote"}
-                else:
-                    # If vote does not exist, add it
-                    new_vote = models.PrivateMessageVote(message_id=vote.message_id,
-                                                         user_id=current_user.id,
-                                                         dir=vote.dir)
-                    session.add(new_vote)
-                    await session.commit()
-                    return {"notice": "Successfully added vote"}
-
-            else:
-                if not found_vote:
-                    return {"notice": "Vote does not exist or has already been removed"}
-
-                # Remove the vote
-                await session.delete(found_vote)
-                await session.commit()
-                return {"notice": "Successfully deleted vote"}
-
-        except HTTPException as http_exc:
-            logger.error(f"HTTP error occurred: {http_exc.detail}")
-            raise http_exc
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="Message has been deleted")
+        return message, seq
 
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}", exc_info=True)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail=f"An unexpected error occurred {e}")
+    except HTTPException as http_exc:
+        logger.error(f"HTTP error occurred: {http_exc.detail}")
+        raise http_exc
+
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Unexpected error: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"An unexpected error occurred {e}")
 
 
 
 async def change_message(message_id: UUID, message_update: schemas.ChatUpdateMessage,
                          session: AsyncSession,
-                         current_user: models.User):
+                         current_user: models.User) -> int:
+    """
+    Edit a message of `current_user`.
 
+    Returns:
+        int: The change log `seq` of the edit.
+    """
     try:
         query = select(models.PrivateMessage).where(models.PrivateMessage.id == message_id,
                                                     models.PrivateMessage.sender_id == current_user.id)
@@ -296,9 +568,10 @@ async def change_message(message_id: UUID, message_update: schemas.ChatUpdateMes
         messages.message = message_update.message
         messages.edited = True
         session.add(messages)
+        seq, = await record_changes([(messages.sender_id, messages.receiver_id, message_id, EDIT)], session)
         await session.commit()
 
-        return {"notice": "Message updated successfully"}
+        return seq
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -317,7 +590,7 @@ async def delete_message(message_id: UUID,
         current_user (models.User): The current user.
 
     Returns:
-        Dict[str, Any]: A response indicating whether the message was deleted and any errors that may have occurred.
+        int: The change log `seq` of the delete.
 
     Raises:
         HTTPException: If an error occurs while deleting the message.
@@ -337,17 +610,25 @@ async def delete_message(message_id: UUID,
         message.id_return = None
         message.deleted = True
 
-        vote_result = await session.execute(select(models.PrivateMessageVote).filter(
+        session.add(message)
+
+        removed = await session.execute(delete(models.PrivateMessageVote).where(
             models.PrivateMessageVote.message_id == message_id,
             models.PrivateMessageVote.user_id == current_user.id
-        ))
-        found_vote = vote_result.scalars().all()
-        for vote in found_vote:
-            await session.delete(vote)
+        ).returning(models.PrivateMessageVote.dir))
+        removed_votes = sum(vote or 0 for vote in removed.scalars().all())
+        if removed_votes:
+            # Relative to the stored count, like _toggle_vote_statement, so concurrent votes are kept
+            await session.execute(
+                update(models.PrivateMessage)
+                .where(models.PrivateMessage.id == message_id)
+                .values(vote_count=models.PrivateMessage.vote_count - removed_votes)
+                .execution_options(synchronize_session=False)
+            )
 
-        session.add(message)
+        seq, = await record_changes([(message.sender_id, message.receiver_id, message_id, DELETE)], session)
         await session.commit()
-        return str(message_id)
+        return seq
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -367,7 +648,4 @@ async def get_message_by_id(message_id: UUID, user_id: UUID,
                             detail="Error getting message id")
     
 async def get_sayory(session: AsyncSession):
-    sayory = settings.sayory
-    sayory_query = select(models.User).where(models.User.user_name == sayory)
-    sayory_result = await session.execute(sayory_query)
-    return sayory_result.scalar_one_or_none()
\ No newline at end of file
+    return await auth_cache.get_sayory(session)
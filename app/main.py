@@ -1,27 +1,89 @@
 
+# The clock starts before the other imports, so startup_seconds includes them
+# ruff: noqa: E402
+import time
+
+STARTED_AT = time.perf_counter()
+
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import private_messages
-import sentry_sdk
+from _log_config.log_config import get_logger
+from .routers import conversations, health, metrics, private_messages
+from app.database.database import async_session_maker, engine_async, warm_pool
+from app.functions.fcm_sent_message import notification_dispatcher
+from app.functions.func_private import get_sayory, vote_reconciliation_task
+from app.metrics.metrics import STARTUP_SECONDS
 from app.settings.config import settings
 
+logger = get_logger('main', 'main.log')
 
-sentry_sdk.init(
-    dsn=settings.sentry_url,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for tracing.
-    traces_sample_rate=1.0,
-    _experiments={
-        # Set continuous_profiling_auto_start to True
-        # to automatically start the profiler on when
-        # possible.
-        "continuous_profiling_auto_start": True,
-    },
-)
 
+if settings.sentry_url:
+    # Imported only when enabled: sentry_sdk is heavy and off the startup path otherwise
+    import sentry_sdk
+
+    sentry_sdk.init(
+        dsn=settings.sentry_url,
+        # Tracing every transaction is costly on the hot paths: sample,
+        # and rely on the /metrics histograms for latency regressions
+        traces_sample_rate=settings.sentry_traces_sample_rate,
+        _experiments={
+            # Set continuous_profiling_auto_start to True
+            # to automatically start the profiler on when
+            # possible.
+            "continuous_profiling_auto_start": True,
+        },
+    )
+
+
+async def warm_up():
+    """
+    Open the pool connections and resolve the Sayory user before traffic arrives.
+    """
+    await warm_pool(min(settings.startup_warm_connections, settings.db_pool_size),
+                    settings.startup_deadline)
+    async with async_session_maker() as session:
+        await get_sayory(session)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    imported_in = time.perf_counter() - STARTED_AT
+    app.state.ready = False
+    app.state.startup_seconds = None
+    try:
+        await asyncio.wait_for(warm_up(), settings.startup_deadline)
+        app.state.ready = True
+    except Exception as e:
+        # Keep serving: /readyz reports 503 until the database answers
+        logger.error(f"Startup warm-up did not finish: {e!r}")
+
+    await private_messages.manager.start()
+    notification_dispatcher.start()
+    private_messages.sayory_worker.start()
+    background = []
+    if settings.vote_reconcile_interval:
+        background.append(asyncio.create_task(vote_reconciliation_task(settings.vote_reconcile_interval)))
+
+    app.state.startup_seconds = time.perf_counter() - STARTED_AT
+    STARTUP_SECONDS.set(app.state.startup_seconds)
+    logger.info(f"Startup took {app.state.startup_seconds:.3f}s (imports {imported_in:.3f}s), ready={app.state.ready}")
+
+    yield
+
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await private_messages.sayory_worker.stop()
+    await notification_dispatcher.stop()
+    await private_messages.manager.stop()
+    await engine_async.dispose()
 
 
 app = FastAPI(
+    lifespan=lifespan,
     docs_url="/docs",
     title="Private Messages API",
     description="API for private messages",
@@ -45,3 +107,6 @@ app.add_middleware(
 
 
 app.include_router(private_messages.router)
+app.include_router(conversations.router)
+app.include_router(metrics.router)
+app.include_router(health.router)
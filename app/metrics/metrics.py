@@ -0,0 +1,72 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Database connection pool
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the pool',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+DB_POOL_IN_USE = Gauge('db_pool_in_use', 'Connections currently checked out of the pool')
+DB_POOL_IDLE = Gauge('db_pool_idle', 'Connections idle in the pool')
+DB_POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections open beyond pool_size')
+
+# Hot paths
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+WS_CONNECT_TO_HISTORY = Histogram(
+    'ws_connect_to_history_seconds',
+    'Time from a WebSocket connect to its first history page being queued',
+    buckets=LATENCY_BUCKETS
+)
+WS_ACTIVE_CONNECTIONS = Gauge('ws_active_connections', 'Open private-chat sockets in this process')
+SEND_PRIVATE_ALL = Histogram(
+    'send_private_all_seconds',
+    'send_private_all end to end: encrypt, insert and fan-out',
+    buckets=LATENCY_BUCKETS
+)
+DB_MESSAGE_INSERT = Histogram(
+    'db_message_insert_seconds',
+    'Message INSERT and conversation summary upsert, per transaction',
+    ['mode'],
+    buckets=LATENCY_BUCKETS
+)
+CRYPTO_SECONDS = Histogram(
+    'crypto_seconds',
+    'Time to encrypt or decrypt one message body or batch',
+    ['op'],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+)
+FCM_SEND = Histogram(
+    'fcm_send_seconds',
+    'One FCM send_each call',
+    buckets=LATENCY_BUCKETS
+)
+GPT_SECONDS = Histogram(
+    'gpt_seconds',
+    'Sayory model latency: to the first token and to the complete answer',
+    ['stage'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 60)
+)
+
+# Startup
+STARTUP_SECONDS = Gauge('startup_seconds', 'Time from process import of app.main to readiness')
+
+
+# Per-socket outbound queues
+WS_QUEUE_DEPTH = Histogram(
+    'ws_outbound_queue_depth',
+    'Depth of a connection\'s outbound queue when a frame is queued',
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+WS_QUEUE_DEPTH_MAX = Gauge('ws_outbound_queue_depth_max', 'Deepest outbound queue among open connections')
+WS_QUEUED_FRAMES = Gauge('ws_outbound_queued_frames', 'Frames waiting in all outbound queues')
+WS_DROPPED_FRAMES = Counter('ws_outbound_dropped_frames', 'Frames dropped from full outbound queues', ['policy'])
+WS_EVICTIONS = Counter('ws_evictions', 'Connections closed as slow consumers', ['reason'])
+
+# In-process caches, by cache name
+CACHE_HITS = Counter('cache_hits', 'Cache lookups that found a live entry', ['cache'])
+CACHE_MISSES = Counter('cache_misses', 'Cache lookups that found no live entry', ['cache'])
+CACHE_EVICTIONS = Counter('cache_evictions', 'Entries evicted to stay within maxsize', ['cache'])
+CACHE_EXPIRATIONS = Counter('cache_expirations', 'Entries dropped on access after their time to live', ['cache'])
+CACHE_SIZE = Gauge('cache_size', 'Entries currently held', ['cache'])
+CACHE_MAXSIZE = Gauge('cache_maxsize', 'Configured maximum number of entries', ['cache'])
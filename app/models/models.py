@@ -1,10 +1,11 @@
-from sqlalchemy import Boolean, Column, DateTime, Integer, Interval, String, ForeignKey, Enum, UniqueConstraint, JSON
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, Interval, String, ForeignKey, Enum, UniqueConstraint, JSON, Index
 from enum import Enum as PythonEnum
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from app.database.database import Base
+from app.database.ids import uuid7
 
 
 class UserRole(str, PythonEnum):
@@ -16,7 +17,9 @@ class UserRole(str, PythonEnum):
 class PrivateMessage(Base):
     __tablename__ = 'private_messages'
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=text('uuid_generate_v4()'), nullable=False)
+    # Time-ordered (UUIDv7) so new rows append to the primary-key index and break created_at ties in send order
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=text('uuid_generate_v4()'),
+                nullable=False)
     sender_id = Column(UUID, ForeignKey('users.id', ondelete="CASCADE"), nullable=False, index=True)
     receiver_id = Column(UUID, ForeignKey('users.id', ondelete="CASCADE"), nullable=False, index=True)
     message = Column(String)
@@ -30,8 +33,86 @@ class PrivateMessage(Base):
     deleted = Column(Boolean, server_default='false')
     room_id = Column(UUID, nullable=True)
     is_sent = Column(Boolean, default=False)
+    # Sum of PrivateMessageVote.dir, maintained by process_vote
+    vote_count = Column(Integer, nullable=False, server_default='0')
+    # Same for both directions of a conversation, see app.database.ids.conversation_key
+    conversation_key = Column(UUID(as_uuid=True), nullable=True)
+
+    # Keyset pagination of history: one ordered range per conversation, or per
+    # direction until conversation keys are backfilled.
+    __table_args__ = (
+        Index('ix_private_messages_conversation_created', 'conversation_key', 'created_at', 'id'),
+        Index('ix_private_messages_pair_created', 'sender_id', 'receiver_id', 'created_at', 'id'),
+    )
     
     
+class ConversationSummary(Base):
+    """
+    One row per user and conversation partner, maintained on every send so the
+    inbox is read without scanning `private_messages`.
+    """
+    __tablename__ = 'conversation_summaries'
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    peer_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    last_message_id = Column(UUID(as_uuid=True), ForeignKey('private_messages.id', ondelete="SET NULL",
+                                                            deferrable=True, initially="IMMEDIATE"), nullable=True)
+    last_activity = Column(TIMESTAMP(timezone=True), nullable=False)
+    # Messages from peer_id that user_id has not read yet
+    unread_count = Column(Integer, nullable=False, server_default='0')
+
+    # Inbox pages: newest activity first, keyset on (last_activity, peer_id)
+    __table_args__ = (
+        Index('ix_conversation_summaries_user_activity', 'user_id', 'last_activity', 'peer_id'),
+    )
+
+
+class ConversationSequence(Base):
+    """
+    The last change number handed out in each conversation. Its row lock
+    orders concurrent writers, so changes commit in `seq` order.
+    """
+    __tablename__ = 'conversation_sequences'
+
+    conversation_key = Column(UUID(as_uuid=True), primary_key=True)
+    last_seq = Column(BigInteger, nullable=False, server_default='0')
+
+
+class ConversationChange(Base):
+    """
+    Change log of a conversation: every insert, edit, delete and vote change
+    of a message, numbered by `seq` within its conversation. Reconnecting
+    clients read the range after the last `seq` they saw.
+    """
+    __tablename__ = 'conversation_changes'
+
+    conversation_key = Column(UUID(as_uuid=True), primary_key=True)
+    seq = Column(BigInteger, primary_key=True)
+    message_id = Column(UUID(as_uuid=True), nullable=False)
+    # insert, edit, delete or vote
+    kind = Column(String, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+
+    # Recent vote changes, for reconcile_vote_counts
+    __table_args__ = (
+        Index('ix_conversation_changes_votes', 'created_at',
+              postgresql_where=text("kind IN ('vote', 'delete')")),
+    )
+
+
+class ConversationPresence(Base):
+    """
+    Conversations open on each worker process, refreshed every heartbeat.
+    Rows older than `settings.presence_ttl` belong to a worker that has gone away.
+    """
+    __tablename__ = 'conversation_presence'
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    peer_id = Column(UUID(as_uuid=True), primary_key=True)
+    worker_id = Column(UUID(as_uuid=True), primary_key=True)
+    seen_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -68,9 +149,15 @@ class PrivateMessageVote(Base):
     __tablename__ = 'private_message_votes'
 
     user_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
-    message_id = Column(UUID, ForeignKey("private_messages.id", ondelete="CASCADE"), primary_key=True)
+    message_id = Column(UUID, ForeignKey("private_messages.id", ondelete="CASCADE",
+                                         deferrable=True, initially="IMMEDIATE"), primary_key=True)
     dir = Column(Integer)
 
+    # Votes of one message, for recounting vote_count
+    __table_args__ = (
+        Index('ix_private_message_votes_message_id', 'message_id'),
+    )
+
 
 
 class FCMTokenManager(Base):
@@ -0,0 +1,31 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.database import get_async_session
+from app.functions.func_conversations import fetch_conversations
+from app.schemas import schemas
+from app.security import oauth2
+from app.security.auth_cache import UserSnapshot
+
+router = APIRouter(prefix="/conversations", tags=['Conversations'])
+
+
+@router.get("", response_model=schemas.ConversationsPage)
+async def get_conversations(before: Optional[str] = None,
+                            limit: Optional[int] = Query(None, gt=0),
+                            session: AsyncSession = Depends(get_async_session),
+                            current_user: UserSnapshot = Depends(oauth2.get_current_user)):
+    """
+    The current user's conversations with their last message and unread count,
+    most recent activity first.
+
+    Args:
+        before (str): Cursor returned by the previous page.
+        limit (int): Page size.
+
+    Returns:
+        ConversationsPage: The conversations and the cursor of the next page, None on the last one.
+    """
+    return await fetch_conversations(current_user, session, before=before, limit=limit)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Request, status
+from fastapi.responses import JSONResponse
+
+from app.database.database import ping
+
+router = APIRouter(tags=['Health'])
+
+
+@router.get("/healthz")
+async def healthz():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(request: Request):
+    """
+    Readiness: the database answers.
+
+    A worker whose startup warm-up missed its deadline becomes ready here as
+    soon as the database is reachable again.
+    """
+    state = request.app.state
+    if not await ping():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"status": "unavailable"})
+    state.ready = True
+    return {"status": "ready", "startup_seconds": state.startup_seconds}
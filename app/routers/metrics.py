@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter(tags=['Metrics'])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus exposition of the process metrics.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
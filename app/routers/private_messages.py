@@ -1,24 +1,23 @@
-import asyncio
+import time
 from _log_config.log_config import get_logger
+from typing import Dict, Optional
 from uuid import UUID
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
-from fastapi import BackgroundTasks
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
 from app.connect.connection_manager import ConnectionManagerPrivate
-from app.database.database import get_async_session
+from app.database.database import async_session_maker
+from app.metrics.metrics import WS_CONNECT_TO_HISTORY
 from app.schemas import schemas
 from ..security import oauth2
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.functions.func_private import (change_message, delete_message, fetch_last_private_messages,
-                                        mark_messages_as_read, process_vote, get_recipient_by_id,
-                                        send_messages_via_websocket, fetch_one_message, get_sayory)
-from app.functions.fcm_sent_message import send_notifications_private_message
-from app.AI.sayory import ask_to_gpt
+from app.connect.conversation import Conversation
+from app.functions.func_private import get_recipient_by_id, get_sayory
+from app.AI.sayory_worker import SayoryWorker
 
 # Налаштування логування
 logger = get_logger('private_message', 'private_message.log')
 
 router = APIRouter()
 manager = ConnectionManagerPrivate()
+sayory_worker = SayoryWorker(manager)
 
 
 
@@ -26,11 +25,10 @@ manager = ConnectionManagerPrivate()
     
 
 @router.websocket("/private/{receiver_id}")
-async def web_private_endpoint(background_tasks: BackgroundTasks,
-                            websocket: WebSocket,
+async def web_private_endpoint(websocket: WebSocket,
                             receiver_id: UUID,
                             token: str,
-                            session: AsyncSession = Depends(get_async_session)
+                            since: Optional[int] = None
                             ):
     
     """
@@ -40,151 +38,147 @@ async def web_private_endpoint(background_tasks: BackgroundTasks,
     websocket (WebSocket): The WebSocket connection instance.
     recipient_id (int): The ID of the message recipient.
     token (str): The authentication token of the current user.
-    session (AsyncSession): The database session, injected by dependency.
+    since (int): The `seq` of the last `sync` frame the client received, to get only what changed after it.
+
+    No database session is held for the lifetime of the socket: every
+    operation checks a connection out of the pool and returns it when done.
+    Every frame is written through the socket's outbound queue, so a slow
+    client only ever backs up its own queue.
 
     Operations:
     - Authenticates the current user.
     - Establishes a WebSocket connection.
-    - Fetches and sends the last private messages to the connected client.
+    - Records read receipts for delivered messages and `{"read_up_to": {"created_at": ...}}`.
+    - Fetches and sends the newest page of private messages in batched
+      `{"messages": [...]}` frames, followed by a `history` frame with the
+      cursor for older pages. With `since`, sends only the messages created,
+      edited, deleted or voted on after that change instead, when there are
+      not too many. A `{"sync": {"seq": N}}` frame follows either way; new
+      messages, `update` and `deleted` frames carry their own `seq`.
+    - Serves `{"history": {"before": <cursor>, "limit": N}}` requests for older pages.
     - Listens for incoming messages and handles sending and receiving of private messages.
-    - Disconnects on WebSocket disconnect event.
+    - Hands messages to Sayory over to the worker pool, which streams the answer
+      back as `typing` and `delta` frames before the final message.
+    - Unregisters this device's socket when the loop ends, on disconnect or any error.
+      Other devices of the user on the same conversation stay connected.
     """
     
-    try:
-        user = await oauth2.get_current_user(token, session)
-        recipient = await get_recipient_by_id(receiver_id, session)
-        if not recipient:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="Recipient not found.")
-    except Exception as error_get_user:
-        logger.error(f"Error getting user: {error_get_user}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-   
-    await manager.connect(websocket, user.id, receiver_id)
-    await mark_messages_as_read(user.id, receiver_id)
-
-    messages = await fetch_last_private_messages(receiver_id, user.id, session)
-
-    await send_messages_via_websocket(messages, websocket)
-    
-    async def periodic_task():
-        while True:
-            await mark_messages_as_read(user.id, receiver_id)
-            await asyncio.sleep(1) 
-    
-    task = asyncio.create_task(periodic_task())
+    connected_at = time.perf_counter()
+    async with async_session_maker() as session:
+        try:
+            user, recipient = await oauth2.get_current_user_and_recipient(token, receiver_id, session)
+            if not recipient:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="Recipient not found.")
+        except Exception as error_get_user:
+            logger.error(f"Error getting user: {error_get_user}", exc_info=True)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+        sayory = await get_sayory(session)
+        is_sayory = sayory is not None and receiver_id == sayory.id
+
+    outbound = await manager.connect(websocket, user.id, receiver_id)
+    conversation = Conversation(manager, sayory_worker, user, receiver_id, outbound, is_sayory)
 
     try:
+        await conversation.open(since)
+        WS_CONNECT_TO_HISTORY.observe(time.perf_counter() - connected_at)
+
         while True:
             data = await websocket.receive_json()
+            await conversation.handle(data)
 
-            # Created likes
-            if 'vote' in data:
-                try:
-                    vote_data = schemas.Vote(**data['vote'])
-                    await process_vote(vote_data, session, user)
-                 
-                    message_json = await fetch_one_message(vote_data.message_id, session)
-                    await websocket.send_text(message_json)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in private socket of {user.id}: {e}", exc_info=True)
+    finally:
+        # Whatever ended the loop, this device's socket leaves the registry
+        await manager.disconnect(user.id, outbound)
 
-                except Exception as e:
-                    logger.error(f"Error processing vote: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error processing vote: {e}"})
 
-            elif 'update' in data:
-                try:
-                    message_data = schemas.ChatUpdateMessage(**data['update'])
-                    await change_message(message_data.id, message_data, session, user)
+@router.websocket("/ws")
+async def web_multiplexed_endpoint(websocket: WebSocket, token: str):
+    """
+    One WebSocket per user for all of their conversations.
+
+    Args:
+    websocket (WebSocket): The WebSocket connection instance.
+    token (str): The authentication token of the current user.
 
-                    message_json = await fetch_one_message(message_data.id, session)
-                    await websocket.send_text(message_json)
+    The user is authenticated once per socket. Every command and every event
+    carries a `conversation_id`, the user id of the other participant:
 
-                except Exception as e:
-                    logger.error(f"Error processing Update: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error processing update: {e}"})
-                
-            # Block delete message       
-            elif 'delete' in data:
-                try:
-                    message_data = schemas.ChatMessageDelete(**data['delete'])
-                    message_id = await delete_message(message_data.id, session, user)
-                    await websocket.send_json({"deleted": {"id": message_id}})
+    - `{"conversation_id": ..., "subscribe": {"since": N}}` starts delivery for
+      the conversation and sends its newest history page, or only the changes
+      after `since` when given, as on `/private/{receiver_id}`.
+    - `{"conversation_id": ..., "unsubscribe": {}}` stops it.
+    - `history`, `read_up_to`, `vote`, `update`, `delete` and `send` work as on
+      `/private/{receiver_id}` for a subscribed conversation.
+    """
+    async with async_session_maker() as session:
+        try:
+            user, _ = await oauth2.get_current_user_and_recipient(token, None, session)
+        except Exception as error_get_user:
+            logger.error(f"Error getting user: {error_get_user}", exc_info=True)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
+    outbound = await manager.connect(websocket, user.id, multiplexed=True)
+    conversations: Dict[UUID, Conversation] = {}
 
-                except Exception as e:
-                    logger.error(f"Error processing delete: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error processing delete: {e}"})
-
-            elif 'send' in data:
-                
-                message_data = data['send']
-                original_message_id = message_data['original_message_id']
-                original_message = message_data['message']
-                file_url = message_data['fileUrl']
-                voice_url = message_data['voiceUrl']
-                video_url = message_data['videoUrl']
-                    
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if not isinstance(data, dict):
+                await outbound.send_json({"notice": "Expected a JSON object"})
+                continue
+            try:
+                conversation_id = UUID(str(data.get('conversation_id')))
+            except ValueError:
+                await outbound.send_json({"notice": "A conversation_id is required"})
+                continue
+
+            if 'subscribe' in data:
+                if conversation_id in conversations:
+                    continue
+                subscribed_at = time.perf_counter()
                 try:
-
-                    await manager.send_private_all(
-                        message=original_message,
-                        fileUrl=file_url,
-                        voiceUrl=voice_url,
-                        videoUrl=video_url,
-                        receiver_id=receiver_id,
-                        sender_id=user.id,
-                        user_name=user.user_name,
-                        avatar=user.avatar,
-                        verified=user.verified,
-                        id_return=original_message_id,
-                        is_read=True
-                    )
-                    await mark_messages_as_read(user.id, receiver_id)
-
-                    background_tasks.add_task(await send_notifications_private_message(message=original_message,
-                                                                                      sender=user.user_name,
-                                                                                      recipient_id=receiver_id,
-                                                                                      session=session))
-
-
-                    logger.info(f"Sent message: {original_message}")
+                    subscribe = schemas.Subscribe(**(data['subscribe'] or {}))
+                    async with async_session_maker() as session:
+                        peer = await get_recipient_by_id(conversation_id, session)
+                        sayory = await get_sayory(session)
+                    if peer is None:
+                        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                            detail="Recipient not found.")
+                    conversation = Conversation(manager, sayory_worker, user, conversation_id, outbound,
+                                                is_sayory=sayory is not None and conversation_id == sayory.id)
+                    # Subscribed before the catch-up so nothing published meanwhile is missed
+                    manager.subscribe(user.id, conversation_id, outbound)
+                    conversations[conversation_id] = conversation
+                    await conversation.open(subscribe.since)
+                    WS_CONNECT_TO_HISTORY.observe(time.perf_counter() - subscribed_at)
                 except Exception as e:
-                    logger.error(f"Error sending message: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error sending message: {e}"})
-
-                sayory = await get_sayory(session)
-                if receiver_id == sayory.id:
-                    try:
-                        response_sayory = await ask_to_gpt(original_message)
-                        
-                        for message in response_sayory:
-                            await manager.send_private_all(
-                                message=message,
-                                fileUrl=file_url,
-                                voiceUrl=voice_url,
-                                videoUrl=video_url,
-                                receiver_id=user.id,
-                                sender_id=receiver_id,
-                                user_name="SayOry",
-                                avatar="https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/girl_5.webp",
-                                verified=True,
-                                id_return=original_message_id,
-                                is_read=True
-                            )
-                            await asyncio.sleep(1)
-                        await mark_messages_as_read(user.id, receiver_id)
-                        logger.info(f"Sent GPT response: {response_sayory}")
-                    except Exception as e:
-                        logger.error(f"Error processing GPT query: {e}", exc_info=True)
-                        await websocket.send_json({"notice": f"Error processing GPT query: {e}"})
-                        
-                
-                                            
-    except WebSocketDisconnect:
-        task.cancel()
-        await manager.disconnect(user.id, receiver_id)
-    finally:
-        await session.close()
-        print("Session closed")
+                    logger.error(f"Error subscribing: {e}", exc_info=True)
+                    # The client was not brought up to date: it must subscribe again
+                    if conversations.pop(conversation_id, None) is not None:
+                        manager.unsubscribe(user.id, conversation_id, outbound)
+                    await outbound.send_json({"conversation_id": str(conversation_id),
+                                              "notice": f"Error subscribing: {e}"})
+
+            elif 'unsubscribe' in data:
+                if conversations.pop(conversation_id, None) is not None:
+                    manager.unsubscribe(user.id, conversation_id, outbound)
 
+            elif conversation_id in conversations:
+                await conversations[conversation_id].handle(data)
 
+            else:
+                await outbound.send_json({"conversation_id": str(conversation_id),
+                                          "notice": "Not subscribed to this conversation"})
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in multiplexed socket of {user.id}: {e}", exc_info=True)
+    finally:
+        await manager.disconnect(user.id, outbound)
@@ -0,0 +1,145 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from app.schemas.schemas import ChatMessagesSchema, HistoryPage, ReplyPreview, UserPreview
+from app.settings.config import settings
+
+
+# pydantic-core serializers, built once at import
+_message_serializer = ChatMessagesSchema.__pydantic_serializer__
+_page_serializer = HistoryPage.__pydantic_serializer__
+_user_serializer = UserPreview.__pydantic_serializer__
+_reply_serializer = ReplyPreview.__pydantic_serializer__
+
+# Sent once per sender in the `users` map of `{"messages": [...]}` frames instead
+_USER_FIELDS = {'user_name', 'avatar', 'verified'}
+
+
+def encode_message(message: ChatMessagesSchema) -> bytes:
+    """
+    JSON of a single message, encoded straight by pydantic-core.
+    """
+    return _message_serializer.to_json(message)
+
+
+def _seq(seq: Optional[int]) -> bytes:
+    return b'' if seq is None else b',"seq":%d' % seq
+
+
+def message_frame(message: ChatMessagesSchema, seq: Optional[int] = None) -> str:
+    """
+    A `{"message": {...}}` frame; the same text is reused for every recipient.
+
+    With `seq`, the frame carries the conversation change it belongs to.
+    """
+    return (b'{"message":' + encode_message(message) + _seq(seq) + b'}').decode('utf-8')
+
+
+def update_frame(message: ChatMessagesSchema, seq: Optional[int] = None) -> str:
+    """
+    A `{"update": {...}}` frame.
+    """
+    return (b'{"update":' + encode_message(message) + _seq(seq) + b'}').decode('utf-8')
+
+
+def deleted_frame(message_id: UUID, seq: Optional[int] = None) -> str:
+    """
+    A `{"deleted": {"id": ...}}` frame.
+    """
+    return f'{{"deleted":{{"id":"{message_id}"}}{_seq(seq).decode()}}}'
+
+
+def sync_frame(seq: int) -> str:
+    """
+    The `{"sync": {"seq": N}}` frame: the client is up to date with change `seq`
+    and passes it as `since` when it reconnects.
+    """
+    return f'{{"sync":{{"seq":{seq}}}}}'
+
+
+def history_frame(before: Optional[str]) -> str:
+    """
+    The `{"history": {...}}` frame closing a page with the cursor for the next older one.
+    """
+    return (b'{"history":' + _page_serializer.to_json(HistoryPage(before=before)) + b'}').decode('utf-8')
+
+
+def messages_frames(messages: Iterable[ChatMessagesSchema],
+                    max_bytes: Optional[int] = None,
+                    replies: Optional[Dict[UUID, ReplyPreview]] = None) -> List[str]:
+    """
+    Batch `messages` into `{"messages": [...], "users": {...}, "replies": {...}}`
+    frames of at most `max_bytes` each.
+
+    Messages go out without their sender's `user_name`, `avatar` and
+    `verified`: `users` holds each sender's profile once per frame, keyed by
+    the sender id the message carries in `receiver_id`. `replies` holds a
+    preview of each quoted message (`id_return`) found in `replies`, so every
+    frame can be rendered on its own.
+
+    Every message, profile and preview is encoded once; a message larger
+    than `max_bytes` goes out alone in its own frame.
+
+    Args:
+        messages: Messages in the order the client should receive them.
+        max_bytes: Frame size cap, `settings.history_frame_max_bytes` by default.
+        replies: Previews of quoted messages by id, see `fetch_reply_previews`.
+
+    Returns:
+        The frames as text, in order. Empty when there are no messages.
+    """
+    max_bytes = max_bytes or settings.history_frame_max_bytes
+    replies = replies or {}
+    users_json: Dict[UUID, bytes] = {}
+    replies_json: Dict[UUID, bytes] = {}
+
+    def user_entry(message: ChatMessagesSchema) -> bytes:
+        if message.receiver_id not in users_json:
+            preview = UserPreview(user_name=message.user_name, avatar=message.avatar, verified=message.verified)
+            users_json[message.receiver_id] = _entry(message.receiver_id, _user_serializer.to_json(preview))
+        return users_json[message.receiver_id]
+
+    def reply_entry(reply_id: UUID) -> bytes:
+        if reply_id not in replies_json:
+            replies_json[reply_id] = _entry(reply_id, _reply_serializer.to_json(replies[reply_id]))
+        return replies_json[reply_id]
+
+    def additions(message: ChatMessagesSchema, users: dict, quoted: dict) -> Tuple[dict, dict]:
+        # The profile and preview this message adds to a chunk that lacks them
+        new_users = ({} if message.receiver_id is None or message.receiver_id in users
+                     else {message.receiver_id: user_entry(message)})
+        new_quoted = ({message.id_return: reply_entry(message.id_return)}
+                      if message.id_return in replies and message.id_return not in quoted else {})
+        return new_users, new_quoted
+
+    frames = []
+    chunk, users, quoted, size = [], {}, {}, 0
+    overhead = len(b'{"messages":[],"users":{},"replies":{}}')
+    for message in messages:
+        encoded = _message_serializer.to_json(message, exclude=_USER_FIELDS)
+        new_users, new_quoted = additions(message, users, quoted)
+        if chunk and overhead + size + _grown(encoded, new_users, new_quoted) > max_bytes:
+            frames.append(_join(chunk, users, quoted))
+            chunk, users, quoted, size = [], {}, {}, 0
+            new_users, new_quoted = additions(message, users, quoted)
+        chunk.append(encoded)
+        users.update(new_users)
+        quoted.update(new_quoted)
+        size += _grown(encoded, new_users, new_quoted)
+    if chunk:
+        frames.append(_join(chunk, users, quoted))
+    return frames
+
+
+def _grown(encoded: bytes, *entries: Dict[UUID, bytes]) -> int:
+    # Bytes added to a frame, one separator per item
+    return len(encoded) + 1 + sum(len(entry) + 1 for added in entries for entry in added.values())
+
+
+def _entry(key: UUID, value: bytes) -> bytes:
+    return b'"' + str(key).encode() + b'":' + value
+
+
+def _join(chunk: List[bytes], users: Dict[UUID, bytes], quoted: Dict[UUID, bytes]) -> str:
+    return (b'{"messages":[' + b','.join(chunk) + b'],"users":{' + b','.join(users.values())
+            + b'},"replies":{' + b','.join(quoted.values()) + b'}}').decode('utf-8')
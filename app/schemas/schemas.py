@@ -1,12 +1,14 @@
 from pydantic import BaseModel, Field, UUID4, Strict
 from typing import Annotated, Optional
+from uuid import UUID
 from datetime import datetime
 
 
 class ChatMessagesSchema(BaseModel):
     created_at: datetime
     receiver_id: Annotated[UUID4, Strict(False)] = None
-    id: Annotated[UUID4, Strict(False)]
+    # Message ids are UUIDv7 for new rows, v4 for older ones
+    id: Annotated[UUID, Strict(False)]
     message: Optional[str] = None
     fileUrl: Optional[str] = None
     voiceUrl: Optional[str] = None
@@ -15,7 +17,7 @@ class ChatMessagesSchema(BaseModel):
     avatar: Optional[str] = "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/boy_1.webp"
     verified: Optional[bool] = None
     vote: int
-    id_return: Optional[UUID4] = None
+    id_return: Optional[UUID] = None
     edited: bool
     deleted: bool
     is_read: bool
@@ -27,8 +29,60 @@ class WrappedSocketMessage(BaseModel):
     message: ChatMessagesSchema
 
 
-async def wrap_message(chat_model_instance: ChatMessagesSchema) -> WrappedSocketMessage:
-    return WrappedSocketMessage(message=chat_model_instance)
+# History page, newest-first keyset cursor. The messages of a page go out
+# first in `{"messages": [...]}` frames, see app.schemas.frames
+class HistoryRequest(BaseModel):
+    before: Optional[str] = None
+    limit: Optional[Annotated[int, Field(gt=0)]] = None
+
+
+# Profile of a sender in the `users` map of a `{"messages": [...]}` frame
+class UserPreview(BaseModel):
+    user_name: Optional[str] = "USER DELETE"
+    avatar: Optional[str] = None
+    verified: Optional[bool] = None
+
+
+# Quoted message in the `replies` map of a `{"messages": [...]}` frame
+class ReplyPreview(BaseModel):
+    id: Annotated[UUID, Strict(False)]
+    sender_id: Annotated[UUID, Strict(False)]
+    message: Optional[str] = None
+    has_media: bool = False
+    deleted: bool = False
+
+
+class HistoryPage(BaseModel):
+    before: Optional[str] = None
+
+
+# Subscribe a multiplexed socket to a conversation, `since` as for a reconnect
+class Subscribe(BaseModel):
+    since: Optional[int] = None
+
+
+class ReadUpTo(BaseModel):
+    created_at: datetime
+
+
+# Inbox: the user's conversations, most recent activity first
+class ConversationPeer(BaseModel):
+    id: Annotated[UUID4, Strict(False)]
+    user_name: Optional[str] = "USER DELETE"
+    avatar: Optional[str] = None
+    verified: Optional[bool] = None
+
+
+class ConversationSummary(BaseModel):
+    peer: ConversationPeer
+    last_message: Optional[ChatMessagesSchema] = None
+    last_activity: datetime
+    unread_count: int
+
+
+class ConversationsPage(BaseModel):
+    conversations: list[ConversationSummary] = []
+    before: Optional[str] = None
 
 
 # Update message in chat
@@ -36,17 +90,13 @@ class WrappedUpdateMessage(BaseModel):
     update: ChatMessagesSchema
 
 
-async def wrap_message_update(socket_model_update: ChatMessagesSchema) -> WrappedUpdateMessage:
-    return WrappedUpdateMessage(update=socket_model_update)
-
-
 class ChatUpdateMessage(BaseModel):
-    id: Annotated[UUID4, Strict(False)]
+    id: Annotated[UUID, Strict(False)]
     message: str
 
 
 class ChatMessageDelete(BaseModel):
-    id: Annotated[UUID4, Strict(False)]
+    id: Annotated[UUID, Strict(False)]
 
 
 class Token(BaseModel):
@@ -59,5 +109,5 @@ class TokenData(BaseModel):
 
 
 class Vote(BaseModel):
-    message_id: Annotated[UUID4, Strict(False)]
+    message_id: Annotated[UUID, Strict(False)]
     dir: Annotated[int, Field(strict=True, le=1)]
\ No newline at end of file
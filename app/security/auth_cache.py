@@ -0,0 +1,106 @@
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache.cache import MISSING, TTLCache
+from app.models.models import User
+from app.settings.config import settings
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """
+    The fields of `User` the messaging code needs, detached from any session.
+    """
+    id: UUID
+    user_name: str
+    avatar: str
+    verified: bool
+    company_id: Optional[UUID]
+    password_changed: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            user_name=user.user_name,
+            avatar=user.avatar,
+            verified=user.verified,
+            company_id=user.company_id,
+            password_changed=user.password_changed,
+        )
+
+
+# Decoded JWT claims keyed by the raw token
+tokens = TTLCache(settings.auth_cache_size, settings.auth_cache_ttl, name='tokens')
+# UserSnapshot keyed by user id
+users = TTLCache(settings.auth_cache_size, settings.auth_cache_ttl, name='users')
+
+_sayory: Optional[UserSnapshot] = None
+
+
+def get_token_claims(token: str) -> Optional[dict]:
+    """
+    Cached claims of `token`, or None when unknown or expired.
+    """
+    claims = tokens.get(token, None)
+    if claims is not None and claims["exp"] is not None and claims["exp"] <= time.time():
+        tokens.invalidate(token)
+        return None
+    return claims
+
+
+def set_token_claims(token: str, claims: dict):
+    tokens.set(token, claims)
+
+
+async def get_users(user_ids: Iterable[UUID], session: AsyncSession,
+                    refresh: bool = False) -> Dict[UUID, UserSnapshot]:
+    """
+    Snapshots of `user_ids`, loading every cache miss with one `IN` query.
+
+    Unknown users are left out of the result.
+    """
+    found: Dict[UUID, UserSnapshot] = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        snapshot = MISSING if refresh else users.get(user_id)
+        if snapshot is MISSING:
+            missing.append(user_id)
+        else:
+            found[user_id] = snapshot
+
+    if missing:
+        result = await session.execute(select(User).where(User.id.in_(missing)))
+        for user in result.scalars().all():
+            snapshot = UserSnapshot.from_model(user)
+            users.set(snapshot.id, snapshot)
+            found[snapshot.id] = snapshot
+    return found
+
+
+async def get_user(user_id: UUID, session: AsyncSession) -> Optional[UserSnapshot]:
+    return (await get_users([user_id], session)).get(user_id)
+
+
+def invalidate_user(user_id: UUID):
+    users.invalidate(user_id)
+
+
+async def get_sayory(session: AsyncSession) -> Optional[UserSnapshot]:
+    """
+    The Sayory bot user, resolved by `settings.sayory` once per process.
+    """
+    global _sayory
+    if _sayory is None:
+        result = await session.execute(select(User).where(User.user_name == settings.sayory))
+        user = result.scalar_one_or_none()
+        if user is not None:
+            _sayory = UserSnapshot.from_model(user)
+            users.set(_sayory.id, _sayory)
+    return _sayory
@@ -1,39 +1,109 @@
-
-from typing import Optional
+import asyncio
 import base64
-from cryptography.fernet import Fernet, InvalidToken
+import binascii
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import List, Optional, Sequence
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from app.metrics.metrics import CRYPTO_SECONDS
 from app.settings.config import settings
 
 # Ініціалізація шифрувальника
-key = settings.key_crypto
-cipher = Fernet(key)
+# KEY_CRYPTO may hold several comma-separated keys, newest first: new messages are
+# encrypted with the first key and messages encrypted with any of them decrypt.
+keys = [Fernet(key.strip()) for key in settings.key_crypto.split(',') if key.strip()]
+cipher = MultiFernet(keys)
 
+_executor: Optional[Executor] = None
 
-def is_base64(s):
-    try:
-        return base64.b64encode(base64.b64decode(s)).decode('utf-8') == s
-    except Exception:
-        # print(f"Error: Failed to base64 decode {e}")
-        return False
 
-async def async_encrypt(data: Optional[str]):
+def crypto_executor() -> Executor:
+    """
+    Pool used by `encrypt_many`/`decrypt_many` for batches above `settings.crypto_batch_threshold`.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.crypto_max_workers,
+                                       thread_name_prefix='crypto')
+    return _executor
+
+
+def encrypt(data: Optional[str]) -> Optional[str]:
     if data is None:
         return None
 
     encrypted = cipher.encrypt(data.encode())
-    encoded_string = base64.b64encode(encrypted).decode('utf-8')
-    return encoded_string
+    return base64.b64encode(encrypted).decode('utf-8')
 
-async def async_decrypt(encoded_data: Optional[str]):
+
+def decrypt(encoded_data: Optional[str]) -> Optional[str]:
+    """
+    Decrypt a stored message body.
+
+    The outer base64 layer is decoded exactly once: a value that is not valid
+    base64 was stored unencrypted and is returned as is, a token no key can
+    verify yields None.
+    """
     if encoded_data is None:
         return None
 
-    if not is_base64(encoded_data):
+    try:
+        encrypted = base64.b64decode(encoded_data, validate=True)
+    except (binascii.Error, ValueError):
         return encoded_data
 
     try:
-        encrypted = base64.b64decode(encoded_data.encode('utf-8'))
-        decrypted = cipher.decrypt(encrypted).decode('utf-8')
-        return decrypted
+        return cipher.decrypt(encrypted).decode('utf-8')
     except InvalidToken:
         return None
+
+
+def _encrypt_chunk(chunk: Sequence[Optional[str]]) -> List[Optional[str]]:
+    return [encrypt(data) for data in chunk]
+
+
+def _decrypt_chunk(chunk: Sequence[Optional[str]]) -> List[Optional[str]]:
+    return [decrypt(data) for data in chunk]
+
+
+async def _run_batched(func, values: Sequence[Optional[str]],
+                       executor: Optional[Executor]) -> List[Optional[str]]:
+    if len(values) < settings.crypto_batch_threshold:
+        return func(values)
+
+    loop = asyncio.get_running_loop()
+    executor = executor or crypto_executor()
+    size = settings.crypto_chunk_size
+    chunks = [values[i:i + size] for i in range(0, len(values), size)]
+    results = await asyncio.gather(*(loop.run_in_executor(executor, func, chunk) for chunk in chunks))
+    return [value for chunk in results for value in chunk]
+
+
+async def encrypt_many(values: Sequence[Optional[str]],
+                       executor: Optional[Executor] = None) -> List[Optional[str]]:
+    """
+    Encrypt a batch, off the event loop once it reaches `settings.crypto_batch_threshold`.
+
+    `executor` may be a ProcessPoolExecutor for very large batches; the
+    default is a shared thread pool.
+    """
+    with CRYPTO_SECONDS.labels(op='encrypt_many').time():
+        return await _run_batched(_encrypt_chunk, values, executor)
+
+
+async def decrypt_many(values: Sequence[Optional[str]],
+                       executor: Optional[Executor] = None) -> List[Optional[str]]:
+    """
+    Decrypt a batch, off the event loop once it reaches `settings.crypto_batch_threshold`.
+    """
+    with CRYPTO_SECONDS.labels(op='decrypt_many').time():
+        return await _run_batched(_decrypt_chunk, values, executor)
+
+
+async def async_encrypt(data: Optional[str]):
+    with CRYPTO_SECONDS.labels(op='encrypt').time():
+        return encrypt(data)
+
+
+async def async_decrypt(encoded_data: Optional[str]):
+    with CRYPTO_SECONDS.labels(op='decrypt').time():
+        return decrypt(encoded_data)
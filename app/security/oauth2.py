@@ -4,11 +4,14 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 
 from sqlalchemy import select
+from typing import Dict, Iterable, Optional, Tuple
 from uuid import UUID
 
 from app.database import database
 from app.models.models import User
 from app.schemas.schemas import TokenData
+from app.security import auth_cache
+from app.security.auth_cache import UserSnapshot
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -46,7 +49,13 @@ async def create_access_token(user_id: UUID, db: AsyncSession):
 
 
 
-async def verify_access_token(token: str, credentials_exception, db: AsyncSession):
+def decode_access_token(token: str, credentials_exception) -> dict:
+    """
+    JWT claims of `token`, decoded once and then served from `auth_cache.tokens` until it expires.
+    """
+    claims = auth_cache.get_token_claims(token)
+    if claims is not None:
+        return claims
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id_str: str = payload.get("user_id")
@@ -55,20 +64,61 @@ async def verify_access_token(token: str, credentials_exception, db: AsyncSessio
         if user_id_str is None or company_id_str is None:
             raise credentials_exception
 
-        user_id = UUID(user_id_str)
-        company_id = UUID(company_id_str)
-        user = await db.execute(select(User).where(User.id == user_id,
-                                                               User.company_id == company_id))
-        user = user.scalar_one_or_none()
+        claims = {
+            "user_id": UUID(user_id_str),
+            "company": UUID(company_id_str),
+            "password_changed": payload.get("password_changed"),
+            "exp": payload.get("exp"),
+        }
+    except JWTError:
+        oauth2_logger.error(f"Invalid JWT token: {token}")
+        raise credentials_exception
+    except ValueError:
+        raise credentials_exception
+    auth_cache.set_token_claims(token, claims)
+    return claims
+
+
+def _matches_token(user: Optional[UserSnapshot], claims: dict) -> bool:
+    return (user is not None
+            and user.company_id == claims["company"]
+            and str(user.password_changed) == claims["password_changed"])
+
 
-        if user is None or str(user.password_changed) != payload['password_changed']:
+async def authenticate(token: str, credentials_exception, db: AsyncSession,
+                       prefetch: Iterable[UUID] = ()) -> Tuple[UserSnapshot, Dict[UUID, UserSnapshot]]:
+    """
+    Resolve the user of `token` together with the users in `prefetch`.
+
+    Users come from `auth_cache`; all cache misses are loaded with one query.
+    A cached snapshot whose `password_changed` does not match the token is
+    reloaded once, so a token issued after a password change is accepted and
+    older tokens are rejected as soon as the new value is seen.
+
+    Returns:
+        The current user and a mapping of the prefetched users that exist.
+    """
+    claims = decode_access_token(token, credentials_exception)
+    user_id = claims["user_id"]
+    prefetch = list(prefetch)
+
+    found = await auth_cache.get_users([user_id, *prefetch], db)
+    user = found.get(user_id)
+    if not _matches_token(user, claims):
+        auth_cache.invalidate_user(user_id)
+        user = await auth_cache.get_user(user_id, db)
+        if not _matches_token(user, claims):
             raise credentials_exception
 
-        token_data = TokenData(id=user_id)
-        return token_data
+    return user, {user_id: found[user_id] for user_id in prefetch if user_id in found}
 
-    except JWTError:
-        oauth2_logger.error(f"Invalid JWT token: {token}")
+
+async def verify_access_token(token: str, credentials_exception, db: AsyncSession):
+    try:
+        user, _ = await authenticate(token, credentials_exception, db)
+        return TokenData(id=user.id)
+    except HTTPException:
+        raise
     except Exception as e:
         oauth2_logger.error(f"Error verifying access token: {e}")
 
@@ -87,25 +137,36 @@ async def get_current_user(token: str = Depends(oauth2_scheme),
         db (AsyncSession): The database session.
 
     Returns:
-        user_model.User: The currently authenticated user.
+        UserSnapshot: The currently authenticated user.
 
     Raises:
         HTTPException: If the credentials are invalid.
     """
+    user, _ = await get_current_user_and_recipient(token, None, db)
+    return user
+
+
+async def get_current_user_and_recipient(token: str, recipient_id: Optional[UUID],
+                                         db: AsyncSession) -> Tuple[UserSnapshot, Optional[UserSnapshot]]:
+    """
+    Authenticate a WebSocket connect and resolve its recipient in the same cache lookup.
+
+    Costs at most one query on a cold cache and none on a warm one.
+
+    Returns:
+        The current user and the recipient, None if the recipient does not exist.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"}
     )
     try:
-        token = await verify_access_token(token, credentials_exception, db)
-
-        user = await db.execute(select(User).where(User.id == token.id))
-        user = user.scalar_one_or_none()
-        if not user:
-            oauth2_logger.error("Could not find user")
-
-        return user
+        prefetch = [recipient_id] if recipient_id is not None else []
+        user, recipients = await authenticate(token, credentials_exception, db, prefetch)
+        return user, recipients.get(recipient_id)
+    except HTTPException:
+        raise
     except Exception as e:
         oauth2_logger.error(f"Error getting current user: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -14,10 +15,77 @@ class Settings(BaseSettings):
     password_pepper: str
     key_crypto: str
     openai_api_key: str
+    openai_base_url: Optional[str] = None
     google_services: str
     sentry_url: str
+    # Share of transactions traced by Sentry
+    sentry_traces_sample_rate: float = 0.05
     sayory: str
     hell: str
+
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_prepared_statement_cache_size: int = 500
+    startup_warm_connections: int = 5
+    startup_deadline: float = 30
+
+    history_page_size: int = 50
+    history_max_page_size: int = 200
+    # Size cap of one `{"messages": [...]}` history frame
+    history_frame_max_bytes: int = 64 * 1024
+    # Characters of a quoted message kept in the `replies` map of history frames
+    reply_preview_length: int = 100
+    # Read history by `conversation_key`; enable once the backfill has run
+    history_by_conversation_key: bool = False
+    # Reconnects with `since` get a delta of at most this many messages, else a full history page
+    sync_max_changes: int = 1000
+    conversations_page_size: int = 30
+    conversations_max_page_size: int = 100
+    read_receipt_flush_interval: float = 0.25
+    fanout_backend: str = "memory"
+    # Open conversations shared between workers through `conversation_presence` (postgres fan-out only)
+    presence_flush_interval: float = 1
+    presence_heartbeat_interval: float = 30
+    presence_ttl: float = 90
+    message_group_commit: bool = False
+    message_group_commit_window_ms: float = 5
+    message_group_commit_max_batch: int = 100
+    crypto_batch_threshold: int = 256
+    crypto_chunk_size: int = 512
+    crypto_max_workers: int = 4
+    message_cache_size: int = 50_000
+    message_cache_ttl: float = 600
+    auth_cache_size: int = 10_000
+    auth_cache_ttl: float = 30
+    fcm_workers: int = 2
+    fcm_coalesce_window: float = 0.5
+    fcm_coalesce_max_lines: int = 5
+    # FCM rejects messages over 4096 bytes; leaves room for the title and envelope
+    fcm_body_max_bytes: int = 2048
+    fcm_batch_size: int = 500
+    fcm_queue_size: int = 10_000
+    vote_reconcile_interval: float = 3600
+    # Each run rechecks messages voted on within this many seconds; overlapping runs is cheap
+    vote_reconcile_lookback: float = 7200
+    # Per-socket outbound queue; full-queue policy is "drop_oldest", "drop_newest" or "close".
+    # "close" makes the client reconnect with `since` and catch up from the change log;
+    # the drop policies lose frames without telling it.
+    ws_send_queue_size: int = 256
+    ws_send_timeout: float = 10
+    ws_queue_full_policy: str = "close"
+    # Sayory worker pool; each user may ask sayory_rate_limit questions per sayory_rate_window seconds
+    sayory_workers: int = 4
+    sayory_queue_size: int = 100
+    sayory_rate_limit: int = 5
+    sayory_rate_window: float = 60
+    # Recent history sent to the model, and the answer cache
+    sayory_context_tokens: int = 1500
+    sayory_context_messages: int = 30
+    sayory_cache_size: int = 1000
+    sayory_cache_ttl: float = 3600
     
     model_config = SettingsConfigDict(env_file = ".env")
 
@@ -0,0 +1,49 @@
+"""
+Microbenchmark: per-message vs batched Fernet encryption/decryption.
+
+Run from the repository root with the usual `.env` in place:
+
+    PYTHONPATH=. python test/bench_crypto.py [count]
+"""
+import asyncio
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.security.crypto_messages import (async_decrypt, async_encrypt, crypto_executor,
+                                          decrypt_many, encrypt_many)
+
+
+async def per_message(func, values):
+    return [await func(value) for value in values]
+
+
+async def timed(label: str, count: int, coro):
+    start = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1000:9.1f} ms  {count / elapsed:12.0f} msg/s")
+    return result
+
+
+async def main(count: int):
+    plaintext = [f"message number {i} " * 8 for i in range(count)]
+
+    encrypted = await timed("encrypt per message", count, per_message(async_encrypt, plaintext))
+    await timed("encrypt_many (threads)", count, encrypt_many(plaintext))
+
+    await timed("decrypt per message", count, per_message(async_decrypt, encrypted))
+    decrypted = await timed("decrypt_many (threads)", count, decrypt_many(encrypted))
+    assert decrypted == plaintext
+
+    with ProcessPoolExecutor() as processes:
+        # First call pays for worker start-up and the module import in each child
+        await decrypt_many(encrypted[:1024], executor=processes)
+        decrypted = await timed("decrypt_many (processes)", count, decrypt_many(encrypted, executor=processes))
+    assert decrypted == plaintext
+
+    crypto_executor().shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,88 @@
+"""
+Serialization benchmark for message frames.
+
+Compares the per-recipient wrap-and-dump path the socket code used before
+with the encode-once frames of `app.schemas.frames`, for fan-out of new
+messages to two sockets and for sending a history page, and the bytes a
+history page takes on the wire. No database is needed. Run from the repository root:
+
+    PYTHONPATH=. python test/bench_frames.py [messages] [page_size]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from app.schemas import frames, schemas
+
+
+class NullWebSocket:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_text(self, data: str):
+        self.frames += 1
+        self.bytes += len(data.encode('utf-8'))
+
+
+def make_messages(count: int):
+    # One conversation: two senders taking turns
+    senders = [uuid4(), uuid4()]
+    return [schemas.ChatMessagesSchema(created_at=datetime.now(timezone.utc), id=uuid4(),
+                                       receiver_id=senders[i % 2], message=f"message {i} " * 8,
+                                       user_name="bench", verified=True, vote=0,
+                                       edited=False, deleted=False, is_read=True)
+            for i in range(count)]
+
+
+async def fan_out_before(messages, sockets):
+    for message in messages:
+        for websocket in sockets:
+            await websocket.send_text(schemas.WrappedSocketMessage(message=message).model_dump_json())
+
+
+async def fan_out_after(messages, sockets):
+    for message in messages:
+        frame = frames.message_frame(message)
+        for websocket in sockets:
+            await websocket.send_text(frame)
+
+
+async def history_before(page, websocket):
+    for message in page:
+        await websocket.send_text(schemas.WrappedSocketMessage(message=message).model_dump_json())
+
+
+async def history_after(page, websocket):
+    for frame in frames.messages_frames(page):
+        await websocket.send_text(frame)
+
+
+async def measure(label, coro_factory, repeat, messages_per_run):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await coro_factory()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {repeat * messages_per_run / elapsed:>12,.0f} messages/s")
+
+
+async def main(count: int, page_size: int):
+    messages = make_messages(count)
+    sockets = [NullWebSocket(), NullWebSocket()]
+    await measure("fan-out before", lambda: fan_out_before(messages, sockets), 1, count)
+    await measure("fan-out after", lambda: fan_out_after(messages, sockets), 1, count)
+
+    page = messages[:page_size]
+    repeat = max(1, count // page_size)
+    before, after = NullWebSocket(), NullWebSocket()
+    await measure("history before", lambda: history_before(page, before), repeat, page_size)
+    await measure("history after", lambda: history_after(page, after), repeat, page_size)
+    print(f"history frames per page: {before.frames // repeat} before, {after.frames // repeat} after")
+    print(f"history bytes per page: {before.bytes // repeat} before, {after.bytes // repeat} after")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [20000, 50][len(args):])))
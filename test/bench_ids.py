@@ -0,0 +1,67 @@
+"""
+Insert benchmark for random (v4) versus time-ordered (v7) primary keys.
+
+Creates two throw-away tables shaped like the key of `private_messages`,
+inserts the same number of rows into each in batches of `batch`, and prints
+throughput and the size of the primary-key index after each round. Random
+keys split pages all over the B-tree and leave it about half full; v7 keys
+append to the right edge. Run from the repository root with the usual
+`.env` in place:
+
+    PYTHONPATH=. python test/bench_ids.py [rows] [batch] [rounds]
+"""
+import asyncio
+import sys
+import time
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from app.database.database import engine_async
+from app.database.ids import uuid7
+
+GENERATORS = {"v4": uuid4, "v7": uuid7}
+
+
+async def run(kind: str, rows: int, batch: int, rounds: int):
+    table = f"bench_ids_{kind}"
+    generate = GENERATORS[kind]
+    async with engine_async.begin() as connection:
+        await connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        await connection.execute(text(
+            f"CREATE TABLE {table} (id uuid PRIMARY KEY, created_at timestamptz NOT NULL DEFAULT now(), "
+            f"message text)"
+        ))
+    insert = text(f"INSERT INTO {table} (id, message) VALUES (:id, :message)")
+    try:
+        total, elapsed = 0, 0.0
+        for round_number in range(1, rounds + 1):
+            start = time.perf_counter()
+            for _ in range(rows // batch):
+                async with engine_async.begin() as connection:
+                    await connection.execute(insert, [{"id": generate(), "message": "x" * 64}
+                                                      for _ in range(batch)])
+            elapsed += time.perf_counter() - start
+            total += rows // batch * batch
+            async with engine_async.connect() as connection:
+                index_bytes = (await connection.execute(
+                    text(f"SELECT pg_relation_size('{table}_pkey')")
+                )).scalar_one()
+            print(f"{kind} round {round_number}: {total} rows, {total / elapsed:.0f} rows/s, "
+                  f"pkey {index_bytes / 2**20:.1f} MiB ({index_bytes / total:.1f} B/row)")
+    finally:
+        async with engine_async.begin() as connection:
+            await connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+async def main(rows: int, batch: int, rounds: int):
+    try:
+        for kind in GENERATORS:
+            await run(kind, rows, batch, rounds)
+    finally:
+        await engine_async.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [100_000, 500, 5][len(args):])))
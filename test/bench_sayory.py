@@ -0,0 +1,91 @@
+"""
+Latency and concurrency benchmark for the Sayory worker pool.
+
+Runs questions from many users against the local fake completion server in
+test/fake_openai.py, so it needs no network or API key, and reports time
+to the `typing` frame, to the first `delta` and to the persisted answer.
+The same questions are then asked again to time answers from the response
+cache. Run from the repository root:
+
+    PYTHONPATH=. python test/bench_sayory.py [questions] [workers] [token_delay_ms]
+"""
+import asyncio
+import json
+import statistics
+import sys
+import time
+from uuid import uuid4
+
+from app.AI.sayory_worker import SayoryWorker
+from app.cache.cache import sayory_responses
+from fake_openai import FakeCompletionServer
+
+
+class OfflineWorker(SayoryWorker):
+    async def load_context(self, job):
+        return []
+
+
+class TimingManager:
+    def __init__(self):
+        self.submitted = {}
+        self.first = {}
+        self.done = {}
+
+    async def send_to(self, user_id, recipient_id, message_json, delivered_at=None):
+        frame = json.loads(message_json)
+        kind = next(iter(frame))
+        self.first.setdefault((user_id, kind), time.perf_counter())
+
+    async def send_private_all(self, receiver_id, **message):
+        self.done[receiver_id] = time.perf_counter()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (f"p50 {statistics.median(samples) * 1000:7.1f} ms  "
+            f"p95 {samples[int(len(samples) * 0.95) - 1] * 1000:7.1f} ms")
+
+
+async def ask_all(worker, manager, users, sayory):
+    start = time.perf_counter()
+    for i, user in enumerate(users):
+        manager.submitted[user] = time.perf_counter()
+        worker.submit(user, sayory, f"question {i}")
+    handler_free = time.perf_counter() - start
+    await worker.queue.join()
+    return handler_free, time.perf_counter() - start
+
+
+def report(label, manager, users, handler_free, elapsed):
+    def since_submit(kind):
+        return [manager.first[(user, kind)] - manager.submitted[user] for user in users]
+
+    print(f"{label}: submit returned to the handlers in {handler_free * 1000:.2f} ms total")
+    print(f"  typing      {percentiles(since_submit('typing'))}")
+    print(f"  first delta {percentiles(since_submit('delta'))}")
+    print(f"  persisted   {percentiles([manager.done[user] - manager.submitted[user] for user in users])}")
+    print(f"  {len(users) / elapsed:.1f} answers/s")
+
+
+async def main(questions: int, workers: int, token_delay_ms: int):
+    reply = " ".join(f"token{i}" for i in range(40))
+    sayory_responses.clear()
+    async with FakeCompletionServer(reply=reply, first_token_delay=0.2,
+                                    token_delay=token_delay_ms / 1000) as server:
+        print(f"{questions} questions, {workers} workers, {len(reply.split())} tokens each")
+        sayory = uuid4()
+        for label in ("model", "cached"):
+            manager = TimingManager()
+            worker = OfflineWorker(manager, workers=workers, queue_size=questions,
+                                   rate_limit=questions, client=server.client())
+            users = [uuid4() for _ in range(questions)]
+            handler_free, elapsed = await ask_all(worker, manager, users, sayory)
+            await worker.stop()
+            report(label, manager, users, handler_free, elapsed)
+        print(f"max {server.max_in_flight} completions in flight, {len(server.requests)} requests to the model")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [64, 8, 10][len(args):])))
@@ -0,0 +1,90 @@
+"""
+Concurrency benchmark for process_vote.
+
+Creates throw-away users and messages in the configured database, fires
+every toggle at once from separate sessions, checks that each
+`vote_count` matches both the votes table and the expected parity of
+toggles, then deletes what it created. Run from the repository root with
+the usual `.env` in place:
+
+    PYTHONPATH=. python test/bench_votes.py [voters] [messages] [toggles_per_pair]
+"""
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+from uuid import uuid4
+
+from sqlalchemy import delete, func, insert, select
+
+from app.database.database import async_session_maker, engine_async
+from app.functions.func_private import process_vote
+from app.models import models
+from app.schemas import schemas
+from app.settings.config import settings
+
+
+async def create_fixture(voters: int, messages: int):
+    tag = uuid4().hex[:8]
+    users = [dict(id=uuid4(), email=f"bench-{tag}-{i}@example.invalid", user_name=f"bench-{tag}-{i}",
+                  password="x", avatar="x") for i in range(voters)]
+    rows = [dict(id=uuid4(), sender_id=users[0]["id"], receiver_id=users[-1]["id"], message=None)
+            for _ in range(messages)]
+    async with async_session_maker() as session:
+        await session.execute(insert(models.User), users)
+        await session.execute(insert(models.PrivateMessage), rows)
+        await session.commit()
+    return [user["id"] for user in users], [row["id"] for row in rows]
+
+
+async def vote(user_id, message_id, semaphore):
+    async with semaphore:
+        async with async_session_maker() as session:
+            await process_vote(schemas.Vote(message_id=message_id, dir=1), session,
+                               SimpleNamespace(id=user_id))
+
+
+async def main(voters: int, messages: int, toggles: int):
+    user_ids, message_ids = await create_fixture(voters, messages)
+    try:
+        plan = [(user_id, message_id)
+                for user_id in user_ids
+                for message_id in message_ids
+                for _ in range(random.randint(1, toggles))]
+        random.shuffle(plan)
+        expected = Counter()
+        for (user_id, message_id), toggled in Counter(plan).items():
+            expected[message_id] += toggled % 2
+
+        # Bounded by the pool so the benchmark measures votes, not checkout timeouts
+        semaphore = asyncio.Semaphore(settings.db_pool_size + settings.db_max_overflow)
+        start = time.perf_counter()
+        await asyncio.gather(*(vote(user_id, message_id, semaphore) for user_id, message_id in plan))
+        elapsed = time.perf_counter() - start
+        print(f"{len(plan)} votes in {elapsed:.2f}s: {len(plan) / elapsed:.0f} votes/s")
+
+        async with async_session_maker() as session:
+            counts = dict((await session.execute(
+                select(models.PrivateMessage.id, models.PrivateMessage.vote_count)
+                .where(models.PrivateMessage.id.in_(message_ids))
+            )).all())
+            actual = dict((await session.execute(
+                select(models.PrivateMessageVote.message_id, func.sum(models.PrivateMessageVote.dir))
+                .where(models.PrivateMessageVote.message_id.in_(message_ids))
+                .group_by(models.PrivateMessageVote.message_id)
+            )).all())
+        for message_id in message_ids:
+            assert counts[message_id] == actual.get(message_id, 0) == expected[message_id], message_id
+        print("final counts match the votes table and the expected toggles")
+    finally:
+        async with async_session_maker() as session:
+            await session.execute(delete(models.User).where(models.User.id.in_(user_ids)))
+            await session.commit()
+        await engine_async.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [50, 20, 3][len(args):])))
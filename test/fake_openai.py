@@ -0,0 +1,78 @@
+"""
+A local stand-in for the OpenAI chat completions API, for offline tests and benchmarks.
+
+Serves `POST /v1/chat/completions` with `stream=True` as server-sent events:
+the reply is split into `tokens` chunks sent `token_delay` seconds apart,
+after an initial `first_token_delay`. Tracks how many completions are in
+flight so tests can check concurrency limits.
+"""
+import asyncio
+import json
+import time
+
+
+class FakeCompletionServer:
+    def __init__(self, reply: str = "Hello from Sayory", first_token_delay: float = 0.0,
+                 token_delay: float = 0.0):
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    def client(self):
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key="test", base_url=self.base_url, max_retries=0)
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        headers = {}
+        await reader.readline()
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = json.loads(await reader.readexactly(int(headers.get("content-length", 0))))
+        self.requests.append(body)
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+            await asyncio.sleep(self.first_token_delay)
+            for i, token in enumerate(self.reply.split(" ")):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                    token = " " + token
+                writer.write(self._event(token))
+                await writer.drain()
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+        finally:
+            self.in_flight -= 1
+            writer.close()
+
+    @staticmethod
+    def _event(content: str) -> bytes:
+        chunk = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+        }
+        return f"data: {json.dumps(chunk)}\n\n".encode()
@@ -0,0 +1,72 @@
+from app.cache.cache import MISSING, TTLCache
+
+
+def test_lru_eviction_and_counters():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", None)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 1,
+                             "evictions": 1, "expirations": 0}
+
+
+def test_none_is_cached_and_invalidate_drops_entry():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("deleted", None)
+    assert cache.get("deleted") is None
+
+    cache.invalidate("deleted")
+    assert cache.get("deleted") is MISSING
+
+
+def test_expired_entries_are_misses():
+    cache = TTLCache(maxsize=10, ttl=-1)
+    cache.set("a", 1)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_decrypted_bodies_follow_the_ciphertext():
+    import asyncio
+    from types import SimpleNamespace
+    from uuid import uuid4
+
+    from app.cache.cache import decrypted_messages
+    from app.functions.func_private import decrypt_bodies
+    from app.security.crypto_messages import encrypt
+
+    async def scenario():
+        private = SimpleNamespace(id=uuid4(), message=encrypt("first"))
+        assert await decrypt_bodies([private]) == ["first"]
+
+        # An edit on another worker only changes the row
+        private.message = encrypt("edited")
+        assert await decrypt_bodies([private]) == ["edited"]
+
+        private.message = None
+        assert await decrypt_bodies([private]) == [None]
+        decrypted_messages.clear()
+
+    asyncio.run(scenario())
+
+
+def test_named_caches_are_exported():
+    from prometheus_client import REGISTRY
+
+    cache = TTLCache(maxsize=1, ttl=60, name='exported')
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("b")
+    cache.get("a")
+
+    def sample(name):
+        return REGISTRY.get_sample_value(name, {"cache": "exported"})
+
+    assert (sample('cache_hits_total'), sample('cache_misses_total')) == (1, 1)
+    assert sample('cache_evictions_total') == 1
+    assert (sample('cache_size'), sample('cache_maxsize')) == (1, 1)
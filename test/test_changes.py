@@ -0,0 +1,22 @@
+import json
+from uuid import uuid4
+
+from app.functions.func_changes import number_changes
+from app.schemas import frames
+from test_frames import make_message
+
+
+def test_changes_are_numbered_per_conversation_in_order():
+    a, b = uuid4(), uuid4()
+    # Counters after reserving three changes in a and one in b
+    assert number_changes([a, b, a, a], {a: 12, b: 1}) == [10, 1, 11, 12]
+
+
+def test_change_frames_carry_their_seq():
+    message = make_message("hi")
+    assert json.loads(frames.message_frame(message, 7))["seq"] == 7
+    assert json.loads(frames.update_frame(message, 8)) == {"update": json.loads(frames.encode_message(message)),
+                                                           "seq": 8}
+    assert "seq" not in json.loads(frames.message_frame(message))
+    assert json.loads(frames.deleted_frame(message.id, 9)) == {"deleted": {"id": str(message.id)}, "seq": 9}
+    assert json.loads(frames.sync_frame(10)) == {"sync": {"seq": 10}}
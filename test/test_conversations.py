@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from app.functions.func_conversations import summary_rows
+
+
+def test_summary_rows_collapse_a_batch_per_conversation_side():
+    alice, bob = uuid4(), uuid4()
+    start = datetime.now(timezone.utc)
+    first, second, reply, note = uuid4(), uuid4(), uuid4(), uuid4()
+    rows = summary_rows([
+        (alice, bob, first, start),
+        (alice, bob, second, start + timedelta(seconds=2)),
+        (bob, alice, reply, start + timedelta(seconds=1)),
+        (alice, alice, note, start),
+    ])
+    by_key = {(row['user_id'], row['peer_id']): row for row in rows}
+
+    assert len(rows) == 3
+    # Bob has not read Alice's two messages; Alice has not read Bob's reply
+    assert by_key[(bob, alice)]['unread_count'] == 2
+    assert by_key[(alice, bob)]['unread_count'] == 1
+    assert by_key[(alice, bob)]['last_message_id'] == by_key[(bob, alice)]['last_message_id'] == second
+    assert by_key[(alice, alice)]['unread_count'] == 0
+    # Locked in key order by every writer
+    assert rows == sorted(rows, key=lambda row: (str(row['user_id']), str(row['peer_id'])))
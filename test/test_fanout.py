@@ -0,0 +1,165 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from app.connect.connection_manager import ConnectionManagerPrivate
+from app.connect.fanout import (NOTIFY_PAYLOAD_LIMIT, InProcessFanout, LocalBroker, PostgresFanout,
+                                notify_chunks)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+
+async def drain(*workers):
+    for worker in workers:
+        for queues in worker.active_connections.values():
+            for outbound in queues:
+                await outbound.drain()
+
+
+def make_workers(count: int):
+    # One shared broker stands in for Postgres between worker processes
+    broker = LocalBroker()
+    return [ConnectionManagerPrivate(backend=InProcessFanout(broker)) for _ in range(count)]
+
+
+def test_fan_out_reaches_sockets_on_other_workers():
+    async def scenario():
+        worker_a, worker_b, worker_c = make_workers(3)
+        alice, bob = uuid4(), uuid4()
+        alice_socket, bob_socket = FakeWebSocket(), FakeWebSocket()
+
+        await worker_a.connect(alice_socket, alice, bob)
+        await worker_b.connect(bob_socket, bob, alice)
+
+        frame = json.dumps({"message": {"text": "hi"}})
+        created_at = datetime.now(timezone.utc)
+        await worker_c.fan_out(alice, bob, frame, created_at)
+        await drain(worker_a, worker_b)
+
+        assert alice_socket.sent == [frame]
+        assert bob_socket.sent == [frame]
+        # Only the worker holding the recipient's socket records the read receipt
+        assert worker_b.read_receipts.pending == {(bob, alice): created_at}
+        assert worker_a.read_receipts.pending == {}
+
+        for worker in (worker_a, worker_b, worker_c):
+            worker.read_receipts.pending.clear()
+            await worker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_unsubscribes_user_channel():
+    async def scenario():
+        worker_a, worker_b = make_workers(2)
+        alice, bob, carol = uuid4(), uuid4(), uuid4()
+        to_bob, to_carol = FakeWebSocket(), FakeWebSocket()
+
+        bob_queue = await worker_a.connect(to_bob, alice, bob)
+        carol_queue = await worker_a.connect(to_carol, alice, carol)
+        await worker_a.disconnect(alice, bob_queue)
+        assert worker_a.backend.broker.channels
+
+        await worker_b.send_to(alice, carol, "still-open")
+        await worker_b.send_to(alice, bob, "closed")
+        await drain(worker_a)
+        assert to_carol.sent == ["still-open"]
+        assert to_bob.sent == []
+
+        assert worker_a.is_online(alice)
+        assert worker_a.is_online(alice, carol)
+        assert not worker_a.is_online(alice, bob)
+
+        await worker_a.disconnect(alice, carol_queue)
+        assert worker_a.backend.broker.channels == {}
+        assert not worker_a.is_online(alice)
+
+        for worker in (worker_a, worker_b):
+            await worker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_every_device_on_a_conversation_gets_the_frame():
+    async def scenario():
+        worker_a, worker_b = make_workers(2)
+        alice, bob = uuid4(), uuid4()
+        phone, laptop, tablet = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+
+        phone_queue = await worker_a.connect(phone, alice, bob)
+        await worker_a.connect(laptop, alice, bob)
+        await worker_b.connect(tablet, alice, bob)
+
+        await worker_a.send_to(alice, bob, "to-all")
+        await drain(worker_a, worker_b)
+        assert phone.sent == laptop.sent == tablet.sent == ["to-all"]
+
+        # Disconnecting one device leaves the others, and is idempotent
+        await worker_a.disconnect(alice, phone_queue)
+        await worker_a.disconnect(alice, phone_queue)
+        await worker_a.send_to(alice, bob, "after")
+        await drain(worker_a, worker_b)
+        assert phone.sent == ["to-all"]
+        assert laptop.sent == tablet.sent == ["to-all", "after"]
+        assert worker_a.is_online(alice, bob)
+
+        for worker in (worker_a, worker_b):
+            await worker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_multiplexed_socket_gets_frames_tagged_by_conversation():
+    async def scenario():
+        worker_a, worker_b = make_workers(2)
+        alice, bob, carol = uuid4(), uuid4(), uuid4()
+        socket = FakeWebSocket()
+
+        outbound = await worker_a.connect(socket, alice, multiplexed=True)
+        worker_a.subscribe(alice, bob, outbound)
+        worker_a.subscribe(alice, carol, outbound)
+
+        await worker_b.send_to(alice, bob, json.dumps({"message": {"text": "from bob"}}))
+        await worker_b.send_to(alice, carol, json.dumps({"message": {"text": "from carol"}}))
+        await drain(worker_a)
+        assert [json.loads(frame) for frame in socket.sent] == [
+            {"conversation_id": str(bob), "message": {"text": "from bob"}},
+            {"conversation_id": str(carol), "message": {"text": "from carol"}},
+        ]
+
+        worker_a.unsubscribe(alice, bob, outbound)
+        assert not worker_a.is_online(alice, bob)
+        assert worker_a.is_online(alice, carol)
+
+        await worker_a.disconnect(alice, outbound)
+        assert worker_a.active_connections == {}
+        assert not worker_a.is_online(alice)
+
+        for worker in (worker_a, worker_b):
+            await worker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_large_payloads_are_split_and_joined():
+    payload = f"{uuid4()}\n\n" + json.dumps({"message": {"text": "привіт " * 3000}}, ensure_ascii=False)
+    chunks = notify_chunks(payload)
+    assert len(chunks) > 1
+    assert all(len(chunk.encode('utf-8')) <= NOTIFY_PAYLOAD_LIMIT for chunk in chunks)
+    assert notify_chunks("small") == ["small"]
+
+    backend = PostgresFanout("postgresql://unused", engine=None)
+    joined = [backend._join(42, chunk) for chunk in reversed(chunks)]
+    assert joined[:-1] == [None] * (len(chunks) - 1)
+    assert joined[-1] == payload
+    assert backend._parts == {}
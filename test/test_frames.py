@@ -0,0 +1,57 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from app.functions.func_private import fetch_reply_previews
+from app.schemas import frames, schemas
+from app.settings.config import settings
+
+
+def make_message(text: str) -> schemas.ChatMessagesSchema:
+    return schemas.ChatMessagesSchema(created_at=datetime.now(timezone.utc), id=uuid4(),
+                                      receiver_id=uuid4(), message=text, vote=0,
+                                      edited=False, deleted=False, is_read=True)
+
+
+def test_message_frame_matches_wrapped_model():
+    message = make_message("hi")
+    assert frames.message_frame(message) == schemas.WrappedSocketMessage(message=message).model_dump_json()
+    assert frames.update_frame(message) == schemas.WrappedUpdateMessage(update=message).model_dump_json()
+
+
+def test_messages_frames_are_size_capped_and_ordered():
+    messages = [make_message("x" * 100) for _ in range(20)]
+    one_message = len(frames.messages_frames(messages[:1])[0])
+
+    batched = frames.messages_frames(messages, max_bytes=one_message * 5)
+    assert all(len(frame.encode('utf-8')) <= one_message * 5 for frame in batched)
+    received = [item["id"] for frame in batched for item in json.loads(frame)["messages"]]
+    assert received == [str(message.id) for message in messages]
+
+    # A cap below one message still sends it, alone
+    assert len(frames.messages_frames(messages[:3], max_bytes=10)) == 3
+    assert frames.messages_frames([]) == []
+
+
+def test_messages_frames_carry_each_sender_and_quote_once():
+    first, second = make_message("hi"), make_message("hello")
+    replies = [make_message(f"re {i}") for i in range(3)]
+    for reply in replies:
+        reply.receiver_id, reply.id_return = first.receiver_id, second.id
+    preview = schemas.ReplyPreview(id=second.id, sender_id=second.receiver_id, message="hello")
+
+    frame, = frames.messages_frames([first, second, *replies], replies={second.id: preview})
+    decoded = json.loads(frame)
+    assert "avatar" not in decoded["messages"][0]
+    assert set(decoded["users"]) == {str(first.receiver_id), str(second.receiver_id)}
+    assert decoded["users"][str(first.receiver_id)]["user_name"] == first.user_name
+    assert decoded["replies"] == {str(second.id): json.loads(preview.model_dump_json())}
+
+
+def test_reply_previews_of_the_same_page_need_no_query():
+    quoted, reply = make_message("x" * 500), make_message("re")
+    reply.id_return = quoted.id
+    previews = asyncio.run(fetch_reply_previews([quoted, reply], session=None))
+    assert previews[quoted.id].message == "x" * settings.reply_preview_length + "…"
+    assert previews[quoted.id].sender_id == quoted.receiver_id
@@ -0,0 +1,31 @@
+import asyncio
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from app.functions.func_private import fetch_last_private_messages
+
+
+class RecordingSession:
+    # Captures the SQL of each statement and returns no rows
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(str(statement.compile(dialect=postgresql.dialect())))
+        return self
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+def test_notes_to_self_read_a_single_direction():
+    user, peer = uuid4(), uuid4()
+    for receiver, branches in ((user, 1), (peer, 2)):
+        session = RecordingSession()
+        assert asyncio.run(fetch_last_private_messages(user, receiver, session, limit=10)) == []
+        history, = session.statements
+        assert history.count("UNION ALL") == branches - 1
@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from app.database.ids import conversation_key, uuid7, uuid7_time
+from app.schemas import schemas
+
+
+def test_uuid7_is_monotonic_within_the_process():
+    ids = [uuid7() for _ in range(20_000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert {value.version for value in ids} == {7}
+
+
+def test_uuid7_encodes_its_time():
+    at = datetime(2024, 5, 1, 12, 30, 15, 250_000, tzinfo=timezone.utc)
+    assert uuid7_time(uuid7(at)) == at
+    assert uuid7(at) < uuid7()
+    assert uuid7_time(uuid4()) is None
+
+
+def test_conversation_key_is_shared_by_both_directions():
+    a, b = uuid4(), uuid4()
+    assert conversation_key(a, b) == conversation_key(b, a) == conversation_key(str(b), a)
+    assert conversation_key(a, b) != conversation_key(a, uuid4())
+
+
+def test_message_schemas_accept_uuid7_ids():
+    message_id = uuid7()
+    message = schemas.ChatMessagesSchema(created_at=datetime.now(timezone.utc), id=message_id, vote=0,
+                                         edited=False, deleted=False, is_read=True, id_return=uuid7())
+    assert message.id == message_id
+    assert schemas.Vote(message_id=str(message_id), dir=1).message_id == message_id
@@ -0,0 +1,126 @@
+import asyncio
+from uuid import uuid4
+
+from app.functions.fcm_sent_message import (FAILED, INVALID_TOKEN, SENT, NotificationDispatcher,
+                                            truncate_body)
+
+
+class FakeTransport:
+    """Stands in for FCM: records every send_each batch and rejects chosen tokens."""
+
+    def __init__(self, invalid=(), failing=()):
+        self.invalid = set(invalid)
+        self.failing = set(failing)
+        self.batches = []
+
+    def send_each(self, pushes):
+        self.batches.append(list(pushes))
+        return [INVALID_TOKEN if push.token in self.invalid
+                else FAILED if push.token in self.failing
+                else SENT
+                for push in pushes]
+
+
+class InMemoryDispatcher(NotificationDispatcher):
+    def __init__(self, tokens, **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = tokens
+        self.token_queries = 0
+        self.pruned = []
+        # (recipient, sender) conversations open on some worker
+        self.online = set()
+
+    async def _load_online(self, keys):
+        return {key for key in keys if key in self.online}
+
+    async def _load_tokens(self, recipient_ids):
+        self.token_queries += 1
+        return {user_id: self.tokens[user_id] for user_id in recipient_ids if user_id in self.tokens}
+
+    async def _prune_tokens(self, fcm_tokens):
+        self.pruned.extend(fcm_tokens)
+
+
+def test_burst_to_one_recipient_is_coalesced_into_one_push():
+    async def scenario():
+        alice, bob = uuid4(), uuid4()
+        transport = FakeTransport()
+        dispatcher = InMemoryDispatcher({bob: ["phone"]}, transport=transport, coalesce_window=0.05)
+
+        for text in ("one", "two", "three"):
+            dispatcher.notify(bob, alice, "alice", text)
+        await dispatcher.queue.join()
+        await dispatcher.stop()
+
+        assert len(transport.batches) == 1
+        [push] = transport.batches[0]
+        assert (push.token, push.title, push.body) == ("phone", "alice", "one\ntwo\nthree")
+
+    asyncio.run(scenario())
+
+
+def test_recipients_are_batched_and_invalid_tokens_pruned():
+    async def scenario():
+        alice, users = uuid4(), [uuid4() for _ in range(3)]
+        tokens = {user_id: [f"{user_id}-a", f"{user_id}-b"] for user_id in users}
+        transport = FakeTransport(invalid={f"{users[0]}-b"}, failing={f"{users[1]}-a"})
+        dispatcher = InMemoryDispatcher(tokens, transport=transport, workers=1,
+                                        coalesce_window=0.05, batch_size=4)
+
+        for user_id in users:
+            dispatcher.notify(user_id, alice, "alice", "hi")
+        await dispatcher.queue.join()
+        await dispatcher.stop()
+
+        assert dispatcher.token_queries == 1
+        assert [len(batch) for batch in transport.batches] == [4, 2]
+        assert dispatcher.pruned == [f"{users[0]}-b"]
+
+    asyncio.run(scenario())
+
+
+def test_recipient_not_yet_due_keeps_coalescing():
+    async def scenario():
+        alice, bob, carol = uuid4(), uuid4(), uuid4()
+        transport = FakeTransport()
+        dispatcher = InMemoryDispatcher({bob: ["bob"], carol: ["carol"]}, transport=transport,
+                                        workers=1, coalesce_window=0.1)
+
+        dispatcher.notify(bob, alice, "alice", "x")
+        await asyncio.sleep(0.05)
+        dispatcher.notify(carol, alice, "alice", "one")
+        # Bob's push goes out while Carol's window is still open
+        await asyncio.sleep(0.07)
+        dispatcher.notify(carol, alice, "alice", "two")
+        await dispatcher.queue.join()
+        await dispatcher.stop()
+
+        assert [[(push.token, push.body) for push in batch] for batch in transport.batches] == [
+            [("bob", "x")], [("carol", "one\ntwo")]]
+
+    asyncio.run(scenario())
+
+
+def test_recipients_online_on_another_worker_get_no_push():
+    async def scenario():
+        alice, bob, carol = uuid4(), uuid4(), uuid4()
+        transport = FakeTransport()
+        dispatcher = InMemoryDispatcher({bob: ["bob"], carol: ["carol"]}, transport=transport,
+                                        workers=1, coalesce_window=0.01)
+        dispatcher.online = {(bob, alice)}
+
+        dispatcher.notify(bob, alice, "alice", "hi")
+        dispatcher.notify(carol, alice, "alice", "hi")
+        await dispatcher.queue.join()
+        await dispatcher.stop()
+
+        assert [push.token for batch in transport.batches for push in batch] == ["carol"]
+
+    asyncio.run(scenario())
+
+
+def test_long_bodies_are_truncated_on_character_boundaries():
+    body = truncate_body("ї" * 3000, max_bytes=101)
+    assert len(body.encode('utf-8')) <= 101
+    assert body.endswith("…")
+    assert truncate_body("short", max_bytes=101) == "short"
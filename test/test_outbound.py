@@ -0,0 +1,96 @@
+import asyncio
+
+from app.connect.outbound import OutboundQueue
+
+
+class SlowWebSocket:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, data: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def test_full_queue_drops_oldest_or_newest():
+    async def scenario():
+        for policy, expected in (("drop_oldest", ["2", "3"]), ("drop_newest", ["0", "1"])):
+            websocket = SlowWebSocket()
+            outbound = OutboundQueue(websocket, maxsize=2, policy=policy)
+            # Nothing is written until the writer starts, so the queue fills up
+            results = [outbound.offer(str(i)) for i in range(4)]
+            assert results == ([True] * 4 if policy == "drop_oldest" else [True, True, False, False])
+            outbound.start()
+            await outbound.drain()
+            assert websocket.sent == expected
+            await outbound.close()
+
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_is_evicted_without_blocking_the_sender():
+    async def scenario():
+        evicted = []
+
+        async def on_evict(queue):
+            evicted.append(queue)
+
+        websocket = SlowWebSocket(delay=1)
+        outbound = OutboundQueue(websocket, on_evict=on_evict, maxsize=4, send_timeout=0.05, policy="close")
+        outbound.start()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(3):
+            assert outbound.offer(str(i))
+        assert loop.time() - started < 0.05
+
+        await asyncio.sleep(0.2)
+        assert evicted == [outbound]
+        assert websocket.closed_with == 1013
+        assert not outbound.offer("late")
+
+    asyncio.run(scenario())
+
+
+def test_on_sent_runs_only_for_written_frames():
+    async def scenario():
+        written = []
+        websocket = SlowWebSocket()
+        outbound = OutboundQueue(websocket, maxsize=1, policy="drop_oldest")
+        outbound.offer("dropped", lambda: written.append("dropped"))
+        outbound.offer("kept", lambda: written.append("kept"))
+        outbound.start()
+        await outbound.drain()
+        assert websocket.sent == ["kept"]
+        assert written == ["kept"]
+        await outbound.close()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_schedules_one_eviction():
+    async def scenario():
+        evicted = []
+
+        async def on_evict(queue):
+            evicted.append(queue)
+
+        websocket = SlowWebSocket()
+        outbound = OutboundQueue(websocket, on_evict=on_evict, maxsize=1, policy="close")
+        assert outbound.offer("0")
+        assert not outbound.offer("1")
+        evicting = outbound._evicting
+        assert not outbound.offer("2")
+        assert outbound._evicting is evicting
+
+        await evicting
+        assert evicted == [outbound]
+        assert websocket.closed_with == 1013
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+import asyncio
+import json
+from uuid import uuid4
+
+from app.AI.sayory_worker import SayoryWorker
+from app.cache.cache import sayory_responses
+from fake_openai import FakeCompletionServer
+
+
+class OfflineWorker(SayoryWorker):
+    # No database: every question is asked without earlier turns
+    async def load_context(self, job):
+        return []
+
+
+class ConversationWorker(SayoryWorker):
+    # Every question follows an earlier turn, as in a running conversation
+    async def load_context(self, job):
+        return [{"role": "user", "content": "Мене звати Олег"},
+                {"role": "assistant", "content": "Приємно познайомитись"}]
+
+
+class RecordingManager:
+    def __init__(self):
+        self.frames = []
+        self.persisted = []
+
+    async def send_to(self, user_id, recipient_id, message_json, delivered_at=None):
+        self.frames.append((user_id, json.loads(message_json)))
+
+    async def send_private_all(self, **message):
+        self.persisted.append(message)
+
+
+def test_answer_is_streamed_then_persisted_once():
+    async def scenario():
+        sayory_responses.clear()
+        async with FakeCompletionServer(reply="Привіт, я Sayory") as server:
+            manager = RecordingManager()
+            worker = OfflineWorker(manager, workers=1, client=server.client())
+            user, sayory, question = uuid4(), uuid4(), uuid4()
+
+            assert worker.submit(user, sayory, "hi", question)
+            await worker.queue.join()
+            await worker.stop()
+
+        kinds = [next(iter(frame)) for _, frame in manager.frames]
+        assert kinds == ["typing", "delta", "delta", "delta"]
+        assert "".join(frame["delta"]["text"] for _, frame in manager.frames[1:]) == "Привіт, я Sayory"
+        assert all(frame[kind]["id_return"] == str(question) for (_, frame), kind in zip(manager.frames, kinds))
+
+        persisted, = manager.persisted
+        assert persisted["message"] == "Привіт, я Sayory"
+        assert (persisted["sender_id"], persisted["receiver_id"]) == (sayory, user)
+        assert server.requests[0]["stream"] is True
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_and_rate_limit_are_bounded():
+    async def scenario():
+        sayory_responses.clear()
+        async with FakeCompletionServer(first_token_delay=0.05) as server:
+            manager = RecordingManager()
+            worker = OfflineWorker(manager, workers=2, rate_limit=2, rate_window=60, client=server.client())
+            sayory = uuid4()
+            users = [uuid4() for _ in range(3)]
+
+            accepted = [worker.submit(user, sayory, f"question {i}") for user in users for i in range(3)]
+            # Two questions per user inside the window
+            assert accepted == [True, True, False] * 3
+
+            await worker.queue.join()
+            await worker.stop()
+
+        assert len(manager.persisted) == 6
+        assert server.max_in_flight == 2
+
+    asyncio.run(scenario())
+
+
+def test_repeated_question_is_answered_from_cache():
+    async def scenario():
+        sayory_responses.clear()
+        async with FakeCompletionServer(reply="Добрий день", first_token_delay=0.05) as server:
+            manager = RecordingManager()
+            worker = OfflineWorker(manager, workers=1, client=server.client())
+            for prompt in ("Привіт!", "  привіт "):
+                assert worker.submit(uuid4(), uuid4(), prompt)
+            await worker.queue.join()
+            await worker.stop()
+
+        assert len(server.requests) == 1
+        assert [message["message"] for message in manager.persisted] == ["Добрий день"] * 2
+
+    asyncio.run(scenario())
+
+
+def test_questions_in_a_conversation_are_not_cached():
+    async def scenario():
+        sayory_responses.clear()
+        async with FakeCompletionServer(reply="Олег") as server:
+            manager = RecordingManager()
+            worker = ConversationWorker(manager, workers=1, client=server.client())
+            for _ in range(2):
+                assert worker.submit(uuid4(), uuid4(), "Як мене звати?")
+            await worker.queue.join()
+            await worker.stop()
+
+        assert len(server.requests) == 2
+        assert len(sayory_responses) == 0
+        assert server.requests[0]["messages"][1]["content"] == "Мене звати Олег"
+
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+import asyncio
+from uuid import uuid4
+
+from test_history import RecordingSession
+
+from app.functions.func_private import recount_votes
+
+
+class RecordingConnection(RecordingSession):
+    rowcount = 0
+
+
+def test_recount_locks_messages_before_counting():
+    connection = RecordingConnection()
+    assert asyncio.run(recount_votes(sorted([uuid4(), uuid4()]), connection)) == 0
+    lock, recount = connection.statements
+    assert lock.endswith("FOR UPDATE")
+    assert "IS DISTINCT FROM" in recount
+    assert asyncio.run(recount_votes([], RecordingConnection())) == 0
+
+
+def test_vote_that_changes_nothing_is_not_logged():
+    from types import SimpleNamespace
+
+    from app.functions.func_private import process_vote
+    from app.schemas import schemas
+
+    class VoteSession(RecordingSession):
+        def first(self):
+            return SimpleNamespace(id=uuid4(), sender_id=uuid4(), receiver_id=uuid4(), votes_changed=0)
+
+        async def commit(self):
+            pass
+
+    session = VoteSession()
+    message, seq = asyncio.run(process_vote(schemas.Vote(message_id=uuid4(), dir=0), session,
+                                            SimpleNamespace(id=uuid4())))
+    assert seq is None
+    # Only the toggle ran: no change log entry and no sequence bump
+    assert len(session.statements) == 1